@@ -7,8 +7,6 @@ import numpy as np
 import pandas as pd
 import argparse
 
-import skbio.diversity.alpha as alph
-
 from scipy.stats import ranksums, ttest_ind
 from scipy.stats.mstats import kruskalwallis
 from statsmodels.sandbox.stats.multicomp import multipletests
@@ -19,55 +17,76 @@ src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
 from FileIO import get_dataset_ids, read_dataset_files
 from util import raw2abun
+from Profiling import profile_script, profile_dataset, finish_dataset
 
 
-def get_all_pvals(df, groupcol, valuecol, method='kruskalwallis'):
+def get_pfun(method='kruskalwallis'):
     """
-    Returns pairwise p-values between all groups in the column `groupcol`.
+    Returns the function which calculates the p-value between two groups.
 
     Parameters
     ----------
-    df : pandas dataframe
-        tidy dataframe with labels in `groupcol` and values in `valuecol`
-    groupcol, valuecol : str
-        columns in df
     method : str {'kruskalwallis', 'ranksums', 'wilcoxon', 'ttest_ind'}
         statistical method for comparison. Default is 'kruskalwallis'
+    """
+    if method == 'ranksums' or method == 'wilcoxon':
+        return ranksums
+    elif method == 'ttest_ind':
+        return ttest_ind
+    else:
+        return kruskalwallis
+
+def pairwise_pvals(grps, values, pfun):
+    """
+    Returns p-values between all pairs of groups.
+
+    Parameters
+    ----------
+    grps : list
+        group labels. Pairs are compared in this order.
+    values : dict
+        {group label: array of values}
+    pfun : function
+        from get_pfun()
 
     Returns
     -------
     pvals : dict
         dictionary with 'group1_vs_group2' as the keys and p-value as the values
     """
-
     pvals = {}
-
-    ## Get all pairwise combinations
-    grps = list(set(df[groupcol]))
-    for g1 in grps:
-        for g2 in grps[grps.index(g1)+1:]:
+    for i, g1 in enumerate(grps):
+        for g2 in grps[i+1:]:
             if g1 != g2:
-                ## Grab values
-                x = df[df[groupcol] == g1][valuecol]
-                y = df[df[groupcol] == g2][valuecol]
-
-                ## Calculate p value
-                if method == 'ranksums' or method == 'wilcoxon':
-                    pfun = ranksums
-                elif method == 'ttest_ind':
-                    pfun = ttest_ind
-                else:
-                    pfun = kruskalwallis
                 try:
-                    _, p = pfun(x, y)
+                    _, p = pfun(values[g1], values[g2])
                 except:
                     # Should probably have better error handling here...
                     p = np.nan
-
-                ## Store p value
                 pvals[g1 + '_vs_' + g2] = p
     return pvals
 
+def get_all_pvals(df, groupcol, valuecol, method='kruskalwallis'):
+    """
+    Returns pairwise p-values between all groups in the column `groupcol`.
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        tidy dataframe with labels in `groupcol` and values in `valuecol`
+    groupcol, valuecol : str
+        columns in df
+    method : str {'kruskalwallis', 'ranksums', 'wilcoxon', 'ttest_ind'}
+        statistical method for comparison. Default is 'kruskalwallis'
+
+    Returns
+    -------
+    pvals : dict
+        dictionary with 'group1_vs_group2' as the keys and p-value as the values
+    """
+    values = {g: v.values for g, v in df.groupby(groupcol)[valuecol]}
+    return pairwise_pvals(list(set(df[groupcol])), values, get_pfun(method))
+
 def get_layered_pvals(df, groupcol, valuecol, subset_by,
                       pval_method='kruskalwallis'):
     """
@@ -99,6 +118,111 @@ def get_layered_pvals(df, groupcol, valuecol, subset_by,
                                       method=pval_method)
     return pvals
 
+def get_stacked_pvals(df, groupcol, valuecol, layers,
+                      pval_method='kruskalwallis'):
+    """
+    Get pvalues for all pairwise combinations in groupcol, separately for
+    each combination of the values in the layers columns (e.g. for each
+    study and alpha diversity metric).
+
+    The values of every group are pulled out with one groupby, rather than
+    by filtering df once per comparison.
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        tidy dataframe with labels in `groupcol` and values in `valuecol`
+    groupcol, valuecol : str
+        columns in df
+    layers : list of str
+        columns to calculate p-values separately for
+    pval_method : str {'kruskalwallis', 'ranksums', 'wilcoxon', 'ttest_ind'}
+        statistical method for comparison. Default is 'kruskalwallis'
+
+    Returns
+    -------
+    pvals : pandas DataFrame
+        tidy dataframe with the layers columns, 'comparison' (as in
+        get_all_pvals()), and 'p'. Comparisons without a p-value are
+        discarded.
+    """
+    pfun = get_pfun(pval_method)
+    values = {k: v.values for k, v in df.groupby(layers + [groupcol])[valuecol]}
+
+    pvals = []
+    for layer, grpvals in df.groupby(layers)[groupcol]:
+        if not isinstance(layer, tuple):
+            layer = (layer, )
+        grpvalues = {g: values[layer + (g, )] for g in grpvals.unique()}
+        comparisons = pairwise_pvals(list(set(grpvals)), grpvalues, pfun)
+        pvals.extend([layer + (c, p) for c, p in comparisons.items()])
+
+    pvals = pd.DataFrame(pvals, columns=layers + ['comparison', 'p'])
+    return pvals.dropna(subset=['p'])
+
+def alpha_diversities(df):
+    """
+    Calculate the Shannon index, Chao1, and Simpson's index of all samples
+    in df at once.
+
+    These give the same values as skbio's shannon(), chao1(), and simpson()
+    (skbio version 0.4.2, with default parameters) applied to each row.
+    Observed OTUs, singletons, and doubletons (which Chao1 needs) are
+    counted from the non-zero entries only, and Shannon's p*log(p) is only
+    calculated for the non-zero entries.
+
+    Parameters
+    ----------
+    df : pandas DataFrame
+        dataframe with samples in rows, OTUs in columns. Values should be
+        raw counts.
+
+    Returns
+    -------
+    alphas : pandas DataFrame
+        samples in rows and ['shannon', 'chao1', 'simpson', 'observed_otus',
+        'singles', 'doubles'] in columns
+    """
+    counts = np.ascontiguousarray(df.values)
+    n_smpls = counts.shape[0]
+    reads = counts.sum(axis=1)
+
+    # Non-zero entries, in the same row-by-row order as in counts
+    rows, cols = np.nonzero(counts)
+    nz = counts[rows, cols]
+
+    observed = np.bincount(rows, minlength=n_smpls)
+    singles = np.bincount(rows[nz == 1], minlength=n_smpls)
+    doubles = np.bincount(rows[nz == 2], minlength=n_smpls)
+
+    # skbio: -(p*log(p)).sum()/log(2) over each sample's non-zero p's.
+    # Each sample's terms are contiguous in plogp. They're summed with
+    # ndarray.sum() so that the summation order (and so the rounding) is the
+    # same as skbio's.
+    freqs = np.true_divide(nz, reads[rows])
+    plogp = freqs * np.log(freqs)
+    bounds = np.concatenate(([0], np.cumsum(observed)))
+    shannon = np.array([-plogp[i:j].sum()
+                        for i, j in zip(bounds[:-1], bounds[1:])])
+    shannon = shannon / np.log(2)
+    # skbio gives NaN for samples without any reads
+    shannon[reads == 0] = np.nan
+
+    # skbio: o + s*(s - 1)/(2*(d + 1)) (bias-corrected Chao1)
+    chao1 = observed + np.true_divide(singles * (singles - 1),
+                                      2 * (doubles + 1))
+
+    # skbio: 1 - (p*p).sum() over all p's, including zeros
+    freqs = np.true_divide(counts, reads[:, np.newaxis])
+    simpson = 1 - (freqs * freqs).sum(axis=1)
+
+    return pd.DataFrame({'shannon': shannon, 'chao1': chao1,
+                         'simpson': simpson, 'observed_otus': observed,
+                         'singles': singles, 'doubles': doubles},
+                        index=df.index,
+                        columns=['shannon', 'chao1', 'simpson',
+                                 'observed_otus', 'singles', 'doubles'])
+
 def alpha_diversity(df, metric='shannon'):
     """
     Calculate shannon diversity of all samples in df.
@@ -116,24 +240,20 @@ def alpha_diversity(df, metric='shannon'):
         pandas series with samples in rows
     """
 
-    alphafun = alph.shannon
-    if metric == 'chao1':
-        alphafun = alph.chao1
-    elif metric == 'simpson':
-        alphafun = alph.simpson
-    elif metric != 'shannon':
+    if metric not in ['shannon', 'chao1', 'simpson']:
         print('Unknown alpha diversity metric. Doing Shannon Index.')
+        metric = 'shannon'
 
-    return df.apply(alphafun, axis=1)
+    return alpha_diversities(df)[metric]
 
-def make_alpha_df(df, meta, study, metric):
+def make_alpha_df(alpha, meta, study, metric):
     """
     Make the alpha diversity tidy dataframe.
 
     Parameters
     ----------
-    df: pandas DataFrame
-        samples in rows, OTUs in columns
+    alpha : pandas Series
+        alpha diversity of each sample, with samples in the index
     meta : pandas DataFrame
         samples in rows, 'DiseaseState' column
     study : str
@@ -147,55 +267,57 @@ def make_alpha_df(df, meta, study, metric):
         tidy dataframe with ['sample', 'alpha', 'alpha_metric', 'study',
         'DiseaseState'] columns
     """
-    alpha = alpha_diversity(df, metric).reset_index()
-    alpha.columns = ['sample', 'alpha']
+    alpha = alpha.to_frame('alpha')
     alpha['alpha_metric'] = metric
-    alpha['study'] = dataset
-    # Label diseases based on index, which is now in first column
-    alpha['DiseaseState'] = alpha['sample']\
-        .apply(lambda x: meta.loc[x, 'DiseaseState'])
-    return alpha
-
-
-p = argparse.ArgumentParser()
-p.add_argument('datadir', help='directory with clean OTU tables and metadata.')
-p.add_argument('alphas_out', help='out file with all alpha diversities for '
-    + 'all samples')
-p.add_argument('pvals_out', help='out file with all alpha diversity p-values')
-
-args = p.parse_args()
-
-## Data in datadir has already been cleaned up, but not collapsed to genus level
-datadir = args.datadir
-
-datasetids = get_dataset_ids(datadir)
-alphas = []
-
-for dataset in datasetids:
-    print(dataset),
-    ## Read dataset
-    df, meta = read_dataset_files(dataset, datadir)
-
-    for metric in ['shannon', 'chao1', 'simpson']:
-        alpha = make_alpha_df(df, meta, dataset, metric)
-        alphas.append(alpha)
-
-alphasdf = pd.concat(alphas, ignore_index=True)
-
-alphasdf.to_csv(args.alphas_out, sep='\t', index=False)
-
-# Because I'm using the entire OTU table, some of these samples don't have disease metadata.
-# I don't want to compare "NaN" labeled samples with anything because they mean nothing.
-alphasdf = alphasdf.query('DiseaseState != " "').dropna(subset=['DiseaseState'])
-
-pvals = []
-for g, subdf in alphasdf.groupby('alpha_metric'):
-    pval = get_layered_pvals(subdf, 'DiseaseState', 'alpha', 'study')
-    pval = pd.DataFrame.from_dict(pval).stack().reset_index()
-    pval.columns = ['comparison', 'study', 'p']
-    pval['q'] = multipletests(pval['p'])[1]
-    pval['alpha_metric'] = g
-    pvals.append(pval)
-
-pvalsdf = pd.concat(pvals)
-pvalsdf.to_csv(args.pvals_out, sep='\t', index=False)
+    alpha['study'] = study
+    # Label diseases by joining on the sample IDs
+    alpha = alpha.join(meta['DiseaseState'])
+    alpha.index.name = 'sample'
+    return alpha.reset_index()
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument('datadir', help='directory with clean OTU tables and metadata.')
+    p.add_argument('alphas_out', help='out file with all alpha diversities for '
+        + 'all samples')
+    p.add_argument('pvals_out', help='out file with all alpha diversity p-values')
+
+    args = p.parse_args()
+    profile_script()
+
+    ## Data in datadir has already been cleaned up, but not collapsed to genus level
+    datadir = args.datadir
+
+    datasetids = get_dataset_ids(datadir)
+    alphas = []
+
+    for dataset in datasetids:
+        print(dataset),
+        profile_dataset(dataset)
+        ## Read dataset
+        df, meta = read_dataset_files(dataset, datadir)
+
+        # All three metrics are calculated in one pass over the OTU table
+        divs = alpha_diversities(df)
+        for metric in ['shannon', 'chao1', 'simpson']:
+            alpha = make_alpha_df(divs[metric], meta, dataset, metric)
+            alphas.append(alpha)
+    finish_dataset()
+
+    alphasdf = pd.concat(alphas, ignore_index=True)
+
+    alphasdf.to_csv(args.alphas_out, sep='\t', index=False)
+
+    # Because I'm using the entire OTU table, some of these samples don't have disease metadata.
+    # I don't want to compare "NaN" labeled samples with anything because they mean nothing.
+    alphasdf = alphasdf.query('DiseaseState != " "').dropna(subset=['DiseaseState'])
+
+    # All p-values are calculated in one grouped pass, and FDR-corrected
+    # separately for each alpha diversity metric
+    pvalsdf = get_stacked_pvals(alphasdf, 'DiseaseState', 'alpha',
+                                ['alpha_metric', 'study'])
+    pvalsdf = pvalsdf.sort_values(['alpha_metric', 'comparison', 'study'])
+    pvalsdf['q'] = pvalsdf.groupby('alpha_metric')['p']\
+        .transform(lambda p: multipletests(p)[1])
+    pvalsdf = pvalsdf[['comparison', 'study', 'p', 'q', 'alpha_metric']]
+    pvalsdf.to_csv(args.pvals_out, sep='\t', index=False)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+This script calculates the beta diversity (Bray-Curtis and Jaccard
+distances, and weighted and unweighted UniFrac on the phyloT tree) between
+samples on the genus-level relative abundances of the clean OTU tables,
+either within each dataset or between all samples from all datasets pooled
+together.
+
+For each scope and metric it writes the condensed distance matrix (as
+returned by scipy.spatial.distance.pdist) to <scope>.<metric>.npy,
+which can be opened without reading it into memory with
+np.load(fn, mmap_mode='r'). The sample order is in <scope>.samples.txt.
+The scope is the dataset ID, or 'pooled'. <scope>.samples.txt is written
+last (and the Makefile uses pooled.samples.txt as the target), so it only
+exists if all of the scope's distance matrices were written.
+"""
+import argparse
+import pandas as pd
+
+# Add this repo to the path
+import os, sys
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
+sys.path.insert(0, src_dir)
+import FileIO as fio
+from util import raw2abun, collapse_taxonomic_contents_df
+from BetaDiversity import beta_diversity, METRICS
+import UniFrac
+from Profiling import profile_script, profile_dataset, finish_dataset
+
+UNIFRAC_METRICS = {'weighted_unifrac': True, 'unweighted_unifrac': False}
+
+def read_genus_table(dataset, datadir):
+    """
+    Read a clean OTU table and return the genus-level relative abundances.
+    """
+    df, _ = fio.read_dataset_files(dataset, datadir)
+    return collapse_taxonomic_contents_df(raw2abun(df), 'genus')
+
+def write_beta_diversity(df, scope, metrics, outdir, block_size, n_jobs,
+                         tree=None):
+    """
+    Calculate and write the distances between all samples (rows) in df.
+    tree (from UniFrac.read_tree()) is needed for the UniFrac metrics.
+    """
+    fnsamples = os.path.join(outdir, scope + '.samples.txt')
+    # Remove the samples from a previous run, in case this one fails
+    if os.path.exists(fnsamples):
+        os.remove(fnsamples)
+    if any([m in UNIFRAC_METRICS for m in metrics]):
+        keep, genera = UniFrac.match_tree_genera(df.columns, tree)
+        no_reads = UniFrac.samples_without_tree_genera(df.values[:, keep])
+        if len(no_reads) > 0:
+            print('The following samples have no reads in genera in your '
+                  'tree, and their UniFrac distances are NaN:')
+            print('\n'.join([str(i) for i in df.index[no_reads]]))
+    for metric in metrics:
+        fnout = os.path.join(outdir, '{}.{}.npy'.format(scope, metric))
+        if metric in UNIFRAC_METRICS:
+            UniFrac.unifrac(df.values[:, keep], genera, tree, fnout,
+                            weighted=UNIFRAC_METRICS[metric],
+                            block_size=block_size, n_jobs=n_jobs)
+        else:
+            beta_diversity(df.values, metric, fnout, block_size=block_size,
+                           n_jobs=n_jobs)
+    # Write to a temporary file and rename it, so that an interrupted write
+    # doesn't leave a samples file behind either
+    with open(fnsamples + '.tmp', 'w') as f:
+        f.write('\n'.join([str(i) for i in df.index]) + '\n')
+    os.rename(fnsamples + '.tmp', fnsamples)
+
+if __name__ == "__main__":
+    # I need to wrap this code in if name == main to use multiprocessing
+    p = argparse.ArgumentParser()
+    p.add_argument('data_dir', help='path to directory with clean OTU tables')
+    p.add_argument('out_dir', help='directory to write distance matrices to')
+    p.add_argument('--scope', help='"dataset" to calculate distances within '
+        + 'each dataset, "pooled" to calculate distances between all samples '
+        + 'in all datasets (default: %(default)s)',
+        choices=['dataset', 'pooled'], default='dataset')
+    p.add_argument('--metrics', help='beta diversity metrics (default: '
+        + '%(default)s)', nargs='+',
+        choices=sorted(METRICS) + sorted(UNIFRAC_METRICS),
+        default=['braycurtis', 'jaccard'])
+    p.add_argument('--tree', help='newick tree with genus names as tips, '
+        + 'for the UniFrac metrics (e.g. '
+        + 'data/tree/phyloT_tree.updated.newick)', default=None)
+    p.add_argument('--block-size', help='number of samples per block of '
+        + 'distances (default: %(default)s)', default=1024, type=int)
+    p.add_argument('--n-jobs', help='number of processes [default: all CPUs]',
+        default=None, type=int)
+    args = p.parse_args()
+    profile_script()
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    tree = None
+    if any([m in UNIFRAC_METRICS for m in args.metrics]):
+        if args.tree is None:
+            raise ValueError('UniFrac metrics need a --tree')
+        # The tree is flattened once, and used for all tables
+        tree = UniFrac.read_tree(args.tree)
+
+    datasetids = fio.get_dataset_ids(args.data_dir)
+    if args.scope == 'dataset':
+        for dataset in datasetids:
+            print(dataset),
+            profile_dataset(dataset)
+            df = read_genus_table(dataset, args.data_dir)
+            write_beta_diversity(df, dataset, args.metrics, args.out_dir,
+                                 args.block_size, args.n_jobs, tree)
+    else:
+        dfs = []
+        for dataset in datasetids:
+            print(dataset),
+            profile_dataset(dataset)
+            df = read_genus_table(dataset, args.data_dir)
+            # Relabel samples with dataset ID, since sample IDs aren't
+            # unique across datasets
+            df.index = [dataset + '-' + str(i) for i in df.index]
+            dfs.append(df)
+        finish_dataset()
+        # Genera which weren't in a dataset have zero abundance there
+        bigdf = pd.concat(dfs).fillna(0.0)
+        print('\nCalculating distances between {} samples...'.format(
+            bigdf.shape[0]))
+        write_beta_diversity(bigdf, 'pooled', args.metrics, args.out_dir,
+                             args.block_size, args.n_jobs, tree)
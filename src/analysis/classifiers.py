@@ -15,7 +15,10 @@ import os, sys
 src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
 import FileIO as fio
-from util import collapse_taxonomic_contents_df, prep_classifier, cv_and_roc
+import ModelStore as ms
+from util import collapse_taxonomic_contents_df, prep_classifier, cv_and_roc, \
+    rescore_cv
+from Profiling import profile_script, profile_dataset, finish_dataset
 
 def results2df(results, dataset, n_ctrl, n_case, n_features):
     """
@@ -56,6 +59,53 @@ def results2df(results, dataset, n_ctrl, n_case, n_features):
 
     return resultsdf
 
+def classify(df, H_smpls, dis_smpls, dataset, feature_set, args):
+    """
+    Make and cross-validate the RF for one dataset. If a model store is
+    given, re-scores the stored models for this data and parameters
+    instead of re-training them (and stores the models if there aren't any).
+
+    Parameters
+    ----------
+    df : pandas DataFrame
+        samples in rows, features in columns
+    H_smpls, dis_smpls : lists
+        samples in each class
+    dataset : str
+        dataset ID, used to label the stored models
+    feature_set : str
+        'genus' or 'core', used in the model store key
+    args : argparse Namespace
+        with randomstate, profile, and model_store
+
+    Returns
+    -------
+    results : dict
+        results from cv_and_roc function
+    """
+    rf, X, Y = prep_classifier(df, H_smpls, dis_smpls, args.randomstate)
+    if args.model_store is None:
+        return cv_and_roc(rf, X, Y, random_state=args.randomstate,
+                          timing=args.profile)
+
+    data_hash = ms.hash_data(X, Y, [list(H_smpls) + list(dis_smpls),
+                                    list(df.columns)])
+    key = ms.model_key(dataset, data_hash, feature_set, rf.get_params(),
+                       num_cv=5, cv_random_state=args.randomstate)
+    record = ms.load_models(args.model_store, key)
+    if record is not None:
+        print('(from model store)'),
+        return rescore_cv(record['models'], X, Y, record['test_fold'])
+
+    results = cv_and_roc(rf, X, Y, random_state=args.randomstate,
+                         timing=args.profile, keep_models=True)
+    ms.save_models(args.model_store, key,
+                   {'models': results.pop('models'),
+                    'test_fold': results['test_fold'],
+                    'samples': list(H_smpls) + list(dis_smpls),
+                    'features': list(df.columns)})
+    return results
+
 p = argparse.ArgumentParser()
 p.add_argument('datadir', help='directory with clean OTU tables and metadata.')
 p.add_argument('outfile', help='out file with tidy RF results')
@@ -71,7 +121,15 @@ p.add_argument('--subset', help='file with list of dataset IDs that '
     + 'names, and be one per line.', default=None)
 p.add_argument('--split-cases', help='flag to analyze each case type '
     + 'separately.', action='store_true')
+p.add_argument('--profile', help='flag to print how much time each '
+    + 'cross-validation spends in fitting, inference, and metrics.',
+    action='store_true')
+p.add_argument('--model-store', help='directory to save trained classifiers '
+    + 'to. If the classifiers for the same data, features, and parameters '
+    + 'are already there, they are re-scored instead of re-trained.',
+    default=None)
 args = p.parse_args()
+profile_script()
 
 dfdict = fio.read_dfdict_data(args.datadir, subset=args.subset)
 
@@ -79,12 +137,16 @@ dfdict = fio.read_dfdict_data(args.datadir, subset=args.subset)
 if args.core is not None:
     overall = pd.read_csv(args.core, sep='\t', index_col=0)
     core_bugs = overall.dropna().index.tolist()
+    feature_set = 'core'
+else:
+    feature_set = 'genus'
 
 tidyresults = []
 
 ## Classify each dataset
 print('Classifying datasets...')
 for dataset in dfdict.keys():
+    profile_dataset(dataset)
     df = dfdict[dataset]['df']
     meta = dfdict[dataset]['meta']
 
@@ -108,8 +170,8 @@ for dataset in dfdict.keys():
             H_smpls, dis_smpls = fio.get_samples(meta, sub_list)
 
             # Make RF
-            rf, X, Y = prep_classifier(df, H_smpls, dis_smpls, args.randomstate)
-            results = cv_and_roc(rf, X, Y, random_state=args.randomstate)
+            results = classify(df, H_smpls, dis_smpls, newdataset,
+                               feature_set, args)
 
             # Update results
             resultsdf = results2df(results, newdataset,
@@ -121,13 +183,13 @@ for dataset in dfdict.keys():
         classes_list = fio.get_classes(meta, dataset)
         H_smpls, dis_smpls = fio.get_samples(meta, classes_list)
 
-        rf, X, Y = prep_classifier(df, H_smpls, dis_smpls, args.randomstate)
-        results = cv_and_roc(rf, X, Y, random_state=args.randomstate)
+        results = classify(df, H_smpls, dis_smpls, dataset, feature_set, args)
 
         resultsdf = results2df(results, dataset,
                                len(H_smpls), len(dis_smpls), df.shape[1])
 
         tidyresults.append(resultsdf)
+finish_dataset()
 
 tidydf = pd.concat(tidyresults, ignore_index=True)
 tidydf.to_csv(args.outfile, sep='\t', index=False)
@@ -17,6 +17,7 @@ src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
 from FileIO import read_dfdict_data
 from util import collapse_taxonomic_contents_df, cv_and_roc, prep_classifier
+from Profiling import profile_script
 
 
 def run_one_rf((dataset, X, Y, n_est, crit, min_split, min_leaf, random_state)):
@@ -106,6 +107,7 @@ if __name__ == "__main__":
     p.add_argument('--random_state', help='random state seed (default: %(default)s)',
                    default=12345)
     args = p.parse_args()
+    profile_script()
 
     random_state = args.random_state
     ## Test out a few different RF parameters to make sure results are
@@ -16,6 +16,7 @@ import os, sys
 src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
 from util import shuffle_col
+from Profiling import profile_script
 
 def empirical_pval(series1, series2, nreps=1000):
     """
@@ -49,6 +50,9 @@ def empirical_pval(series1, series2, nreps=1000):
         shuffled = pd.concat((shuffled1, shuffled2), axis=1)
         dist.append(sum(shuffled.iloc[:, 0] == shuffled.iloc[:, 1]))
 
+    # As an array, so that dist >= observed is elementwise whatever type
+    # observed is
+    dist = np.array(dist)
     effect = observed - np.mean(dist)
     p = sum(dist >= observed)/float(len(dist))
 
@@ -100,43 +104,45 @@ def concordance(series1, series2, method, nreps=1000):
     else:
         raise ValueError('Unknown concordance method.')
 
-p = argparse.ArgumentParser()
-p.add_argument('qvals', help='path to file with signed qvalues. Datasets '
-    + 'in columns, genera in rows, signed qvalues in values.')
-p.add_argument('--nreps', help='number of shuffles to build empirical null. '
-    + '[default: %(default)s]',
-    default=1000, type=int)
-p.add_argument('fout', help='file to write pvalues to.')
-args = p.parse_args()
-
-# Read in qvalues
-df = pd.read_csv(args.qvals, sep='\t', index_col=0)
-# Rename edd_singh to cdi_singh
-df = df.rename(columns={'edd_singh': 'cdi_singh',
-                        'noncdi_schubert': 'cdi_schubert2'})
-
-# Convert df to effect directions
-# TODO: include different thresholds? Perhaps as an argument to fxn?
-df = np.sign(df).replace(0, np.nan)
-
-methods = ['fisher', 'spearman', 'kendalltau', 'empirical', 'cohen']
-
-# Iterate over all pairwise studies
-allstudies = list(df.columns)
-results = []
-for study1 in allstudies:
-    print(study1)
-    for study2 in allstudies[allstudies.index(study1)+1:]:
-        dis1 = study1.split('_')[0]
-        dis2 = study2.split('_')[0]
-
-        series1 = df[study1]
-        series2 = df[study2]
-
-        for method in methods:
-            measure, p = concordance(series1, series2, method, args.nreps)
-            results.append([dis1, dis2, study1, study2, measure, p, method])
-
-resultsdf = pd.DataFrame(data=results,
-    columns=['dis1', 'dis2', 'study1', 'study2', 'measure', 'p', 'method'])
-resultsdf.to_csv(args.fout, sep='\t', index=False)
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument('qvals', help='path to file with signed qvalues. Datasets '
+        + 'in columns, genera in rows, signed qvalues in values.')
+    p.add_argument('--nreps', help='number of shuffles to build empirical null. '
+        + '[default: %(default)s]',
+        default=1000, type=int)
+    p.add_argument('fout', help='file to write pvalues to.')
+    args = p.parse_args()
+    profile_script()
+
+    # Read in qvalues
+    df = pd.read_csv(args.qvals, sep='\t', index_col=0)
+    # Rename edd_singh to cdi_singh
+    df = df.rename(columns={'edd_singh': 'cdi_singh',
+                            'noncdi_schubert': 'cdi_schubert2'})
+
+    # Convert df to effect directions
+    # TODO: include different thresholds? Perhaps as an argument to fxn?
+    df = np.sign(df).replace(0, np.nan)
+
+    methods = ['fisher', 'spearman', 'kendalltau', 'empirical', 'cohen']
+
+    # Iterate over all pairwise studies
+    allstudies = list(df.columns)
+    results = []
+    for study1 in allstudies:
+        print(study1)
+        for study2 in allstudies[allstudies.index(study1)+1:]:
+            dis1 = study1.split('_')[0]
+            dis2 = study2.split('_')[0]
+
+            series1 = df[study1]
+            series2 = df[study2]
+
+            for method in methods:
+                measure, p = concordance(series1, series2, method, args.nreps)
+                results.append([dis1, dis2, study1, study2, measure, p, method])
+
+    resultsdf = pd.DataFrame(data=results,
+        columns=['dis1', 'dis2', 'study1', 'study2', 'measure', 'p', 'method'])
+    resultsdf.to_csv(args.fout, sep='\t', index=False)
@@ -15,6 +15,7 @@ from scipy.stats import combine_pvalues
 import os, sys
 src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
+from Profiling import profile_script
 
 
 def convert_to_one_tailed(longpvals):
@@ -533,6 +534,7 @@ p.add_argument('dysbiosis_out', help='outfile for tidy file with all of '
 p.add_argument('--qthresh', help='significance threshold [default: '
                + ' %(default)s]', default=0.05)
 args = p.parse_args()
+profile_script()
 
 dfpvals = pd.read_csv(args.qvalues, sep='\t', index_col=0)
 samplesizes = pd.read_csv(args.dataset_info, sep='\t', index_col=0)
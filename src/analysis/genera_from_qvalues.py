@@ -10,6 +10,13 @@ Full taxonomy means with the format k__;p__;...;g__
 import argparse
 import pandas as pd
 
+# Add this repo to the path
+import os, sys
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
+sys.path.insert(0, src_dir)
+from Taxonomy import taxon_name
+from Profiling import profile_script
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
@@ -19,6 +26,7 @@ if __name__ == "__main__":
                         read genera from. Default is "genera.txt."', default='genera.txt')
 
     args = parser.parse_args()
+    profile_script()
     # Write the genera we're gonna want to get from NCBI to genera_outfile
     fnpvals = args.pvalues
     genera_outfile = args.genera_outfile
@@ -29,6 +37,6 @@ if __name__ == "__main__":
     genera = list(allresults.index)
 
     # Get just the genus name (i.e. no g__Genus business, just Genus)
-    genera = [i.split(';')[-1][3:] for i in genera]
+    genera = [taxon_name(i) for i in genera]
     with open(genera_outfile, 'w') as f:
         f.write('\n'.join(genera))
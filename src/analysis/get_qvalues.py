@@ -1,10 +1,16 @@
 #!/usr/bin/env python
 """
 This script calculates q-values for all genera in all datasets.
+
+With --levels, it also (or instead) calculates q-values for taxa collapsed
+to other taxonomic levels, from the same OTU tables. The genus-level
+q-values are written to out_file, and each other level's to out_file with
+the level added before the extension (e.g. qvalues.phylum.txt).
 """
 import os
 import sys
 import argparse
+import multiprocessing
 import numpy as np
 import pandas as pd
 
@@ -13,7 +19,11 @@ src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
 import util
 import FileIO as fio
+from Profiling import profile_script, profile_dataset, finish_dataset, profiled
 
+qthresh = 0.05
+stats_method = 'kruskal-wallis'
+LEVELS = ['kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
 
 def reformat_results(results, col):
     """
@@ -30,20 +40,19 @@ def reformat_results(results, col):
     results[col] = results[col].replace(0, 1e-20)
     return results[col]*np.sign(results['effect'])
 
-def sign_results(results, df, dis_smpls, H_smpls, dataset, col):
+def sign_results(results, H, dis, dataset, col):
     """
-    Convert one results dataframe with p-values for all OTUs in df
+    Convert one results dataframe with p-values for all OTUs
     into two dataframes with 'effect' column calculated using median and mean.
 
     Parameters
     ----------
     results : pandas dataframe
         Dataframe with genera in index and column 'col'
-    df : pandas dataframe
-        Dataframe with genera in columns and samples in index
-    dis, H_smpls : lists
-        Lists of samples in each class.
-        Samples should be in the index of df.
+    H, dis : numpy arrays
+        Abundances of the samples in each class, with samples in rows and
+        genera in columns (in the same order as results.index), as
+        returned by util.group_array()
     dataset : str
         Dataset ID. Used to name the returned Series.
     col : str
@@ -57,114 +66,153 @@ def sign_results(results, df, dis_smpls, H_smpls, dataset, col):
         Positive indicates higher in disease, negatives is higher in healthy.
     """
     # Median results
-    results['effect'] = df.loc[dis_smpls].median() - df.loc[H_smpls].median()
+    results['effect'] = util.effect_from_arrays(dis, H, method='median')
     med_results = reformat_results(results, col)
     med_results.name = dataset
 
     # Mean results
-    results['effect'] = df.loc[dis_smpls].mean() - df.loc[H_smpls].mean()
+    results['effect'] = util.effect_from_arrays(dis, H, method='mean')
     mean_results = reformat_results(results, col)
     mean_results.name = dataset
 
     return med_results, mean_results
 
-parser = argparse.ArgumentParser()
-parser.add_argument('clean_data_dir', help='directory with clean OTU and '
-    + ' metadata tables')
-parser.add_argument('out_file', help='path to write qvalues to')
-parser.add_argument('--subset', help='file with list of dataset IDs that '
-    + 'should be analyzed, if you want to analyze only a subset of the '
-    + 'datasets in clean_data_dir. Dataset IDs should match IDs in file '
-    + 'names, and be one per line.', default=None)
-parser.add_argument('--split-cases', help='flag to analyze each case type '
-    + 'separately.', action='store_true')
-args = parser.parse_args()
-
-qthresh = 0.05
-stats_method = 'kruskal-wallis'
-
-dfdict = fio.read_dfdict_data(args.clean_data_dir, subset=args.subset)
-
-print('Doing univariate tests...')
-resultsdict = {}
+def level_file(out_file, level):
+    """
+    Returns the file to write the q-values at the given taxonomic level to.
+    Genus-level q-values go in out_file.
+    """
+    if level == 'genus':
+        return out_file
+    root, ext = os.path.splitext(out_file)
+    return root + '.' + level + ext
 
-for dataset in dfdict:
-    df = dfdict[dataset]['df']
-    meta = dfdict[dataset]['meta']
+def run_tests(task):
+    """
+    Do the univariate tests for one comparison at one taxonomic level.
 
-    # Collapse to genus level
-    df = util.collapse_taxonomic_contents_df(df, 'genus')
+    Parameters
+    ----------
+    task : tuple
+        (dataset, level, H, dis, columns), where H and dis are the
+        arrays from util.group_array() and columns are the taxa
 
+    Returns
+    -------
+    dataset, level : str
+        same as in task
+    results : pandas dataframe
+        from util.compare_groups_teststat(), with the 'q' column
+    """
+    dataset, level, H, dis, columns = task
+    with profiled('run_tests', dataset):
+        results = util.compare_groups_teststat(
+            H, dis, columns, method=stats_method, multi_comp='fdr')
+    return dataset, level, results
+
+if __name__ == "__main__":
+    # I need to wrap this code in if name == main to use multiprocessing
+    parser = argparse.ArgumentParser()
+    parser.add_argument('clean_data_dir', help='directory with clean OTU and '
+        + ' metadata tables')
+    parser.add_argument('out_file', help='path to write qvalues to')
+    parser.add_argument('--subset', help='file with list of dataset IDs that '
+        + 'should be analyzed, if you want to analyze only a subset of the '
+        + 'datasets in clean_data_dir. Dataset IDs should match IDs in file '
+        + 'names, and be one per line.', default=None)
+    parser.add_argument('--split-cases', help='flag to analyze each case type '
+        + 'separately.', action='store_true')
+    parser.add_argument('--levels', help='taxonomic levels to calculate '
+        + 'q-values at (default: %(default)s)', nargs='+', choices=LEVELS,
+        default=['genus'])
+    parser.add_argument('--n-jobs', help='number of processes to do the '
+        + 'tests with [default: all CPUs]', default=None, type=int)
+    args = parser.parse_args()
+    profile_script()
+
+    dfdict = fio.read_dfdict_data(args.clean_data_dir, subset=args.subset)
+
+    print('Doing univariate tests...')
+    # Each task is one comparison (i.e. dataset or case group) at one level.
+    # The group arrays are kept to sign the results afterward.
+    tasks = []
+
+    for dataset in dfdict:
+        profile_dataset(dataset)
+        df = dfdict[dataset]['df']
+        meta = dfdict[dataset]['meta']
 
-    if args.split_cases:
         # Get samples in each class. Note that the two fio.get_classes
         # functions are basically the same, just with different diseases
         # hard-coded in.
         classes_list = fio.get_classes(meta, dataset)
-
-        # Go through each case group one by one
-        for dis_label in classes_list[1]:
+        if args.split_cases:
+            # The controls are the same for every case group
+            H_smpls, _ = fio.get_samples(meta, [classes_list[0], []])
+            # Go through each case group one by one
             # old dataset = ibd_alm, new dataset = uc_alm
-            newdataset = dis_label.lower() + '_' + dataset.split('_')[1]
-
-            # Get samples
-            sub_list = [classes_list[0], [dis_label]]
-            H_smpls, dis_smpls = fio.get_samples(meta, sub_list)
-
-            # Do some stats. 'results' is a dataframe with two
-            # columns, 'p' and 'test-stat'
-            results = util.compare_otus_teststat(
-                df, H_smpls, dis_smpls, method=stats_method,
-                multi_comp='fdr')
-
-            resultsdict[newdataset] = {
-                 'df': df, 'dis_smpls': dis_smpls,
-                 'H_smpls': H_smpls, 'results': results}
-
+            cases = [(dis_label.lower() + '_' + dataset.split('_')[1],
+                      fio.get_samples(meta, [[], [dis_label]])[1])
+                     for dis_label in classes_list[1]]
+        else:
+            # Just combine all cases together
+            H_smpls, dis_smpls = fio.get_samples(meta, classes_list)
+            cases = [(dataset, dis_smpls)]
+
+        for level in args.levels:
+            # Collapse from the OTU table, so that OTUs which are annotated
+            # at this level but not at lower levels are kept
+            leveldf = util.collapse_taxonomic_contents_df(df, level)
+
+            # Slice each group once, for both the tests and the effects
+            H = util.group_array(leveldf, H_smpls)
+            for newdataset, dis_smpls in cases:
+                dis = util.group_array(leveldf, dis_smpls)
+                tasks.append((newdataset, level, H, dis, leveldf.columns))
+    finish_dataset()
+
+    if args.n_jobs == 1:
+        outputs = map(run_tests, tasks)
     else:
-        classes_list = fio.get_classes(meta, dataset)
-        # Just combine all cases together
-        H_smpls, dis_smpls = fio.get_samples(meta, classes_list)
-
-        # Do some stats. 'results' is a dataframe with two
-        # columns, 'p' and 'test-stat'
-        results = util.compare_otus_teststat(
-            df, H_smpls, dis_smpls, method=stats_method,
-            multi_comp='fdr')
-
-        resultsdict[dataset] = {
-            'df': df, 'meta': meta,
-            'dis_smpls': dis_smpls, 'H_smpls': H_smpls,
-            'results': results}
-
-## Manipulate each dataset's results with values signed
-## according to median and mean effects in dis - H
-med_allresults_lst = []
-mean_allresults_lst = []
-
-for dataset in resultsdict:
-    ## Manipulate the results dataframe
-    # into a df with signed values according to direction of change
-    # Calculates using both mean and median.
-    results = resultsdict[dataset]['results']
-    df = resultsdict[dataset]['df']
-    dis_smpls = resultsdict[dataset]['dis_smpls']
-    H_smpls = resultsdict[dataset]['H_smpls']
-
-    med_results, mean_results = \
-        sign_results(results, df, dis_smpls, H_smpls, dataset, col='q')
-
-    med_allresults_lst.append(med_results)
-    mean_allresults_lst.append(mean_results)
-
-print('Doing univariate tests... Finished')
-
-## Concat list of signed results series into a dataframe with
-## genera in rows, datasets in columns
-med_allresults =  pd.concat(med_allresults_lst, axis=1)
-mean_allresults =  pd.concat(mean_allresults_lst, axis=1)
-
-# Note: I don't ever use the median-based results in the paper, but this
-# is where you could find them.
-#med_allresults.to_csv(medfile, sep='\t')
-mean_allresults.to_csv(args.out_file, sep='\t')
+        pool = multiprocessing.Pool(args.n_jobs)
+        outputs = pool.map(run_tests, tasks)
+        pool.close()
+        pool.join()
+
+    # {level: {dataset: {'H': H, 'dis': dis, 'results': results}}}
+    resultsdict = {level: {} for level in args.levels}
+    for task, (dataset, level, results) in zip(tasks, outputs):
+        resultsdict[level][dataset] = {
+            'H': task[2], 'dis': task[3], 'results': results}
+
+    print('Doing univariate tests... Finished')
+
+    for level in args.levels:
+        ## Manipulate each dataset's results with values signed
+        ## according to median and mean effects in dis - H
+        med_allresults_lst = []
+        mean_allresults_lst = []
+
+        for dataset in resultsdict[level]:
+            ## Manipulate the results dataframe
+            # into a df with signed values according to direction of change
+            # Calculates using both mean and median.
+            results = resultsdict[level][dataset]['results']
+            H = resultsdict[level][dataset]['H']
+            dis = resultsdict[level][dataset]['dis']
+
+            med_results, mean_results = \
+                sign_results(results, H, dis, dataset, col='q')
+
+            med_allresults_lst.append(med_results)
+            mean_allresults_lst.append(mean_results)
+
+        ## Concat list of signed results series into a dataframe with
+        ## taxa in rows, datasets in columns
+        med_allresults =  pd.concat(med_allresults_lst, axis=1)
+        mean_allresults =  pd.concat(mean_allresults_lst, axis=1)
+
+        # Note: I don't ever use the median-based results in the paper, but this
+        # is where you could find them.
+        #med_allresults.to_csv(medfile, sep='\t')
+        mean_allresults.to_csv(level_file(args.out_file, level), sep='\t')
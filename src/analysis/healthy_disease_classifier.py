@@ -10,178 +10,257 @@ import sys
 import pandas as pd
 import numpy as np
 
+from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import roc_curve, auc
 
 # Add util to the path
 src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
 import FileIO as fio
-from util import collapse_taxonomic_contents_df, prep_classifier, cv_and_roc
+import ModelStore as ms
+from util import collapse_taxonomic_contents_df, group_codes, codes_in, \
+    holdout_probs
+from Profiling import profile_script
 
-def test_dataset(rf, X_test, Y_test):
+def startswith(prefixes):
     """
-    Test X_test with rf (which is a trained RandomForestClassifier).
-    Returns fpr, tpr lists and roc_auc float.
+    Returns a function which checks whether a group label starts with any of
+    the given prefixes. Held-out groups are matched by prefix, so that (for
+    example) holding out cdi_schubert also holds out cdi_schubert2, which
+    shares its healthy controls.
     """
+    return lambda label: any(label.startswith(p) for p in prefixes)
 
-    # Test
-    probs = rf.predict_proba(X_test)[:,1]
-    predictions = rf.predict(X_test)
-
-    fpr, tpr, thresholds = roc_curve(Y_test, probs)
-    roc_auc = auc(fpr, tpr)
-    return fpr, tpr, roc_auc
-
-
-p = argparse.ArgumentParser()
-p.add_argument('data_dir', help='path to directory with clean OTU tables and '
-    'metadata.')
-p.add_argument('out_file', help='file to write RF results to')
-p.add_argument('--random-state', help='random state seed for classification',
-    default=12345, type=int)
-p.add_argument('--n-cv', help='number of cross validation folds [default: '
-    + '%(default)s]', default=100, type=int)
-args = p.parse_args()
-
-datadir = args.data_dir
-# Read in dfdict
-dfdict = fio.read_dfdict_data(datadir)
-
-## Collapse to genus level and relabel samples
-for dataset in dfdict:
-    # Collapse to genus level and relabel samples with dataset ID
-    df = dfdict[dataset]['df']
-    df = collapse_taxonomic_contents_df(df, 'genus')
-    if dataset == 'edd_singh':
-        df.index = ['cdi_singh-' + i for i in df.index]
-    elif dataset == 'noncdi_schubert':
-        df.index = ['cdi_schubert2-' + i for i in df.index]
-    else:
-        df.index = [dataset + '-' + i for i in df.index]
-    dfdict[dataset]['df'] = df
-
-    # Also relabel indices in metadata
-    meta = dfdict[dataset]['meta']
-    if dataset == 'edd_singh':
-        meta.index = ['cdi_singh-' + i for i in meta.index]
-    elif dataset == 'noncdi_schubert':
-        meta.index = ['cdi_schubert2-' + i for i in meta.index]
-    else:
-        meta.index = [dataset + '-' + i for i in meta.index]
-    dfdict[dataset]['meta'] = meta
-
-## Concatenate OTU tables and corresponding metadata
-# Only keep datasets with *healthy* controls
-ignore_datasets = [d for d in dfdict
-    if 'H' not in dfdict[d]['meta']['DiseaseState'].unique()]
-# cdi_vincent only has five controls
-ignore_datasets.append('cdi_vincent')
-
-bigdf = pd.concat([dfdict[d]['df'] for d in dfdict if d not in ignore_datasets])
-# Fill NaN's with zeros (i.e. unobserved OTUs)
-bigdf = bigdf.fillna(0.0)
-bigmeta = pd.concat([dfdict[d]['meta'] for d in dfdict
-    if d not in ignore_datasets])
-
-# excludes: 'postFMT_CDI', None, ' '
-diseases = ['ASD', 'CD', 'CDI', 'nonCDI', 'CIRR', 'CRC', 'EDD', 'HIV',
-            'MHE', 'NASH', 'OB',
-            'PAR', 'PSA', 'RA', 'T1D', 'T2D', 'UC']
-classes_list = [['H'], diseases]
-[h_smpls, dis_smpls] = fio.get_samples(bigmeta, classes_list)
-
-# Get rid of the ob_zhu healthy samples so they are not duplicated in the
-# training set
-h_smpls = [i for i in h_smpls if not i.startswith('ob_zhu')]
-
-random_state = args.random_state
-
-## Leave-one-dataset-out
-datasets = list(set([i.split('-')[0] for i in bigdf.index]))
-all_results = []
-for d in datasets:
-    print(d)
-    # Train on all samples not in that dataset
-    train_h = [i for i in h_smpls if not i.startswith(d)]
-    # Get rid of the healthy samples that match with ob_zhu dataset
-    if d == 'ob_zhu':
-        train_h = [i for i in train_h if not i.startswith('nash_zhu')]
-
-    train_dis = [i for i in dis_smpls if not i.startswith(d)]
-    rf, X_train, Y_train = prep_classifier(
-        bigdf, train_h, train_dis, random_state)
-    rf = rf.fit(X_train, Y_train)
-
-    # Test on that dataset
-    test_h = [i for i in h_smpls if i.startswith(d)]
-    # test_h will be empty for ob_zhu, the healthy samples are in nash_zhu
-    if d == 'ob_zhu':
-        test_h = [i for i in h_smpls if i.startswith('nash_zhu')]
-    test_dis = [i for i in dis_smpls if i.startswith(d)]
-
-    _, X_test, Y_test = prep_classifier(bigdf, test_h, test_dis, random_state)
-    fpr, tpr, roc_auc = test_dataset(rf, X_test, Y_test)
-
-    dis = d.split('_')[0] # note: edd_singh samples were relabeld to cdi_singh
-    results = pd.DataFrame.from_dict(
-        dict(zip(['dataset', 'disease', 'fpr', 'tpr', 'auc', 'classifier'],
-                 (d, dis, fpr, tpr, roc_auc, 'dataset_out'))))
-    all_results.append(results)
-
-## Leave-one-disease-out
-diseases = list(set([i.split('_')[0] for i in bigdf.index]))
-for d in diseases:
-    print(d)
-    train_h = [i for i in h_smpls if not i.startswith(d)]
-
-    # For ob comparison, get rid of the healthy controls from nash_zhu
-    # because they belong to ob_zhu dataset too
-    if d == 'ob':
-        train_h = [i for i in train_h if not i.startswith('nash_zhu')]
-
-    train_dis = [i for i in dis_smpls if not i.startswith(d)]
-    rf, X_train, Y_train = prep_classifier(
-        bigdf, train_h, train_dis, random_state)
-
-    test_h = [i for i in h_smpls if i.startswith(d)]
-    # Add the ob_zhu healthy samples here
-    if d == 'ob':
-        test_h += [i for i in h_smpls if i.startswith('nash_zhu')]
-
-    test_dis = [i for i in dis_smpls if i.startswith(d)]
-    _, X_test, Y_test = prep_classifier(bigdf, test_h, test_dis, random_state)
-
-    # Train
-    rf = rf.fit(X_train, Y_train)
-    # Test
-    probs = rf.predict_proba(X_test)[:,1]
-
-    # Get the fpr, tpr, and AUC for disease-wise results
-    fpr, tpr, thresholds = roc_curve(Y_test, probs)
-    roc_auc = auc(fpr, tpr)
-
-    results = pd.DataFrame.from_dict(
-        dict(zip(['disease', 'fpr', 'tpr', 'auc', 'classifier'],
-                 (d, fpr, tpr, roc_auc, 'disease_out'))))
-    all_results.append(results)
-
-    # Also get the dataset-wise fpr, tpr, and AUC
-    # Make dataframe with probabilities and Y_test
-    all_smpls = test_h + test_dis
-    probs_df = pd.DataFrame(probs, index=all_smpls, columns=['probs'])
-    probs_df['y_test'] = Y_test
-    probs_df['dataset'] = [i.split('-')[0] for i in probs_df.index]
-    if d == 'ob':
-        probs_df = probs_df.replace('nash_zhu', 'ob_zhu')
-
-    for g, subdf in probs_df.groupby('dataset'):
-        fpr, tpr, thresholds = roc_curve(subdf['y_test'], subdf['probs'])
+def holdout_split(train_h, train_dis, test_h, test_dis):
+    """
+    Convert boolean masks for each class into integer train and test
+    indices. Healthy samples come first, then disease samples, in the
+    order they are in the data.
+    """
+    train_index = np.concatenate((np.flatnonzero(train_h),
+                                  np.flatnonzero(train_dis)))
+    test_index = np.concatenate((np.flatnonzero(test_h),
+                                 np.flatnonzero(test_dis)))
+    return train_index, test_index
+
+if __name__ == "__main__":
+    # I need to wrap this code in if name == main to use multiprocessing.map
+    p = argparse.ArgumentParser()
+    p.add_argument('data_dir', help='path to directory with clean OTU tables and '
+        'metadata.')
+    p.add_argument('out_file', help='file to write RF results to')
+    p.add_argument('--random-state', help='random state seed for classification',
+        default=12345, type=int)
+    p.add_argument('--n-cv', help='number of cross validation folds [default: '
+        + '%(default)s]', default=100, type=int)
+    p.add_argument('--n-jobs', help='number of processes to train the held-out '
+        + 'classifiers with [default: all CPUs]', default=None, type=int)
+    p.add_argument('--model-store', help='directory to save trained classifiers '
+        + 'to. Held-out classifiers for the same data and parameters which '
+        + 'are already there are re-scored instead of re-trained.',
+        default=None)
+    p.add_argument('--pooled-model', help='file to save a classifier trained '
+        + 'on all samples to. This is the model used by score_samples.py to '
+        + 'score new samples. If --model-store is given, it is also kept '
+        + 'there, and only re-trained if the data or parameters changed.',
+        default=None)
+    args = p.parse_args()
+    profile_script()
+
+    datadir = args.data_dir
+    # Read in dfdict
+    dfdict = fio.read_dfdict_data(datadir)
+
+    ## Collapse to genus level and relabel samples
+    for dataset in dfdict:
+        # Collapse to genus level and relabel samples with dataset ID
+        df = dfdict[dataset]['df']
+        df = collapse_taxonomic_contents_df(df, 'genus')
+        if dataset == 'edd_singh':
+            df.index = ['cdi_singh-' + i for i in df.index]
+        elif dataset == 'noncdi_schubert':
+            df.index = ['cdi_schubert2-' + i for i in df.index]
+        else:
+            df.index = [dataset + '-' + i for i in df.index]
+        dfdict[dataset]['df'] = df
+
+        # Also relabel indices in metadata
+        meta = dfdict[dataset]['meta']
+        if dataset == 'edd_singh':
+            meta.index = ['cdi_singh-' + i for i in meta.index]
+        elif dataset == 'noncdi_schubert':
+            meta.index = ['cdi_schubert2-' + i for i in meta.index]
+        else:
+            meta.index = [dataset + '-' + i for i in meta.index]
+        dfdict[dataset]['meta'] = meta
+
+    ## Concatenate OTU tables and corresponding metadata
+    # Only keep datasets with *healthy* controls
+    ignore_datasets = [d for d in dfdict
+        if 'H' not in dfdict[d]['meta']['DiseaseState'].unique()]
+    # cdi_vincent only has five controls
+    ignore_datasets.append('cdi_vincent')
+
+    bigdf = pd.concat([dfdict[d]['df'] for d in dfdict if d not in ignore_datasets])
+    # Fill NaN's with zeros (i.e. unobserved OTUs)
+    bigdf = bigdf.fillna(0.0)
+    bigmeta = pd.concat([dfdict[d]['meta'] for d in dfdict
+        if d not in ignore_datasets])
+
+    # excludes: 'postFMT_CDI', None, ' '
+    diseases = ['ASD', 'CD', 'CDI', 'nonCDI', 'CIRR', 'CRC', 'EDD', 'HIV',
+                'MHE', 'NASH', 'OB',
+                'PAR', 'PSA', 'RA', 'T1D', 'T2D', 'UC']
+
+    ## Integer-coded groups for every sample, in metadata order
+    # Rows of X are in the same order as bigmeta, so that the training
+    # samples are in the same order as with fio.get_samples()
+    X = bigdf.loc[bigmeta.index].values
+    dataset_codes, dataset_names = group_codes(
+        [i.split('-')[0] for i in bigmeta.index])
+    disease_names = np.array([i.split('_')[0] for i in dataset_names])
+
+    is_h = (bigmeta['DiseaseState'] == 'H').values
+    is_dis = bigmeta['DiseaseState'].isin(diseases).values
+    # Get rid of the ob_zhu healthy samples so they are not duplicated in the
+    # training set
+    is_h &= ~codes_in(dataset_codes, dataset_names, startswith(['ob_zhu']))
+    Y = is_dis.astype(int)
+
+    random_state = args.random_state
+
+    ## Leave-one-dataset-out
+    datasets = list(dataset_names)
+    splits = []
+    for d in datasets:
+        in_d = codes_in(dataset_codes, dataset_names, startswith([d]))
+        # Train on all samples not in that dataset, and test on that dataset
+        train_h = is_h & ~in_d
+        # test_h would be empty for ob_zhu, the healthy samples are in
+        # nash_zhu. Get rid of them in training and test on them instead.
+        if d == 'ob_zhu':
+            in_nash_zhu = codes_in(dataset_codes, dataset_names,
+                                   startswith(['nash_zhu']))
+            train_h &= ~in_nash_zhu
+            test_h = is_h & in_nash_zhu
+        else:
+            test_h = is_h & in_d
+        splits.append(holdout_split(train_h, is_dis & ~in_d,
+                                    test_h, is_dis & in_d))
+
+    ## Leave-one-disease-out
+    diseases = list(pd.unique(disease_names))
+    for d in diseases:
+        in_d = codes_in(dataset_codes, dataset_names, startswith([d]))
+        train_h = is_h & ~in_d
+        test_h = is_h & in_d
+        # For ob comparison, get rid of the healthy controls from nash_zhu
+        # because they belong to ob_zhu dataset too. Add them to the test
+        # set instead.
+        if d == 'ob':
+            in_nash_zhu = codes_in(dataset_codes, dataset_names,
+                                   startswith(['nash_zhu']))
+            train_h &= ~in_nash_zhu
+            test_h |= is_h & in_nash_zhu
+        splits.append(holdout_split(train_h, is_dis & ~in_d,
+                                    test_h, is_dis & in_d))
+
+    ## Re-score any held-out classifiers which are in the model store
+    split_names = ['dataset_out_' + d for d in datasets] \
+                  + ['disease_out_' + d for d in diseases]
+    all_probs = [None]*len(splits)
+    if args.model_store is not None:
+        data_hash = ms.hash_data(X, Y, [bigmeta.index, bigdf.columns])
+        rf_params = {'n_estimators': 1000, 'random_state': random_state}
+        keys = [ms.model_key(s, data_hash, 'genus', rf_params)
+                for s in split_names]
+        for i, key in enumerate(keys):
+            record = ms.load_models(args.model_store, key)
+            if record is not None:
+                all_probs[i] = \
+                    record['model'].predict_proba(X[splits[i][1]])[:, 1]
+    todo = [i for i in range(len(splits)) if all_probs[i] is None]
+
+    ## Train and test all of the other held-out groups at once
+    print('Training {} held-out classifiers...'.format(len(todo)))
+    new_probs = holdout_probs(X, Y, [splits[i] for i in todo], random_state,
+                              n_jobs=args.n_jobs,
+                              keep_models=args.model_store is not None)
+    if args.model_store is not None:
+        new_probs, models = new_probs
+        for i, rf in zip(todo, models):
+            ms.save_models(args.model_store, keys[i],
+                           {'model': rf,
+                            'train_index': splits[i][0],
+                            'test_index': splits[i][1],
+                            'features': list(bigdf.columns)})
+    for i, probs in zip(todo, new_probs):
+        all_probs[i] = probs
+
+    all_results = []
+    for d, (_, test_index), probs in zip(datasets, splits, all_probs):
+        print(d),
+        fpr, tpr, thresholds = roc_curve(Y[test_index], probs)
         roc_auc = auc(fpr, tpr)
 
+        dis = d.split('_')[0] # note: edd_singh samples were relabeld to cdi_singh
         results = pd.DataFrame.from_dict(
             dict(zip(['dataset', 'disease', 'fpr', 'tpr', 'auc', 'classifier'],
-                     (g, d, fpr, tpr, roc_auc, 'disease_out'))))
+                     (d, dis, fpr, tpr, roc_auc, 'dataset_out'))))
+        all_results.append(results)
+
+    for d, (_, test_index), probs in zip(diseases, splits[len(datasets):],
+                                         all_probs[len(datasets):]):
+        print(d),
+        Y_test = Y[test_index]
+
+        # Get the fpr, tpr, and AUC for disease-wise results
+        fpr, tpr, thresholds = roc_curve(Y_test, probs)
+        roc_auc = auc(fpr, tpr)
+
+        results = pd.DataFrame.from_dict(
+            dict(zip(['disease', 'fpr', 'tpr', 'auc', 'classifier'],
+                     (d, fpr, tpr, roc_auc, 'disease_out'))))
         all_results.append(results)
 
-all_results_df = pd.concat(all_results)
-all_results_df.to_csv(args.out_file, sep='\t', index=False)
+        # Also get the dataset-wise fpr, tpr, and AUC
+        test_datasets = dataset_names[dataset_codes[test_index]]
+        if d == 'ob':
+            test_datasets[test_datasets == 'nash_zhu'] = 'ob_zhu'
+
+        for g in np.unique(test_datasets):
+            in_g = test_datasets == g
+            fpr, tpr, thresholds = roc_curve(Y_test[in_g], probs[in_g])
+            roc_auc = auc(fpr, tpr)
+
+            results = pd.DataFrame.from_dict(
+                dict(zip(['dataset', 'disease', 'fpr', 'tpr', 'auc', 'classifier'],
+                         (g, d, fpr, tpr, roc_auc, 'disease_out'))))
+            all_results.append(results)
+
+    all_results_df = pd.concat(all_results)
+    all_results_df.to_csv(args.out_file, sep='\t', index=False)
+
+    ## Pooled classifier trained on all healthy and disease samples
+    if args.pooled_model is not None:
+        record = None
+        if args.model_store is not None:
+            pooled_key = ms.model_key('pooled_healthy_disease', data_hash,
+                                      'genus', rf_params)
+            record = ms.load_models(args.model_store, pooled_key)
+        if record is None:
+            print('\nTraining pooled classifier on all samples...')
+            train_index = np.concatenate((np.flatnonzero(is_h),
+                                          np.flatnonzero(is_dis)))
+            rf = RandomForestClassifier(
+                n_estimators=1000, random_state=random_state,
+                n_jobs=args.n_jobs if args.n_jobs is not None else -1)
+            rf.fit(X[train_index], Y[train_index])
+            rf.set_params(n_jobs=1)
+            record = {'model': rf,
+                      'features': list(bigdf.columns),
+                      'level': 'genus',
+                      'datasets': list(dataset_names)}
+            if args.model_store is not None:
+                ms.save_models(args.model_store, pooled_key, record)
+        ms.save_model_file(args.pooled_model, record)
@@ -1,5 +1,9 @@
 """
 Make table of the log-fold change for each genus in each dataset.
+
+Log-fold changes of the means (the default) are calculated from each
+dataset's summary statistics, without reading its OTU table. Log-fold
+changes of the medians need the full OTU tables.
 """
 import argparse
 
@@ -11,58 +15,34 @@ from copy import copy
 import os, sys
 src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
-from FileIO import read_dfdict_data
-from util import collapse_taxonomic_contents_df
+from FileIO import read_dfdict_data, read_dataset_summary, get_classes
+from util import collapse_taxonomic_contents_df, effect_size, \
+    effect_from_centers
+import SummaryStats as ss
+from Profiling import profile_script
 
-def get_log_change(col, dis_smpls, H_smpls, method='mean', logfun=np.log2):
+def summary_logfold(summary, dataset, logfun=np.log2, pseudocount=0):
     """
-    Get the log(dis_samples/H_smpls) for one Series of relative abundances.
-    This function is to be used with the OTU table,
-    df.apply(lambda col: get_log_change(col, dis_smpls, H_smpls, ...))
-
-    Parameters
-    ----------
-    col : pandas Series
-        series with genera in index
-    dis_smpls, H_smpls : lists
-        lists of samples to compare
-    method : str
-        'mean' or 'median'
-    logfun : function
-        np.log10 or np.log2
+    Calculate the logfold change between the mean abundances in disease
+    and controls of each genus, from a dataset's summary statistics (see
+    SummaryStats.py).
 
     Returns
     -------
-    val : float
-        logfun(col.loc[dis_smpls].method()/col.loc[H_smpls].method()).
-        If method(dis) == 0, returns 0. If method(H) == 0, returns np.inf
+    logdf : pandas Series
+        genera in rows, logfold change as values (as in util.effect_size())
     """
-    if method == 'mean':
-        try:
-            val = logfun(col.loc[dis_smpls].mean()/col.loc[H_smpls].mean())
-        except:
-            # If both numerator and denominator are 0, return 0 logfold change
-            if col.loc[dis_smpls].mean() == 0:
-                val = 0
-            # If numerator is not zero, return log10(1/0) AKA -log10(0/1) = np.inf
-            else:
-                val = np.inf
-
-    elif method == 'median':
-        try:
-            val = logfun(df.loc[dis_smpls, o].median()/df.loc[H_smpls, o].median())
-        except:
-            # If both numerator and denominator are 0, return 0 logfold change
-            if df.loc[dis_smpls, o].median() == 0:
-                val = 0
-            # If numerator is not zero, return log10(1/0) AKA -log10(0/1) = np.inf
-            else:
-                val = np.inf
-    else:
-        raise ValueError('Unrecognized method to compare values')
-    return val
-
-def convert_dataset_to_logfold(col, dfdict, logfun=np.log2, method='mean'):
+    labels = [str(g) for g in summary['groups']]
+    classes_list = get_classes(pd.DataFrame({'DiseaseState': labels}),
+                               dataset)
+    h = ss.genus_mean(ss.pool_groups(summary, classes_list[0]))
+    dis = ss.genus_mean(ss.pool_groups(summary, classes_list[1]))
+    return pd.Series(effect_from_centers(dis.values, h.values, logfun=logfun,
+                                         pseudocount=pseudocount),
+                     index=dis.index)
+
+def convert_dataset_to_logfold(col, dfdict, logfun=np.log2, method='mean',
+                               pseudocount=0):
     """
     Calculate the logfold change between disease and controls for genera
     in one column.
@@ -73,10 +53,13 @@ def convert_dataset_to_logfold(col, dfdict, logfun=np.log2, method='mean'):
         genera in rows, dataset as Series name. Values are irrelevant.
     dfdict : dict
         {dataset: {'df': df, 'dis_smpls': dis_smpls, 'H_smpls': H_smpls}, ...}
+        or, for method='mean', {dataset: {'summary': summary}, ...}
     logfun : function
         np.log10 or np.log2
     method : str
         'mean' or 'median'
+    pseudocount : float
+        see util.effect_size()
 
     Returns
     -------
@@ -87,21 +70,21 @@ def convert_dataset_to_logfold(col, dfdict, logfun=np.log2, method='mean'):
         Genera which are in the OTU table but not in col.index are discarded.
     """
     dataset = col.name
-    df = dfdict[dataset]['df']
-    dis_smpls = dfdict[dataset]['dis_smpls']
-    h_smpls = dfdict[dataset]['H_smpls']
-    # This returns a Series with genera as rows, logfold change as values
-    logdf = df.apply(lambda col: get_log_change(col, dis_smpls, h_smpls,
-                                                logfun=logfun, method=method))
-
-    # Merge results from logfold change with the given index, and keep only
-    # rows which were in the original index. Any rows which are not in the df
-    # are nan's
-    logcol = pd.Series(index=col.index, data=np.nan)
-
-    genera = [i for i in logcol.index if i in logdf.index]
+    # These return a Series with genera as rows, logfold change as values
+    if 'summary' in dfdict[dataset]:
+        logdf = summary_logfold(dfdict[dataset]['summary'], dataset,
+                                logfun=logfun, pseudocount=pseudocount)
+    else:
+        df = dfdict[dataset]['df']
+        dis_smpls = dfdict[dataset]['dis_smpls']
+        h_smpls = dfdict[dataset]['H_smpls']
+        logdf = effect_size(df, dis_smpls, h_smpls, method=method,
+                            logfun=logfun, pseudocount=pseudocount)
 
-    logcol.loc[genera] = logdf.loc[genera]
+    # Keep only rows which were in the original index. Any rows which are not
+    # in the df are nan's
+    logcol = logdf.reindex(col.index)
+    logcol.name = dataset
 
     return logcol
 
@@ -116,24 +99,35 @@ p.add_argument('--logfun', help='log function to use (default: %(default)s)',
 p.add_argument('--method', help='measure of central tendency to use in '
                + 'calculating effect direction (default: %(default)s)',
                choices=['mean', 'median'], default='mean')
+p.add_argument('--pseudocount', help='value to add to the mean/median '
+               + 'relative abundances before taking the logfold change '
+               + '(default: %(default)s)', default=0.0, type=float)
 args = p.parse_args()
-
-# Read in dfdict
-dfdict = read_dfdict_data(args.datadir)
-# Collapse to genus level
-for dataset in dfdict:
-    dfdict[dataset]['df'] = \
-        collapse_taxonomic_contents_df(dfdict[dataset]['df'], 'genus')
+profile_script()
 
 # Read in qvalues. Tab-delimited, genera in index and datasets in columns
 qvals = pd.read_csv(args.qvalues, sep='\t', index_col=0)
 
+if args.method == 'mean':
+    # The means are exact from the summary statistics
+    dfdict = {dataset: {'summary': read_dataset_summary(dataset, args.datadir)}
+              for dataset in qvals.columns}
+else:
+    # Read in dfdict
+    dfdict = read_dfdict_data(args.datadir)
+    # Collapse to genus level
+    for dataset in dfdict:
+        dfdict[dataset]['df'] = \
+            collapse_taxonomic_contents_df(dfdict[dataset]['df'], 'genus')
+
 # Calculate logfold change with pandas-fu
+logfun = {'log2': np.log2, 'log10': np.log10}[args.logfun]
 allres = qvals.apply(lambda col: convert_dataset_to_logfold(col, dfdict,
-                                     logfun=np.log2, method='mean'))
+                                     logfun=logfun, method=args.method,
+                                     pseudocount=args.pseudocount))
 
 # Replace +/- infinity with max/min value in entire matrix
-# From get_log_change(): +inf is returned when controls = 0, disease > 0;
+# From util.effect_size(): +inf is returned when controls = 0, disease > 0;
 # -inf is returned when controls > 0, disease = 0; 0 is returned when both
 # controls and disease = 0
 allres = allres.replace(np.inf, np.ma.masked_invalid(allres.fillna(0)).max())
@@ -8,6 +8,13 @@ import argparse
 import pandas as pd
 import numpy as np
 
+# Add this repo to the path
+import sys
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
+sys.path.insert(0, src_dir)
+from Taxonomy import taxon_name
+from Profiling import profile_script
+
 def count_sig(allresults, qthresh=0.05):
     """
     Count how often bacteria are significant in each disease.
@@ -60,7 +67,10 @@ def count_sig(allresults, qthresh=0.05):
     meta_counts = meta_results.groupby(['otu', 'disease', 'significant']).size()
     meta_counts.name = 'num_times_sig'
     meta_counts = meta_counts.reset_index()
-    meta_counts['genus'] = meta_counts['otu'].apply(lambda x: x.split(';')[-1])
+    # Get each OTU's genus once, rather than for every disease/direction
+    codes, otus = pd.factorize(meta_counts['otu'])
+    genera = np.array([taxon_name(o, prefix=True) for o in otus])
+    meta_counts['genus'] = genera[codes]
 
     return meta_counts
 
@@ -221,6 +231,7 @@ if __name__ == "__main__":
         + 'meta-analysis.', action='store_true')
 
     args = parser.parse_args()
+    profile_script()
 
     qvals = pd.read_csv(args.qvalues, sep='\t', index_col=0)
 
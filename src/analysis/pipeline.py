@@ -0,0 +1,576 @@
+#!/usr/bin/env python
+"""
+This script runs the analysis stages of the Makefile (and the steps which
+prepare their results for plotting) from one Python process, instead of
+launching a new python process for each stage.
+
+The clean OTU tables and metadata are read once, before any stage runs,
+and every stage gets them from memory (see FileIO.cache_clean_tables).
+Each stage runs the same script with the same arguments as its Makefile
+rule, so it writes the same files. Stages run in a forked child process
+which shares the already-read tables and imported modules with this one.
+Independent stages run at the same time, up to --n-jobs at once.
+
+Unlike make, whether a stage needs to be re-run doesn't depend on file
+timestamps. The manifest (data/pipeline_manifest.json) has the content hash
+of each stage's input files, code (its scripts and the modules in this repo
+that they import), parameters, and output files from when it last ran. A
+stage only runs if one of these changed, or if one of its output files is
+missing, so re-downloading or checking out identical files doesn't cause
+any rebuilds (use --force to run all of the selected stages anyway).
+Stages which write more than one file list all of them, and are re-run if
+any of them changed. Files which are written once per dataset are given as
+a glob pattern (e.g. data/analysis_results/beta_diversity/*.braycurtis.npy).
+If the files were made by make (or before the manifest existed), use
+--record once to save their hashes without re-running anything.
+
+Cleaning the raw data (one stage per dataset, as in the Makefile) is
+included, but downloading it isn't.
+
+If the PROFILE_REPORT environment variable is set, each stage's timing and
+memory use are written to the report (see src/util/Profiling.py), and a
+summary table of this run is printed at the end.
+
+Run it from the top directory of this repo, e.g.:
+    python src/analysis/pipeline.py --stages qvals alpha --n-jobs 4
+"""
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import re
+import runpy
+import time
+
+# Add this repo to the path
+import os, sys
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
+sys.path.insert(0, src_dir)
+import FileIO as fio
+import Profiling
+
+## File names, as in the Makefile
+clean_dir = 'data/clean_tables'
+results_dir = 'data/analysis_results'
+yaml_file = 'data/user_input/results_folders.yaml'
+split_datasets = 'data/user_input/split_cases_datasets.txt'
+final_tree_file = 'data/tree/phyloT_tree.updated.newick'
+model_store = 'data/models'
+raw_dir = 'data/raw_otu_tables'
+manifest_file = 'data/pipeline_manifest.json'
+
+dataset_info = results_dir + '/datasets_info.txt'
+split_dataset_info = results_dir + '/datasets_info.split_cases.txt'
+qvalues = results_dir + '/qvalues.mean.kruskal-wallis.case-control.txt'
+meta_qvalues = results_dir + '/meta.counting.q-0.05.disease_wise.txt'
+core_file = results_dir + '/meta.counting.q-0.05.{}_diseases.across_all_diseases.txt'
+overall_qvalues = core_file.format(2)
+nocdi_overall = results_dir + '/meta.counting.q-0.05.2_diseases.across_all_diseases_except_cdi.txt'
+overall_qvalues_stouffer = results_dir + '/meta.stouffer.q-0.05.across_all_diseases.txt'
+qvalues_stouffer = results_dir + '/meta.stouffer_qvalues.txt'
+null_core_file = results_dir + '/null_core.{}_diseases.txt'
+dysbiosis = results_dir + '/dysbiosis_metrics.txt'
+alpha_divs = results_dir + '/alpha_diversity.txt'
+alpha_pvals = results_dir + '/alpha_diversity.pvalues.txt'
+beta_dir = results_dir + '/beta_diversity'
+beta_metrics = ['braycurtis', 'jaccard', 'weighted_unifrac',
+                'unweighted_unifrac']
+# beta_diversity.py writes the samples and one distance matrix per metric,
+# for each dataset and for all samples pooled together
+beta_outputs = [os.path.join(beta_dir, '{}.{}'.format(scope, ext))
+                for scope in ['pooled', '*']
+                for ext in ['samples.txt']
+                + ['{}.npy'.format(m) for m in beta_metrics]]
+rf_results = results_dir + '/rf_results.txt'
+rf_h_v_dis = results_dir + '/rf_results.healthy_vs_disease.txt'
+rf_param_search = results_dir + '/rf_results.parameter_search.txt'
+rf_core = results_dir + '/rf_results.core_only.txt'
+pooled_model = model_store + '/pooled_healthy_disease.joblib'
+ubiquity = results_dir + '/ubiquity_abundance_calculations.txt'
+split_qvalues = results_dir + '/qvalues.mean.kruskal-wallis.split-cases.txt'
+split_rf = results_dir + '/rf_results.split_cases.txt'
+split_dysbiosis = results_dir + '/dysbiosis_metrics.split_cases.txt'
+qvalues_clean_tmp = qvalues.replace('txt', 'sig.txt')
+qvalues_clean = qvalues.replace('txt', 'sig_ordered.txt')
+meta_clean = meta_qvalues.replace('txt', 'sig_ordered.txt')
+overall_clean = overall_qvalues.replace('txt', 'sig_ordered.txt')
+nocdi_clean = nocdi_overall.replace('txt', 'sig_ordered.txt')
+stouffer_clean = overall_qvalues_stouffer.replace('txt', 'sig_ordered.txt')
+logfold = qvalues.replace('txt', 'log2change.sig_ordered.txt')
+
+# Stands in for the clean OTU and metadata tables (and their summary
+# statistics) in stages' inputs
+CLEAN = 'clean tables'
+# Files that the clean tables are expanded to
+CLEAN_GLOBS = ['*.clean.feather', '*.clean.compact.parquet',
+               '*.summary.clean.npz']
+
+def stage(name, script, args, outputs, inputs=(), commands=None, params=None):
+    """
+    Returns the dict describing one stage: the script(s) it runs with their
+    arguments, the files it reads and writes, and any other parameters which
+    it depends on. commands is a list of (script, args) tuples, for stages
+    which run more than one command. outputs can have glob patterns, for
+    files written once per dataset.
+    """
+    if commands is None:
+        commands = [(script, args)]
+    return {'name': name, 'commands': commands, 'outputs': list(outputs),
+            'inputs': list(inputs), 'params': params}
+
+def clean_stages():
+    """
+    Returns one stage per dataset in the yaml file, to clean its raw OTU
+    table and metadata. Each stage depends on the dataset's raw files and
+    its entry in the yaml file (rather than on the whole yaml file).
+    """
+    if not os.path.exists(yaml_file):
+        return []
+    datasets = fio.read_yaml(yaml_file, raw_dir)
+    stages = []
+    for dataset in sorted(datasets):
+        out = os.path.join(clean_dir, dataset)
+        stages.append(
+            stage('clean_' + dataset, 'src/data/clean_otu_and_metadata.py',
+                  [raw_dir, yaml_file, out + '.otu_table.clean.feather'],
+                  [out + '.otu_table.clean.feather',
+                   out + '.metadata.clean.feather',
+                   out + '.summary.clean.npz'],
+                  [datasets[dataset]['otu_table'],
+                   datasets[dataset]['metadata_file']],
+                  params=datasets[dataset]))
+    return stages
+
+def make_stages():
+    """
+    Returns the list of stages, in the same order as the Makefile rules.
+    """
+    a = 'src/analysis/'
+    stages = clean_stages() + [
+        stage('dataset_info', 'src/data/dataset_info.py',
+              [yaml_file, 'data/raw_otu_tables', clean_dir, dataset_info],
+              [dataset_info], [yaml_file, CLEAN]),
+        stage('split_dataset_info', 'src/data/dataset_info.py',
+              [yaml_file, 'data/raw_otu_tables', clean_dir,
+               split_dataset_info, '--split-cases', '--subset',
+               split_datasets],
+              [split_dataset_info], [yaml_file, split_datasets, CLEAN]),
+        stage('qvalues', a + 'get_qvalues.py', [clean_dir, qvalues],
+              [qvalues], [CLEAN]),
+        stage('meta_qvalues', a + 'meta_analyze.py',
+              [qvalues, results_dir, '0.05', '2', '--exclude-nonhealthy',
+               '--disease'],
+              [meta_qvalues], [qvalues])]
+    for n in range(2, 6):
+        stages.append(
+            stage('core_{}'.format(n), a + 'meta_analyze.py',
+                  [qvalues, results_dir + '/', '0.05', str(n),
+                   '--exclude-nonhealthy', '--overall'],
+                  [core_file.format(n)], [qvalues]))
+    stages += [
+        stage('nocdi_overall', a + 'meta_analyze.py',
+              [qvalues, results_dir, '0.05', '2', '--no-cdi',
+               '--exclude-nonhealthy', '--overall'],
+              [nocdi_overall], [qvalues]),
+        stage('stouffer', a + 'meta_analyze_stouffer.py',
+              [qvalues, dataset_info, qvalues_stouffer,
+               overall_qvalues_stouffer, '--exclude-nonhealthy'],
+              [overall_qvalues_stouffer, qvalues_stouffer],
+              [qvalues, dataset_info]),
+        stage('dysbiosis', a + 'dysbiosis_metrics.py',
+              [qvalues, dataset_info, overall_qvalues, rf_results, dysbiosis],
+              [dysbiosis],
+              [qvalues, dataset_info, overall_qvalues, rf_results]),
+        stage('alpha', a + 'alpha_diversity.py',
+              [clean_dir, alpha_divs, alpha_pvals],
+              [alpha_divs, alpha_pvals], [CLEAN]),
+        stage('beta', None, None, beta_outputs,
+              [CLEAN, final_tree_file],
+              commands=[(a + 'beta_diversity.py',
+                         [clean_dir, beta_dir, '--scope', scope,
+                          '--metrics'] + beta_metrics
+                         + ['--tree', final_tree_file])
+                        for scope in ['dataset', 'pooled']]),
+        stage('rf_results', a + 'classifiers.py',
+              [clean_dir, rf_results, '--model-store', model_store],
+              [rf_results], [CLEAN]),
+        stage('rf_param_search', a + 'classifiers_parameters.py',
+              [clean_dir, rf_param_search], [rf_param_search], [CLEAN]),
+        stage('ubiquity', a + 'ubiquity_abundance.py',
+              [clean_dir, overall_qvalues, ubiquity], [ubiquity],
+              [CLEAN, overall_qvalues]),
+        stage('rf_core', a + 'classifiers.py',
+              ['--core', overall_qvalues, clean_dir, rf_core,
+               '--model-store', model_store],
+              [rf_core], [CLEAN, overall_qvalues]),
+        stage('rf_h_v_dis', a + 'healthy_disease_classifier.py',
+              [clean_dir, rf_h_v_dis, '--model-store', model_store,
+               '--pooled-model', pooled_model],
+              [rf_h_v_dis, pooled_model], [CLEAN]),
+        stage('split_qvalues', a + 'get_qvalues.py',
+              [clean_dir, split_qvalues, '--subset', split_datasets,
+               '--split-cases'],
+              [split_qvalues], [split_datasets, CLEAN]),
+        stage('split_rf', a + 'classifiers.py',
+              [clean_dir, split_rf, '--subset', split_datasets,
+               '--split-cases', '--model-store', model_store],
+              [split_rf], [split_datasets, CLEAN]),
+        stage('split_dysbiosis', a + 'dysbiosis_metrics.py',
+              [split_qvalues, split_dataset_info, overall_qvalues, split_rf,
+               split_dysbiosis],
+              [split_dysbiosis],
+              [split_qvalues, split_dataset_info, overall_qvalues, split_rf])]
+    for n in range(2, 6):
+        stages.append(
+            stage('null_core_{}'.format(n), a + 'null_core.py',
+                  [qvalues, '0.05', null_core_file.format(n), '--n_diseases',
+                   str(n), '--reps', '1000', '--exclude-nonhealthy'],
+                  [null_core_file.format(n)], [qvalues]))
+    stages += [
+        stage('qvalues_clean_tmp', a + 'clean_qvalues.py', [qvalues],
+              [qvalues_clean_tmp], [qvalues]),
+        stage('qvalues_clean', a + 'reorder_qvalues.py',
+              ['--do-qvals', '--qvalues', qvalues_clean_tmp, final_tree_file],
+              [qvalues_clean], [qvalues_clean_tmp, final_tree_file]),
+        stage('meta_clean', a + 'reorder_qvalues.py',
+              ['--disease-df', meta_qvalues, '--qvalues', qvalues_clean,
+               final_tree_file],
+              [meta_clean], [meta_qvalues, final_tree_file, qvalues_clean]),
+        stage('overall_clean', a + 'reorder_qvalues.py',
+              ['--overall', overall_qvalues, '--qvalues', qvalues_clean,
+               final_tree_file],
+              [overall_clean],
+              [overall_qvalues, final_tree_file, qvalues_clean]),
+        stage('nocdi_clean', a + 'reorder_qvalues.py',
+              ['--overall', nocdi_overall, final_tree_file],
+              [nocdi_clean], [nocdi_overall, final_tree_file]),
+        stage('stouffer_clean', a + 'reorder_qvalues.py',
+              ['--overall', overall_qvalues_stouffer, final_tree_file],
+              [stouffer_clean], [overall_qvalues_stouffer, final_tree_file]),
+        stage('logfold', a + 'logfold_effect.py',
+              [clean_dir, qvalues_clean, logfold],
+              [logfold], [qvalues_clean, CLEAN])]
+    return stages
+
+# Groups of stages, named after the corresponding Makefile targets
+GROUPS = {
+    'qvals': ['qvalues', 'meta_qvalues', 'core_2', 'split_qvalues'],
+    'shared_response': ['core_2', 'stouffer', 'nocdi_overall']
+        + ['null_core_{}'.format(n) for n in range(2, 6)]
+        + ['core_{}'.format(n) for n in range(2, 6)],
+    'alpha': ['alpha'],
+    'beta': ['beta'],
+    'rf_results': ['rf_results', 'rf_h_v_dis'],
+    'for_plotting': ['qvalues_clean', 'meta_clean', 'overall_clean',
+                     'logfold']}
+GROUPS['analysis'] = GROUPS['qvals'] + GROUPS['alpha'] \
+    + GROUPS['rf_results'] + ['dysbiosis']
+GROUPS['reviewer_analysis'] = GROUPS['shared_response'] \
+    + ['split_qvalues', 'split_dysbiosis', 'split_rf', 'rf_core']
+GROUPS['data'] = ['clean_data', 'dataset_info']
+
+# Stages which are run if none are given
+DEFAULT_STAGES = ['data', 'analysis', 'reviewer_analysis', 'for_plotting']
+
+def select_stages(stages, names):
+    """
+    Returns the stages (in order) which are named in names (stage or group
+    names), plus all of the stages they depend on, and a dict with the
+    names of the stages each one directly depends on.
+    """
+    producer = {}
+    for s in stages:
+        for f in s['outputs']:
+            producer[f] = s['name']
+    cleaning = [s['name'] for s in stages if s['name'].startswith('clean_')]
+    upstream = {}
+    for s in stages:
+        deps = set([producer[f] for f in s['inputs'] if f in producer])
+        if CLEAN in s['inputs']:
+            deps.update(cleaning)
+        upstream[s['name']] = sorted(deps)
+
+    selected = set()
+    todo = []
+    for name in names:
+        todo += GROUPS.get(name, [name])
+    while todo:
+        name = todo.pop()
+        # clean_data can be given directly or come from a group (e.g. data)
+        if name == 'clean_data':
+            todo += cleaning
+            continue
+        if name not in upstream:
+            raise ValueError('Unknown stage {}'.format(name))
+        if name not in selected:
+            selected.add(name)
+            todo += upstream[name]
+    return [s for s in stages if s['name'] in selected], upstream
+
+def code_files(script, found=None):
+    """
+    Returns the script and the modules in src/util and src/analysis that it
+    imports (directly or through other modules).
+    """
+    if found is None:
+        found = set()
+    found.add(script)
+    with open(script) as f:
+        text = f.read()
+    names = re.findall(r'^\s*from\s+(\w+)\s+import', text, re.M)
+    for line in re.findall(r'^\s*import\s+([\w ,]+)$', text, re.M):
+        names += [n.split()[0] for n in line.split(',') if n.strip()]
+    for name in names:
+        for d in ['src/util', 'src/analysis']:
+            fn = os.path.join(d, name + '.py')
+            if os.path.exists(fn) and fn not in found:
+                code_files(fn, found)
+    return found
+
+def input_files(s):
+    """
+    Returns the files a stage depends on: its code and input files, with
+    the clean tables expanded.
+    """
+    files = set()
+    for script, _ in s['commands']:
+        files.update(code_files(script))
+    for f in s['inputs']:
+        if f == CLEAN:
+            for pattern in CLEAN_GLOBS:
+                files.update(glob.glob(os.path.join(clean_dir, pattern)))
+        else:
+            files.add(f)
+    return sorted(files)
+
+def hash_file(fn, manifest):
+    """
+    Returns the sha1 of a file's contents, or None if it doesn't exist.
+    Hashes are kept in the manifest with the file's size and modification
+    time, and a file is only read again if one of those changed.
+    """
+    if not os.path.exists(fn):
+        return None
+    st = os.stat(fn)
+    cached = manifest['files'].get(fn)
+    if cached is not None and cached[0] == st.st_size \
+            and cached[1] == st.st_mtime:
+        return cached[2]
+    h = hashlib.sha1()
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    manifest['files'][fn] = [st.st_size, st.st_mtime, h.hexdigest()]
+    return h.hexdigest()
+
+def output_hashes(s, manifest):
+    """
+    Returns the hashes of the stage's output files, with glob patterns
+    expanded. Missing files, and patterns which don't match any files, are
+    None.
+    """
+    hashes = {}
+    for f in s['outputs']:
+        if not glob.has_magic(f):
+            hashes[f] = hash_file(f, manifest)
+            continue
+        fns = glob.glob(f)
+        if len(fns) == 0:
+            hashes[f] = None
+        for fn in fns:
+            hashes[fn] = hash_file(fn, manifest)
+    return hashes
+
+def params_hash(s):
+    """
+    Returns the hash of the stage's commands and parameters.
+    """
+    return hashlib.sha1(json.dumps([s['commands'], s['params']],
+                                   sort_keys=True, default=str)
+                        .encode('utf-8')).hexdigest()
+
+def stage_record(s, manifest):
+    """
+    Returns the hashes of the stage's parameters and input files, as they
+    are now.
+    """
+    return {'params': params_hash(s),
+            'inputs': {f: hash_file(f, manifest) for f in input_files(s)}}
+
+def is_up_to_date(s, manifest):
+    """
+    Returns True if the stage's parameters, code, and inputs haven't changed
+    since it last ran, and all of its outputs are the same as it made them.
+    """
+    last = manifest['stages'].get(s['name'])
+    if last is None:
+        return False
+    if last['params'] != params_hash(s):
+        return False
+    outputs = output_hashes(s, manifest)
+    if None in outputs.values() or outputs != last['outputs']:
+        return False
+    return last['inputs'] == stage_record(s, manifest)['inputs']
+
+def record_stage(s, record, manifest):
+    """
+    Save the stage's input hashes from before it ran, and its output hashes.
+    """
+    record['outputs'] = output_hashes(s, manifest)
+    manifest['stages'][s['name']] = record
+
+def read_manifest():
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            return json.load(f)
+    return {'files': {}, 'stages': {}}
+
+def write_manifest(manifest):
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(manifest_file + '.tmp', manifest_file)
+
+def _run_stage(commands):
+    """
+    Run each of a stage's scripts in this process, as if they were run
+    from the command line.
+    """
+    for script, args in commands:
+        sys.argv = [script] + args
+        try:
+            runpy.run_path(script, run_name='__main__')
+        finally:
+            # This process doesn't run exit handlers when it's done
+            Profiling.finish_script()
+
+def run_pipeline(stages, upstream, manifest, n_jobs=None, force=False,
+                 finished=(), failed=()):
+    """
+    Run the stages which aren't up to date, each one once all of the stages
+    it depends on have finished. Up to n_jobs stages run at the same time
+    (all CPUs if None). The manifest is updated after each stage finishes.
+
+    finished and failed are stages which were already run (e.g. by an
+    earlier call to this function).
+
+    Returns
+    -------
+    finished, failed : lists
+        names of stages which finished (or were up to date), and which
+        failed or weren't run because a stage they depend on failed
+    """
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+
+    pending = [s for s in stages]
+    running = {}
+    finished = list(finished)
+    failed = list(failed)
+
+    while pending or running:
+        for s in list(pending):
+            deps = upstream[s['name']]
+            if any([d in failed for d in deps]):
+                print('Not running {} because a stage it needs '
+                      'failed'.format(s['name']))
+                failed.append(s['name'])
+                pending.remove(s)
+            elif all([d in finished for d in deps]) and len(running) < n_jobs:
+                pending.remove(s)
+                if not force and is_up_to_date(s, manifest):
+                    print('{} is up to date'.format(s['name']))
+                    finished.append(s['name'])
+                    continue
+                print('Running {}...'.format(s['name']))
+                # Hash the inputs before the stage runs, so that the stage
+                # re-runs if they change while it's running
+                record = stage_record(s, manifest)
+                p = multiprocessing.Process(target=_run_stage,
+                                            args=(s['commands'],))
+                p.start()
+                running[s['name']] = (p, s, record, time.time())
+
+        for name, (p, s, record, start) in list(running.items()):
+            if p.is_alive():
+                continue
+            p.join()
+            del running[name]
+            if p.exitcode == 0:
+                print('Running {}... Finished in {:.1f} s'.format(
+                    name, time.time() - start))
+                finished.append(name)
+                record_stage(s, record, manifest)
+                write_manifest(manifest)
+            else:
+                print('Running {}... Failed (exit code {})'.format(
+                    name, p.exitcode))
+                failed.append(name)
+        time.sleep(0.1)
+
+    return finished, failed
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument('--stages', help='stages or groups of stages to run, '
+        + 'with the stages they depend on. Groups are named after the '
+        + 'Makefile targets: clean_data, ' + ', '.join(sorted(GROUPS))
+        + ' (default: %(default)s)', nargs='+',
+        default=DEFAULT_STAGES)
+    p.add_argument('--n-jobs', help='number of stages to run at the same '
+        + 'time [default: all CPUs]', default=None, type=int)
+    p.add_argument('--force', help='run all of the selected stages, even if '
+        + 'they are up to date', action='store_true')
+    p.add_argument('--record', help='save the hashes of the selected '
+        + 'stages\' current inputs and outputs in the manifest, without '
+        + 'running them (e.g. for files made by make)', action='store_true')
+    p.add_argument('--list', help='print the stages and their commands, and '
+        + 'exit', action='store_true')
+    args = p.parse_args()
+    start = time.time()
+    Profiling.profile_script()
+
+    stages, upstream = select_stages(make_stages(), args.stages)
+
+    if args.list:
+        for s in stages:
+            print(s['name'] + ':')
+            for script, script_args in s['commands']:
+                print('    python ' + ' '.join([script] + script_args))
+        sys.exit(0)
+
+    manifest = read_manifest()
+
+    if args.record:
+        for s in stages:
+            if None not in output_hashes(s, manifest).values():
+                record_stage(s, stage_record(s, manifest), manifest)
+            else:
+                print('Not recording {}: some of its outputs are '
+                      'missing'.format(s['name']))
+        write_manifest(manifest)
+        sys.exit(0)
+
+    # Clean the raw data first, so that the clean tables can then be read
+    # once, before the analysis stages are forked from this process
+    cleaning = [s for s in stages if s['name'].startswith('clean_')]
+    finished, failed = run_pipeline(cleaning, upstream, manifest,
+                                    n_jobs=args.n_jobs, force=args.force)
+
+    analyses = [s for s in stages if not s['name'].startswith('clean_')]
+    reads_clean = [s for s in analyses if CLEAN in s['inputs']
+                   and (args.force or not is_up_to_date(s, manifest))]
+    if len(reads_clean) > 0:
+        print('Reading clean tables...')
+        fio.cache_clean_tables(fio.get_dataset_ids(clean_dir), clean_dir)
+
+    finished, failed = run_pipeline(analyses, upstream, manifest,
+                                    n_jobs=args.n_jobs, force=args.force,
+                                    finished=finished, failed=failed)
+    write_manifest(manifest)
+    if Profiling.ENABLED:
+        Profiling.finish_script()
+        Profiling.print_summary(Profiling.REPORT, since=start)
+    if len(failed) > 0:
+        print('Failed stages: ' + ', '.join(failed))
+        sys.exit(1)
@@ -13,6 +13,7 @@ import os, sys
 src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
 from Formatting import reorder_index_from_tree
+from Profiling import profile_script
 
 p = argparse.ArgumentParser()
 p.add_argument('--disease-df', help='file with disease-wise significant bugs')
@@ -23,6 +24,7 @@ p.add_argument('--do-qvals', help='whether to reorder the given qvalues file.',
     action='store_true')
 p.add_argument('fntree', help='path to tree file (newick)')
 args = p.parse_args()
+profile_script()
 
 if args.qvalues is not None:
     sig_otus = pd.read_csv(args.qvalues, sep='\t', index_col=0).index
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+This script scores new samples with the pooled healthy vs. disease
+classifier saved by healthy_disease_classifier.py (with --pooled-model).
+It reads a raw OTU table in batches and writes the probability that each
+sample comes from a case patient.
+"""
+import argparse
+import numpy as np
+import pandas as pd
+
+# Add this repo to the path
+import os, sys
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
+sys.path.insert(0, src_dir)
+import ModelStore as ms
+from util import raw2abun, collapse_taxonomic_contents_df
+from Profiling import profile_script
+
+def load_pooled_model(fn, n_jobs=1):
+    """
+    Load the pooled classifier record saved by healthy_disease_classifier.py.
+
+    Parameters
+    ----------
+    fn : str
+        path to the saved model
+    n_jobs : int
+        number of processes the classifier uses to score samples
+        (-1 for all CPUs)
+
+    Returns
+    -------
+    record : dict
+        {'model': trained RandomForestClassifier,
+         'features': list of genera, in the order the model expects,
+         'level': taxonomic level of the features, ...}
+    """
+    record = ms.load_model_file(fn)
+    record['model'].set_params(n_jobs=n_jobs)
+    return record
+
+def align_to_features(df, features, level='genus'):
+    """
+    Convert a raw OTU table into relative abundances of the model's
+    features, in the same way as the training data.
+
+    Parameters
+    ----------
+    df : pandas DataFrame
+        raw counts, samples in rows and OTUs in columns. OTU names are
+        the full taxonomy, as in the raw OTU tables.
+    features : list
+        the model's features (e.g. full genus-level taxonomies)
+    level : str
+        taxonomic level of the features
+
+    Returns
+    -------
+    abun : pandas DataFrame
+        samples in rows, features in columns in the same order as features.
+        Features which are not in df are zero. Taxa in df which are not
+        features are discarded.
+    reads : pandas Series
+        total reads per sample
+    found : set
+        features which were in df
+    """
+    reads = df.sum(axis=1)
+    abun = collapse_taxonomic_contents_df(raw2abun(df), level)
+    found = set(abun.columns).intersection(features)
+    abun = abun.reindex(columns=features, fill_value=0.0)
+    return abun, reads, found
+
+def score_batch(record, df):
+    """
+    Score one batch of samples with the pooled classifier.
+
+    Parameters
+    ----------
+    record : dict
+        from load_pooled_model()
+    df : pandas DataFrame
+        raw counts, samples in rows and OTUs in columns
+
+    Returns
+    -------
+    scores : pandas DataFrame
+        samples in rows, with columns 'p_disease' (probability of being
+        a case, NaN for samples without any reads), 'n_reads', and
+        'frac_in_model' (the fraction of each sample's reads which are
+        in the model's features)
+    found : set
+        the model features which were in df
+    """
+    rf = record['model']
+    abun, reads, found = align_to_features(df, record['features'],
+                                           record.get('level', 'genus'))
+
+    scores = pd.DataFrame(index=abun.index)
+    scores['p_disease'] = np.nan
+    scores['n_reads'] = reads
+    scores['frac_in_model'] = abun.sum(axis=1)
+
+    has_reads = (reads > 0).values
+    if has_reads.any():
+        dis_col = list(rf.classes_).index(1)
+        scores.loc[has_reads, 'p_disease'] = \
+            rf.predict_proba(abun.values[has_reads])[:, dis_col]
+    return scores, found
+
+def read_otu_batches(fn, batch_size, table_type='classic'):
+    """
+    Read a raw tab-delimited OTU table in batches of samples.
+
+    Parameters
+    ----------
+    fn : str
+        path to OTU table
+    batch_size : int
+        number of samples per batch
+    table_type : str
+        'normal' (samples in rows, OTUs in columns) or 'classic' (OTUs in
+        rows, samples in columns), as in the yaml file. Normal tables are
+        streamed, but classic tables have to be read in fully to be
+        transposed.
+
+    Yields
+    ------
+    df : pandas DataFrame
+        counts, with samples in rows and OTUs in columns
+    """
+    if table_type == 'normal':
+        for df in pd.read_csv(fn, sep='\t', index_col=0,
+                              chunksize=batch_size):
+            df.index = df.index.astype(str)
+            yield df
+    else:
+        df = pd.read_csv(fn, sep='\t', index_col=0).T
+        df.index = df.index.astype(str)
+        for i in range(0, df.shape[0], batch_size):
+            yield df.iloc[i:i + batch_size]
+
+def score_table(record, fn, fnout, batch_size=10000, table_type='classic'):
+    """
+    Score all samples in an OTU table, writing results batch by batch.
+
+    Returns the number of samples scored and the set of model features
+    which were found in the table.
+    """
+    n_smpls = 0
+    found = set()
+    with open(fnout, 'w') as f:
+        for i, df in enumerate(read_otu_batches(fn, batch_size, table_type)):
+            scores, batch_found = score_batch(record, df)
+            found.update(batch_found)
+            scores.to_csv(f, sep='\t', header=(i == 0), index_label='sample')
+            n_smpls += scores.shape[0]
+            print(n_smpls),
+    return n_smpls, found
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument('model', help='pooled classifier file saved by '
+        + 'healthy_disease_classifier.py --pooled-model')
+    p.add_argument('otu_table', help='raw tab-delimited OTU table with counts '
+        + 'and full taxonomies as OTU names')
+    p.add_argument('out_file', help='file to write probabilities to')
+    p.add_argument('--table-type', help='"classic" if OTUs are in rows and '
+        + 'samples in columns, "normal" if samples are in rows. Normal tables '
+        + 'are read in batches (default: %(default)s)',
+        choices=['classic', 'normal'], default='classic')
+    p.add_argument('--batch-size', help='number of samples to score at a '
+        + 'time (default: %(default)s)', default=10000, type=int)
+    p.add_argument('--n-jobs', help='number of processes to score with '
+        + '(default: %(default)s, all CPUs)', default=-1, type=int)
+    args = p.parse_args()
+    profile_script()
+
+    record = load_pooled_model(args.model, n_jobs=args.n_jobs)
+    print('Scoring samples...')
+    n_smpls, found = score_table(record, args.otu_table, args.out_file,
+                                 batch_size=args.batch_size,
+                                 table_type=args.table_type)
+    print('\nScoring samples... Finished.')
+
+    missing = len(record['features']) - len(found)
+    if missing > 0:
+        print('{} of the {} genera in the model were not in the OTU table, '
+              'and were scored as zero.'.format(missing,
+                                                len(record['features'])))
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+"""
+This script runs a local HTTP service which scores OTU count vectors with
+the pooled healthy vs. disease classifier (from healthy_disease_classifier.py
+--pooled-model) and the per-dataset classifiers (from classifiers.py
+--model-store). Models stay loaded between requests, and requests which
+arrive at the same time are scored together in one batch.
+
+Endpoints:
+    POST /score
+        {"otus": [full taxonomy for each OTU],
+         "counts": [[count of each OTU] for each sample],
+         "samples": [sample IDs] (optional),
+         "model": "pooled" or a dataset ID (optional, default "pooled")}
+        returns {"model": ..., "samples": [...], "p_disease": [...]}.
+        p_disease is null for samples without any reads.
+    GET /models
+        names of the loaded models
+    GET /stats
+        number of requests, batch sizes, and latency percentiles (in ms)
+"""
+import argparse
+import json
+import time
+import threading
+import collections
+import numpy as np
+from scipy import sparse
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    import Queue as queue
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    import queue
+
+# Add this repo to the path
+import os, sys
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
+sys.path.insert(0, src_dir)
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/analysis'))
+sys.path.insert(0, src_dir)
+import ModelStore as ms
+from score_samples import load_pooled_model
+
+# Names of the held-out and pooled classifiers which
+# healthy_disease_classifier.py keeps in its model store
+HDC_PREFIXES = ('dataset_out_', 'disease_out_', 'pooled_healthy_disease')
+# Number of semicolon-delimited levels kept by collapse_taxonomic_contents_df
+TAX_LEVELS = {'kingdom': 1, 'phylum': 2, 'class': 3, 'order': 4,
+              'family': 5, 'genus': 6, 'species': 7}
+
+class FeatureAligner(object):
+    """
+    Maps OTU taxonomy strings onto one model's feature columns, in the same
+    way as collapse_taxonomic_contents_df() followed by reindexing to the
+    model's features. Each taxonomy string is parsed only the first time
+    it's seen.
+    """
+    def __init__(self, features, level='genus', max_cache=1000000):
+        self.n_features = len(features)
+        self.n_levels = TAX_LEVELS[level]
+        self.feature_index = {f: i for i, f in enumerate(features)}
+        self.max_cache = max_cache
+        self.cache = {}
+
+    def column(self, otu):
+        """
+        Returns the feature column that otu is summed into, or -1 if it
+        isn't in any of the features (or is unannotated at this level).
+        """
+        try:
+            return self.cache[otu]
+        except KeyError:
+            pass
+        taxon = ';'.join(otu.split(';')[:self.n_levels])
+        if taxon.endswith('__'):
+            col = -1
+        else:
+            col = self.feature_index.get(taxon, -1)
+        if len(self.cache) >= self.max_cache:
+            self.cache = {}
+        self.cache[otu] = col
+        return col
+
+    def align(self, otus, counts):
+        """
+        Convert raw counts into relative abundances of the model's features.
+
+        Parameters
+        ----------
+        otus : list of str
+            full taxonomy for each OTU
+        counts : array-like, shape = [n_samples, n_otus]
+
+        Returns
+        -------
+        abun : numpy array, shape = [n_samples, n_features]
+            relative abundances (rows with zero reads are all zero)
+        reads : numpy array
+            total reads per sample
+        """
+        counts = np.asarray(counts, dtype=float)
+        if counts.ndim != 2 or counts.shape[1] != len(otus):
+            raise ValueError('counts should have one row per sample and '
+                             'one column per OTU')
+        cols = np.array([self.column(o) for o in otus], dtype=int)
+        keep = np.flatnonzero(cols >= 0)
+        # (n_otus x n_features) indicator matrix to sum OTUs into features
+        collapse = sparse.csr_matrix(
+            (np.ones(len(keep)), (keep, cols[keep])),
+            shape=(len(otus), self.n_features))
+        abun = np.asarray(collapse.T.dot(counts.T).T)
+
+        reads = counts.sum(axis=1)
+        has_reads = reads > 0
+        abun[has_reads] /= reads[has_reads][:, np.newaxis]
+        return abun, reads
+
+class ServedModel(object):
+    """
+    One model being served. Cross-validated models (from classifiers.py)
+    have one classifier per fold, and their probabilities are averaged.
+    """
+    def __init__(self, name, models, features, level='genus'):
+        self.name = name
+        self.models = models
+        self.aligner = FeatureAligner(features, level)
+
+    def predict(self, X):
+        probs = [rf.predict_proba(X)[:, list(rf.classes_).index(1)]
+                 for rf in self.models]
+        return np.mean(probs, axis=0)
+
+class MicroBatcher(object):
+    """
+    Collects the samples from requests for one model which arrive within
+    max_wait seconds of each other (up to max_batch samples) and scores
+    them together, since predicting many samples at once is much faster
+    than predicting them one request at a time.
+    """
+    def __init__(self, model, max_batch=1024, max_wait=0.005):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.batch_sizes = collections.deque(maxlen=10000)
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def score(self, X):
+        """
+        Score samples in X. Blocks until the batch they're in is scored.
+        """
+        item = {'X': X, 'done': threading.Event()}
+        self.queue.put(item)
+        item['done'].wait()
+        if 'error' in item:
+            raise item['error']
+        return item['probs']
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            n_smpls = items[0]['X'].shape[0]
+            deadline = time.time() + self.max_wait
+            while n_smpls < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                items.append(item)
+                n_smpls += item['X'].shape[0]
+
+            try:
+                probs = self.model.predict(np.vstack([i['X'] for i in items]))
+            except Exception as e:
+                for i in items:
+                    i['error'] = e
+            else:
+                start = 0
+                for i in items:
+                    end = start + i['X'].shape[0]
+                    i['probs'] = probs[start:end]
+                    start = end
+            self.batch_sizes.append(n_smpls)
+            for i in items:
+                i['done'].set()
+
+class LatencyStats(object):
+    """
+    Keeps the latencies of the most recent requests.
+    """
+    def __init__(self, maxlen=10000):
+        self.latencies = collections.deque(maxlen=maxlen)
+        self.n_requests = 0
+        self.n_errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, error=False):
+        with self.lock:
+            self.latencies.append(1000*seconds)
+            self.n_requests += 1
+            self.n_errors += int(error)
+
+    def summary(self):
+        with self.lock:
+            lat = np.array(self.latencies)
+            d = {'n_requests': self.n_requests, 'n_errors': self.n_errors}
+        for q in [50, 90, 95, 99]:
+            d['p{}_ms'.format(q)] = \
+                float(np.percentile(lat, q)) if len(lat) else None
+        d['max_ms'] = float(lat.max()) if len(lat) else None
+        return d
+
+def load_served_models(pooled_model=None, store_dir=None):
+    """
+    Load the pooled classifier and/or the cross-validated per-dataset
+    classifiers in a model store.
+
+    Returns
+    -------
+    served : dict
+        {name: ServedModel}. The pooled classifier is 'pooled'. Per-dataset
+        genus-level classifiers are named by dataset ID, and classifiers
+        with other feature sets are '<dataset ID>.<feature set>'. If there
+        are multiple models for one dataset, the newest one is used.
+    """
+    served = {}
+    if pooled_model is not None:
+        record = load_pooled_model(pooled_model)
+        served['pooled'] = ServedModel('pooled', [record['model']],
+                                       record['features'],
+                                       record.get('level', 'genus'))
+
+    # Keys are '<name>.<feature set>.<hash>', oldest first. Skip other
+    # files (e.g. a pooled model saved in the same directory) and the
+    # classifiers from healthy_disease_classifier.py without loading them.
+    # The pooled classifier is served from its own file.
+    for key in ms.stored_keys(store_dir):
+        parts = ms.split_key(key)
+        if parts is None:
+            continue
+        name, feature_set, _ = parts
+        if name.startswith(HDC_PREFIXES):
+            continue
+        record = ms.load_models(store_dir, key)
+        if 'models' not in record:
+            continue
+        if feature_set != 'genus':
+            name = name + '.' + feature_set
+        print(name),
+        served[name] = ServedModel(name, record['models'], record['features'],
+                                   record.get('level', 'genus'))
+    return served
+
+class ScoringHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, code, d):
+        body = json.dumps(d).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/models':
+            self.send_json(200, {'models': sorted(self.server.batchers)})
+        elif self.path == '/stats':
+            d = self.server.stats.summary()
+            d['mean_batch_size'] = {
+                name: float(np.mean(b.batch_sizes)) if len(b.batch_sizes)
+                      else None
+                for name, b in self.server.batchers.items()}
+            self.send_json(200, d)
+        else:
+            self.send_json(404, {'error': 'unknown path ' + self.path})
+
+    def do_POST(self):
+        if self.path != '/score':
+            self.send_json(404, {'error': 'unknown path ' + self.path})
+            return
+        t0 = time.time()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            name = request.get('model', 'pooled')
+            if name not in self.server.batchers:
+                raise ValueError('unknown model ' + str(name))
+            batcher = self.server.batchers[name]
+
+            abun, reads = batcher.model.aligner.align(request['otus'],
+                                                      request['counts'])
+            samples = request.get('samples', list(range(abun.shape[0])))
+            if len(samples) != abun.shape[0]:
+                raise ValueError('samples and counts have different lengths')
+        except (ValueError, KeyError, TypeError) as e:
+            self.server.stats.record(time.time() - t0, error=True)
+            self.send_json(400, {'error': str(e)})
+            return
+
+        # Samples without any reads don't get scored
+        probs = [None]*len(samples)
+        has_reads = np.flatnonzero(reads > 0)
+        try:
+            if len(has_reads) > 0:
+                for i, p in zip(has_reads, batcher.score(abun[has_reads])):
+                    probs[i] = float(p)
+        except Exception as e:
+            self.server.stats.record(time.time() - t0, error=True)
+            self.send_json(500, {'error': str(e)})
+            return
+
+        self.server.stats.record(time.time() - t0)
+        self.send_json(200, {'model': name, 'samples': samples,
+                             'p_disease': probs})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class ScoringServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, served, max_batch=1024, max_wait=0.005,
+                 verbose=False):
+        HTTPServer.__init__(self, address, ScoringHandler)
+        self.batchers = {name: MicroBatcher(m, max_batch, max_wait)
+                         for name, m in served.items()}
+        self.stats = LatencyStats()
+        self.verbose = verbose
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument('--pooled-model', help='pooled classifier file saved by '
+        + 'healthy_disease_classifier.py --pooled-model', default=None)
+    p.add_argument('--model-store', help='model store directory with '
+        + 'per-dataset classifiers saved by classifiers.py', default=None)
+    p.add_argument('--host', help='address to listen on. Only local by '
+        + 'default (default: %(default)s)', default='127.0.0.1')
+    p.add_argument('--port', help='port (default: %(default)s)',
+        default=8765, type=int)
+    p.add_argument('--max-batch', help='maximum samples scored in one batch '
+        + '(default: %(default)s)', default=1024, type=int)
+    p.add_argument('--max-wait-ms', help='how long to wait for other '
+        + 'requests to batch with, in milliseconds (default: %(default)s)',
+        default=5.0, type=float)
+    p.add_argument('--verbose', help='flag to log every request',
+        action='store_true')
+    args = p.parse_args()
+
+    print('Loading models...')
+    served = load_served_models(args.pooled_model, args.model_store)
+    if len(served) == 0:
+        raise ValueError('No models to serve. Give --pooled-model and/or '
+                         '--model-store.')
+    print('\nLoading models... Finished. Serving {} models on {}:{}'.format(
+        len(served), args.host, args.port))
+
+    server = ScoringServer((args.host, args.port), served,
+                           max_batch=args.max_batch,
+                           max_wait=args.max_wait_ms/1000.0,
+                           verbose=args.verbose)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats.summary()))
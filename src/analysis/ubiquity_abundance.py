@@ -16,7 +16,11 @@ import os, sys
 src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
 import FileIO as fio
-import util
+import SummaryStats as ss
+from Profiling import profile_script, profile_dataset, finish_dataset
+
+# Patient groups: all patients, healthy patients, and case patients
+PATIENT_GROUPS = ['total', 'dis', 'h']
 
 def read_all_and_return_abun_ubiquity(datadir, fnpvals):
     """
@@ -26,8 +30,8 @@ def read_all_and_return_abun_ubiquity(datadir, fnpvals):
     Parameters
     ----------
     datadir : str
-        path to directory with *.otu_table.clean.feather and
-        *.metadata.clean.feather files
+        path to directory with *.summary.clean.npz files (the per-dataset
+        summary statistics written with the clean tables)
     fnpvals : str
         path to file with 'overall' significant bugs (should have column labeled
         'overall' and OTUs in rows)
@@ -47,67 +51,43 @@ def read_all_and_return_abun_ubiquity(datadir, fnpvals):
           color: float or str, {RGBA values or 'k'}
           overall_significance: str, {'not_sig', 'disease', 'health', 'mixed'}
     """
-    toconcat = []
+    # Running per-genus totals for each patient group. The genus-level
+    # totals of each dataset are read from its summary statistics, so the
+    # OTU tables aren't read.
+    acc = {g: None for g in PATIENT_GROUPS}
     print('Reading datasets...')
     datasetids = fio.get_dataset_ids(datadir)
     for dataset in datasetids:
         print(dataset),
-        ## Read dataset
-        df, meta = fio.read_dataset_files(dataset, datadir)
-        df = util.raw2abun(df)
-
-        ## Collapse to genus level
-        df = util.collapse_taxonomic_contents_df(df, 'genus')
-        classes_list = fio.get_classes(meta)
-        [ctrl_smpls, dis_smpls] = fio.get_samples(meta, classes_list)
-
-        ## Do calculations for all patients
-        # Note: dis_smpls and ctrl_smpls sometimes just grabs a subset of
+        profile_dataset(dataset)
+        summary = fio.read_dataset_summary(dataset, datadir)
+        labels = [str(g) for g in summary['groups']]
+        classes_list = fio.get_classes(pd.DataFrame({'DiseaseState': labels}))
+        [ctrl_labels, dis_labels] = classes_list
+
+        ## DiseaseState labels in each patient group
+        # Note: dis_labels and ctrl_labels sometimes just grabs a subset of
         # patients. e.g. in CRC studies, this discards adenoma patients
-        #all_smpls = ctrl_smpls + dis_smpls
-        all_smpls = list(df.index)
-        # tmp is a DataFrame with the calculations for different patient
-        # groups in the columns, genera in rows
-        tmp = pd.DataFrame(df.loc[all_smpls].sum(),
-                           columns=['total_total_abun'])
-        tmp['total_present'] = df.loc[all_smpls]\
-                                 .applymap(lambda x: 1 if x else 0)\
-                                 .sum()
-        tmp['total_samples'] = len(all_smpls)
-
-        ## Do calculations across healthy patients only
-        H_smpls = meta.query('DiseaseState == "H"').index
-        if len(H_smpls) > 0:
-            tmp['total_h_abun'] = df.loc[H_smpls].sum()
-            tmp['h_present'] = df.loc[H_smpls]\
-                                 .applymap(lambda x: 1 if x else 0)\
-                                 .sum()
-            tmp['h_samples'] = len(H_smpls)
-
+        # 'total' is all patients
+        groups = {'total': labels}
+        if 'H' in labels:
+            groups['h'] = ['H']
         else:
             # add the non-healthy controls to our disease patients
-            dis_smpls += ctrl_smpls
+            dis_labels = dis_labels + ctrl_labels
+        groups['dis'] = dis_labels
 
-        ## Do calculations across non-healthy patients
-        tmp['total_dis_abun'] = df.loc[dis_smpls].sum()
-        tmp['dis_present'] = df.loc[dis_smpls]\
-                               .applymap(lambda x: 1 if x else 0)\
-                               .sum()
-        tmp['dis_samples'] = len(dis_smpls)
-
-        tmp['dataset'] = dataset
-        tmp['otu'] = tmp.index
-
-        toconcat.append(tmp)
-
-    df = pd.concat(toconcat, ignore_index=True)
+        stats = dataset_group_stats(summary, groups)
+        for g in groups:
+            acc[g] = accumulate(acc[g], stats, g)
+    finish_dataset()
 
     # Calculate ubiquity and abundance metrics for genera
-    # df now has many columns, see the calculate_ubiquity_and_abun docstring
-    # for these columns
-    df = calculate_ubiquity_and_abun(df, 'h')
-    df = calculate_ubiquity_and_abun(df, 'dis')
-    df = calculate_ubiquity_and_abun(df, 'total')
+    # df has one row per genus, see the summarize_ubiquity_and_abun
+    # docstring for these columns
+    df = pd.concat([summarize_ubiquity_and_abun(acc[g], g)
+                    for g in PATIENT_GROUPS], axis=1)
+    df['otu'] = df.index
 
     # Turn into tidy df with 'metric', 'calculation', and 'patient' columns
     tidy = tidyfy_df(df)
@@ -132,83 +112,117 @@ def read_all_and_return_abun_ubiquity(datadir, fnpvals):
 
     return tidy
 
-def calculate_ubiquity_and_abun(df, patient_type):
+def dataset_group_stats(summary, groups):
     """
-    Use groupby-fu to calculate the ubiquity and abundance of genera
-    across patients of patient_type.
+    Get the total abundance, number of samples with each genus present,
+    and number of samples in each patient group of one dataset, from its
+    summary statistics.
 
     Parameters
     ----------
-    df : pandas dataframe
-        df with the following columns: '<H/dis/total>_present',
-        '<H/dis/total>_samples', 'total_<H/dis/total>_abun', and 'otu'
-    patient_type : str
-        'H', 'dis', or 'total'. Type of patient to calculate stuff over.
+    summary : dict
+        genus-level summary statistics of the dataset (see SummaryStats.py)
+    groups : dict
+        {patient group: list of the DiseaseState labels in the group}
 
     Returns
     -------
-    df : pandas dataframe
-        modified input df (not modified in place) with additional columns:
-        'ubiquity_in_one_dataset_<h/dis/total>',
-        'mean_abundance_in_one_dataset_<h/dis/total>',
-        'ubiquity_mean_of_datasets_<h/dis/total>',
-        'ubiquity_from_pooled_calc_<h/dis/total>',
-        'abundance_mean_of_dataset_<h/dis/total>',
-        'abundance_from_pooled_calc_<h/dis/total>'
+    stats : pandas dataframe
+        genera in rows, with 'total_<group>_abun', '<group>_present', and
+        '<group>_samples' columns for each group in groups
     """
-    if patient_type == 'H' or patient_type == 'h':
-        coltype = 'h'
-    elif patient_type == 'dis':
-        coltype = 'dis'
-    elif patient_type == 'total':
-        coltype = 'total'
-    else:
-        print('Unknown patient type.')
-
-    ## Calculate various metrics per OTU using different types of averages
-    #(average of dataset-wise average, overall average)
-
-    ## Ubiquity of OTUs
-    # samples with OTU present / total samples
-    df['ubiquity_in_one_dataset_' + coltype] = \
-        df[coltype + '_present'].astype(float)/df[coltype + '_samples']
-
-    # Get the mean of individual dataset's ubiquities, for each OTU
-    # Turn that series into a dataframe and merge it with the existing df
-    # on the 'otu' column to add the 'ubiquity_mean_of_datasets' column
-    # to the original df
-    df = (df.groupby('otu') \
-            .mean()['ubiquity_in_one_dataset_' + coltype] \
-            .to_frame('ubiquity_mean_of_datasets_' + coltype)) \
-            .merge(df,right_on='otu', left_index=True)
+    stats = pd.DataFrame(index=summary['genera'])
+    for g in groups:
+        pooled = ss.pool_groups(summary, groups[g])
+        stats['total_' + g + '_abun'] = pooled['sum']
+        stats[g + '_present'] = pooled['present'].astype(float)
+        stats[g + '_samples'] = float(pooled['n_samples'])
+    return stats
+
+def accumulate(acc, stats, patient_type):
+    """
+    Add one dataset's stats (from dataset_group_stats()) for patient_type
+    to the running per-genus totals in acc.
 
-    # Overall ubiquity is the sum of all samples with the OTU present,
-    # divided by all the samples total
-    df = (df.groupby('otu').sum()[coltype + '_present'] \
-          / df.groupby('otu').sum()[coltype + '_samples']) \
-          .to_frame(name='ubiquity_from_pooled_mean_' + coltype) \
-          .merge(df, right_on='otu', left_index=True)
+    Parameters
+    ----------
+    acc : pandas dataframe or None
+        running totals from the previous datasets, genera in rows and
+        'ubiquity_sum', 'ubiquity_n', 'abundance_sum', 'abundance_n',
+        'present', 'samples', and 'abun' in columns. None before the
+        first dataset.
+    stats : pandas dataframe
+        from dataset_group_stats()
+    patient_type : str
+        'h', 'dis', or 'total'
 
-    ## Abundance - consider abundance across *only* samples who have the bug
-    # Mean of dataset-wise mean abundances
-    # First get the mean abundance of the OTU in each dataset
-    df['mean_abundance_in_one_dataset_' + coltype] = \
-            df['total_' + coltype + '_abun'] / df[coltype + '_present']
+    Returns
+    -------
+    acc : pandas dataframe
+        updated running totals. Genera which weren't in acc yet are added.
+    """
+    coltype = patient_type
+    ## Ubiquity in this dataset: samples with genus present / total samples
+    ubiquity = stats[coltype + '_present']/stats[coltype + '_samples']
+    ## Abundance in this dataset, across *only* samples who have the bug.
+    # This is NaN if no samples have the bug, and then the dataset isn't
+    # included in the mean of datasets.
+    abundance = stats['total_' + coltype + '_abun'] / stats[coltype + '_present']
+
+    new = pd.DataFrame({'ubiquity_sum': ubiquity,
+                        'ubiquity_n': 1.0,
+                        'abundance_sum': abundance.fillna(0.0),
+                        'abundance_n': abundance.notnull().astype(float),
+                        'present': stats[coltype + '_present'],
+                        'samples': stats[coltype + '_samples'],
+                        'abun': stats['total_' + coltype + '_abun']})
+    if acc is None:
+        return new
+    return acc.add(new, fill_value=0.0)
+
+def summarize_ubiquity_and_abun(acc, patient_type):
+    """
+    Calculate the ubiquity and abundance of genera across patients of
+    patient_type, from the running totals from accumulate().
 
-    # Then take the mean of those means for each OTU
-    # And merge with the original df to create 'abundance_mean_of_datasets' col
-    df = (df.groupby('otu') \
-            .mean()['mean_abundance_in_one_dataset_' + coltype] \
-            .to_frame('abundance_mean_of_datasets_' + coltype)) \
-            .merge(df,right_on='otu', left_index=True)
+    Parameters
+    ----------
+    acc : pandas dataframe or None
+        totals over all datasets from accumulate(). None if no datasets
+        have this patient type.
+    patient_type : str
+        'h', 'dis', or 'total'
 
+    Returns
+    -------
+    df : pandas dataframe
+        genera in rows, with columns:
+        'abundance_from_pooled_mean_<h/dis/total>',
+        'abundance_mean_of_datasets_<h/dis/total>',
+        'ubiquity_from_pooled_mean_<h/dis/total>',
+        'ubiquity_mean_of_datasets_<h/dis/total>'
+        Values are NaN for genera which are not in any dataset with this
+        patient type.
+    """
+    coltype = patient_type
+    cols = ['abundance_from_pooled_mean_' + coltype,
+            'abundance_mean_of_datasets_' + coltype,
+            'ubiquity_from_pooled_mean_' + coltype,
+            'ubiquity_mean_of_datasets_' + coltype]
+    if acc is None:
+        return pd.DataFrame(columns=cols, dtype=float)
+
+    df = pd.DataFrame(index=acc.index)
     # Mean abundance overall: total abundance across all studies divided
     # by total number of samples with the OTU present across all studies
-    df = (df.groupby('otu').sum()['total_' + coltype + '_abun'] \
-          / df.groupby('otu').sum()[coltype + '_present']) \
-          .to_frame(name='abundance_from_pooled_mean_' + coltype) \
-          .merge(df, right_on='otu', left_index=True)
-
+    df[cols[0]] = acc['abun'] / acc['present']
+    # Mean of dataset-wise mean abundances
+    df[cols[1]] = acc['abundance_sum'] / acc['abundance_n']
+    # Overall ubiquity is the sum of all samples with the OTU present,
+    # divided by all the samples total
+    df[cols[2]] = acc['present'] / acc['samples']
+    # Mean of individual dataset's ubiquities
+    df[cols[3]] = acc['ubiquity_sum'] / acc['ubiquity_n']
     return df
 
 def tidyfy_df(df):
@@ -245,6 +259,7 @@ p.add_argument('fnoverall', help='file with the "overall" significance')
 p.add_argument('out', help='file to write results to')
 
 args = p.parse_args()
+profile_script()
 
 tidy = read_all_and_return_abun_ubiquity(args.datadir, args.fnoverall)
 tidy.to_csv(args.out, sep='\t')
@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+"""
+This script checks that a changed version of the code (by default, the
+working tree) gives the same results as a reference version (by default,
+the last commit), and how much faster it is.
+
+It runs the same analysis stages (as defined in src/analysis/pipeline.py,
+i.e. the Makefile rules) with each version of the code, on the same clean
+tables, in separate copies of the repo under --work-dir. Each version runs
+the commands of its own pipeline.py, so that options which were added
+since (e.g. --model-store) aren't passed to older code. Versions from
+before pipeline.py existed run this version's commands, without the
+options which their scripts don't have. Then it compares
+each tab-delimited output file of the two versions: the rows and columns
+must be the same, non-numeric values must be identical, and numeric values
+must be within the stage's tolerance (see TOLERANCES), with NaN's in the
+same places. Other output files (e.g. saved models) aren't compared.
+
+It prints (and writes to <work_dir>/equivalence_report.txt) one row per
+output file with the result of the comparison, the largest differences,
+and the time each version took to run the stage, and exits with an error
+if any output differs.
+
+The stages which shuffle data without a fixed seed (null_core_*) aren't
+reproducible, so they aren't run by default.
+
+Run it from the top directory of this repo, e.g.:
+    python src/benchmarks/check_equivalence.py --reference v1.0 \\
+        --stages qvals rf_results dysbiosis
+"""
+import argparse
+import glob
+import json
+import re
+import shutil
+import subprocess
+import tarfile
+import time
+import numpy as np
+import pandas as pd
+
+# Add this repo to the path
+import os, sys
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/analysis'))
+sys.path.insert(0, src_dir)
+from pipeline import make_stages, select_stages
+
+# Stages whose outputs are checked by default
+DEFAULT_STAGES = ['qvalues', 'split_qvalues', 'meta_qvalues', 'nocdi_overall',
+                  'stouffer', 'dysbiosis', 'split_dysbiosis', 'alpha',
+                  'rf_results', 'rf_core', 'rf_h_v_dis', 'split_rf',
+                  'ubiquity', 'logfold'] \
+                 + ['core_{}'.format(n) for n in range(2, 6)]
+
+# (rtol, atol) for numeric values in each stage's outputs. Counts and core
+# genus calls have to be exactly the same; statistics can differ by
+# floating point rounding.
+DEFAULT_TOLERANCE = (1e-9, 1e-12)
+TOLERANCES = {'meta_qvalues': (0, 0),
+              'nocdi_overall': (0, 0),
+              'dataset_info': (0, 0),
+              'split_dataset_info': (0, 0)}
+TOLERANCES.update({'core_{}'.format(n): (0, 0) for n in range(2, 6)})
+
+# Entries of data/ which are outputs, and aren't shared with the copies
+OUTPUT_DIRS = ['analysis_results', 'models', 'clean_tables']
+
+# Prints a copy's stage definitions, when run in the copy's directory
+STAGES_SCRIPT = ("import json, sys; sys.path.insert(0, 'src/analysis'); "
+                 "from pipeline import make_stages; "
+                 "print(json.dumps(make_stages()))")
+
+def make_tree(tree_dir, revision, clean_dir):
+    """
+    Make a copy of the repo in tree_dir to run the stages in. Its src/ is
+    the code at revision (or the working tree, if revision is None), its
+    data/clean_tables links to clean_dir, and it has empty
+    data/analysis_results and data/models directories. Everything else in
+    data/ links to this repo's data/.
+    """
+    if os.path.exists(tree_dir):
+        shutil.rmtree(tree_dir)
+    os.makedirs(os.path.join(tree_dir, 'data'))
+    if revision is None:
+        os.symlink(os.path.abspath('src'), os.path.join(tree_dir, 'src'))
+    else:
+        archive = os.path.join(tree_dir, 'src.tar')
+        subprocess.check_call(['git', 'archive', '-o', archive, revision,
+                               'src'])
+        with tarfile.open(archive) as tar:
+            tar.extractall(tree_dir)
+        os.remove(archive)
+
+    for entry in os.listdir('data'):
+        if entry not in OUTPUT_DIRS:
+            os.symlink(os.path.abspath(os.path.join('data', entry)),
+                       os.path.join(tree_dir, 'data', entry))
+    os.symlink(os.path.abspath(clean_dir),
+               os.path.join(tree_dir, 'data', 'clean_tables'))
+    for d in OUTPUT_DIRS[:2]:
+        os.makedirs(os.path.join(tree_dir, 'data', d))
+
+def tree_stages(tree_dir):
+    """
+    Read the stage definitions of the copy of the repo in tree_dir, from its
+    own src/analysis/pipeline.py.
+
+    Returns
+    -------
+    stages : dict, or None if the copy's code doesn't have pipeline.py
+        stages, keyed by their name
+    """
+    if not os.path.exists(os.path.join(tree_dir, 'src/analysis/pipeline.py')):
+        return None
+    out = subprocess.check_output([sys.executable, '-c', STAGES_SCRIPT],
+                                  cwd=tree_dir)
+    # Only the last line is the stages, in case importing anything prints
+    return {s['name']: s for s in json.loads(out.strip().splitlines()[-1])}
+
+def script_help(script, tree_dir, helps):
+    """
+    Returns the --help text of script in tree_dir ('' if it doesn't have
+    the script or its --help fails). helps caches the texts, keyed by
+    (tree_dir, script).
+    """
+    if (tree_dir, script) not in helps:
+        text = ''
+        if os.path.exists(os.path.join(tree_dir, script)):
+            try:
+                text = subprocess.check_output(
+                    [sys.executable, script, '--help'], cwd=tree_dir,
+                    stderr=subprocess.STDOUT)
+            except subprocess.CalledProcessError:
+                pass
+        helps[(tree_dir, script)] = text
+    return helps[(tree_dir, script)]
+
+def option_nargs(option, usage):
+    """
+    Returns the number of values that option takes, according to the
+    argparse usage text, or None if it takes any number of them (e.g.
+    [--metrics METRICS [METRICS ...]]).
+    """
+    m = re.search(r'\[' + re.escape(option) + r'((?: [A-Z][A-Z0-9_]*)*)'
+                  + r'( \[[A-Z0-9_]+ \.\.\.\])?\]', usage)
+    if m is None:
+        return 0
+    if m.group(2):
+        return None
+    return len(m.group(1).split())
+
+def drop_unsupported_options(s, tree_dir, new_dir, helps):
+    """
+    Returns a copy of stage s, without the options which the scripts in
+    tree_dir don't have (i.e. that were added after that version of the
+    code). How many values each option takes is read from the script's
+    usage in new_dir.
+    """
+    commands = []
+    for script, args in s['commands']:
+        old_help = script_help(script, tree_dir, helps)
+        if old_help == '':
+            # The script doesn't exist (or can't run) in that version, so
+            # the stage fails either way
+            commands.append((script, args))
+            continue
+        kept, i = [], 0
+        while i < len(args):
+            arg = args[i]
+            if not arg.startswith('--') or re.search(
+                    r'(?<![\w-])' + re.escape(arg) + r'(?![\w-])', old_help):
+                kept.append(arg)
+                i += 1
+                continue
+            n = option_nargs(arg, script_help(script, new_dir, helps))
+            i += 1
+            if n is None:
+                while i < len(args) and not args[i].startswith('--'):
+                    i += 1
+            else:
+                i += n
+        commands.append((script, kept))
+    s = dict(s)
+    s['commands'] = commands
+    return s
+
+def run_stage(s, tree_dir, log):
+    """
+    Run a stage's commands in tree_dir, writing their output to log.
+
+    Returns
+    -------
+    seconds : float
+        wall-clock time the stage took, or None if it failed
+    """
+    start = time.time()
+    for script, args in s['commands']:
+        if subprocess.call([sys.executable, script] + args, cwd=tree_dir,
+                           stdout=log, stderr=subprocess.STDOUT) != 0:
+            return None
+    return time.time() - start
+
+def read_output(fn):
+    """
+    Read a tab-delimited output file, with its first column as the index.
+    """
+    return pd.read_csv(fn, sep='\t', index_col=0)
+
+def compare_tables(ref, new, rtol, atol):
+    """
+    Compare two output tables.
+
+    Returns
+    -------
+    result : dict
+        'status': 'identical', 'within tolerance', or 'different'
+        'note': why the tables are different (if they are)
+        'n_different': number of values which are different (beyond the
+            tolerance, for numeric values)
+        'max_abs_diff', 'max_rel_diff': largest differences between numeric
+            values
+    """
+    result = {'status': 'identical', 'note': '', 'n_different': 0,
+              'max_abs_diff': 0.0, 'max_rel_diff': 0.0}
+    if set(ref.columns) != set(new.columns) \
+            or sorted(ref.index.astype(str)) != sorted(new.index.astype(str)):
+        result.update({'status': 'different', 'n_different': np.nan,
+                       'note': 'different rows or columns'})
+        return result
+    notes = []
+    if list(ref.columns) != list(new.columns) \
+            or list(ref.index) != list(new.index):
+        notes.append('rows or columns in a different order')
+        # Duplicate index labels (e.g. in tidy tables) are aligned by
+        # position within each label
+        key = lambda df: df.groupby(level=0).cumcount()
+        ref = ref.set_index(key(ref), append=True).sort_index()
+        new = new.set_index(key(new), append=True).sort_index()
+        new = new[ref.columns]
+
+    for col in ref.columns:
+        r, n = ref[col], new[col]
+        numeric = pd.api.types.is_numeric_dtype(r) \
+            and pd.api.types.is_numeric_dtype(n)
+        if not numeric:
+            diff = (r.astype(str) != n.astype(str)).values
+            result['n_different'] += int(diff.sum())
+            continue
+        r, n = r.values.astype(float), n.values.astype(float)
+        nan_diff = np.isnan(r) != np.isnan(n)
+        both = ~np.isnan(r) & ~np.isnan(n)
+        # Infinite values have to be the same
+        absdiff = np.where(r[both] == n[both], 0.0,
+                           np.abs(r[both] - n[both]))
+        if len(absdiff) > 0:
+            reldiff = absdiff/np.maximum(np.abs(r[both]), 1e-300)
+            result['max_abs_diff'] = max(result['max_abs_diff'],
+                                         float(np.nanmax(absdiff)))
+            result['max_rel_diff'] = max(result['max_rel_diff'],
+                                         float(np.nanmax(reldiff)))
+            over = ~(absdiff <= atol + rtol*np.abs(r[both]))
+        else:
+            over = np.zeros(0, dtype=bool)
+        result['n_different'] += int(nan_diff.sum() + over.sum())
+        if result['max_abs_diff'] > 0 and result['status'] == 'identical':
+            result['status'] = 'within tolerance'
+
+    if result['n_different'] > 0:
+        result['status'] = 'different'
+    result['note'] = '; '.join(notes)
+    return result
+
+def compare_stage(s, ref_dir, new_dir):
+    """
+    Compare each output file of a stage between the two copies of the repo.
+    Returns a list of dicts, with the file name and compare_tables() result.
+    """
+    rtol, atol = TOLERANCES.get(s['name'], DEFAULT_TOLERANCE)
+    # Glob patterns (files written once per dataset) are expanded to the
+    # files which either copy wrote
+    files = []
+    for pattern in s['outputs']:
+        if not glob.has_magic(pattern):
+            files.append(pattern)
+            continue
+        found = set()
+        for d in [ref_dir, new_dir]:
+            found.update(os.path.relpath(fn, d) for fn in
+                         glob.glob(os.path.join(d, pattern)))
+        files += sorted(found) if found else [pattern]
+    results = []
+    for fn in files:
+        row = {'stage': s['name'], 'file': fn}
+        ref_fn, new_fn = os.path.join(ref_dir, fn), os.path.join(new_dir, fn)
+        if not fn.endswith('.txt'):
+            row['status'] = 'not compared'
+        elif not os.path.exists(ref_fn) or not os.path.exists(new_fn):
+            row['status'] = 'missing'
+        else:
+            row.update(compare_tables(read_output(ref_fn),
+                                      read_output(new_fn), rtol, atol))
+        results.append(row)
+    return results
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument('--reference', help='git revision of the reference code '
+        + '[default: %(default)s]', default='HEAD')
+    p.add_argument('--candidate', help='git revision of the code to check '
+        + '[default: the working tree]', default=None)
+    p.add_argument('--stages', help='stages or groups of stages (as in '
+        + 'pipeline.py) whose outputs to compare. The stages they depend on '
+        + 'are also run. [default: {}]'.format(' '.join(DEFAULT_STAGES)),
+        nargs='+', default=DEFAULT_STAGES)
+    p.add_argument('--clean-dir', help='directory with the clean tables to '
+        + 'run on [default: %(default)s]', default='data/clean_tables')
+    p.add_argument('--work-dir', help='directory to make the copies of the '
+        + 'repo in [default: %(default)s]', default='data/equivalence')
+    args = p.parse_args()
+
+    stages, _ = select_stages(make_stages(), args.stages)
+    # The clean tables are given, not made
+    stages = [s for s in stages if not s['name'].startswith('clean_')]
+
+    # The candidate is set up first, so that a reference without pipeline.py
+    # can use its commands
+    trees = [('candidate', args.candidate), ('reference', args.reference)]
+    new_dir = os.path.join(args.work_dir, 'candidate')
+    times = {}
+    helps = {}
+    for label, revision in trees:
+        tree_dir = os.path.join(args.work_dir, label)
+        print('Setting up the {} code ({})...'.format(
+            label, revision if revision is not None else 'working tree'))
+        make_tree(tree_dir, revision, args.clean_dir)
+        own_stages = tree_stages(tree_dir)
+        if own_stages is None:
+            own_stages = {}
+            for s in stages:
+                own_stages[s['name']] = drop_unsupported_options(
+                    s, tree_dir, new_dir, helps)
+        with open(os.path.join(args.work_dir, label + '.log'), 'w') as log:
+            for s in stages:
+                if s['name'] not in own_stages:
+                    print('The {} code has no {} stage.'.format(label,
+                                                                s['name']))
+                    times[(label, s['name'])] = None
+                    continue
+                s = own_stages[s['name']]
+                print('Running {} with the {} code...'.format(s['name'],
+                                                              label))
+                log.write('### {}\n'.format(s['name']))
+                log.flush()
+                times[(label, s['name'])] = run_stage(s, tree_dir, log)
+
+    report = []
+    ref_dir = os.path.join(args.work_dir, 'reference')
+    for s in stages:
+        ref_time = times[('reference', s['name'])]
+        new_time = times[('candidate', s['name'])]
+        if ref_time is None or new_time is None:
+            rows = [{'stage': s['name'], 'file': fn, 'status': 'failed',
+                     'note': '{} code failed (see its log)'.format(
+                         'reference' if ref_time is None else 'candidate')}
+                    for fn in s['outputs']]
+        else:
+            rows = compare_stage(s, ref_dir, new_dir)
+        for row in rows:
+            row.update({'reference_time': ref_time, 'candidate_time': new_time,
+                        'speedup': ref_time/new_time
+                        if ref_time and new_time else np.nan})
+        report += rows
+
+    report = pd.DataFrame(report, columns=['stage', 'file', 'status',
+        'n_different', 'max_abs_diff', 'max_rel_diff', 'reference_time',
+        'candidate_time', 'speedup', 'note'])
+    report['file'] = report['file'].apply(os.path.basename)
+    report.to_csv(os.path.join(args.work_dir, 'equivalence_report.txt'),
+                  sep='\t', index=False)
+    with pd.option_context('display.width', 250, 'display.max_rows', None,
+                           'display.max_columns', None,
+                           'display.max_colwidth', 60):
+        print(report.drop('note', axis=1))
+    notes = report[report['note'].fillna('') != '']
+    for _, row in notes.iterrows():
+        print('{} ({}): {}'.format(row['stage'], row['file'], row['note']))
+
+    bad = report['status'].isin(['different', 'missing', 'failed'])
+    if bad.any():
+        print('Outputs of {} are not equivalent.'.format(
+            ', '.join(report.loc[bad, 'stage'].unique())))
+        sys.exit(1)
+    print('All compared outputs are equivalent.')
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+This script compares the results of run_benchmarks.py from different runs
+(e.g. different commits), and plots how each benchmark scales with the
+size of the synthetic data.
+
+Run it from the top directory of this repo, e.g.:
+    python src/benchmarks/compare_benchmarks.py data/benchmarks/old.json \\
+        data/benchmarks/new.json --plot data/benchmarks/scaling.png
+"""
+import argparse
+import json
+import pandas as pd
+
+# Benchmarks which scale with the q-values table (genera x datasets),
+# rather than with the OTU table (samples x OTUs)
+QVALUE_BENCHMARKS = ['meta_analysis', 'null_core', 'empirical_pval',
+                     'reorder_index_from_tree']
+
+def read_results(fn):
+    """
+    Read a run_benchmarks.py results file into a DataFrame with one row
+    per benchmark and case, and the run's environment (a dict).
+    """
+    with open(fn, 'r') as f:
+        results = json.load(f)
+    df = pd.DataFrame(results['results'])
+    if 'error' not in df:
+        df['error'] = None
+    return df, results['environment']
+
+def run_label(env, fn):
+    """
+    Returns a short label for a run: its commit, or its file name.
+    """
+    if env.get('commit'):
+        return env['commit'][:8]
+    return fn
+
+def compare_runs(fns, col='wall'):
+    """
+    Tabulate col (e.g. 'wall', 'cpu', or 'rss_increase') for each
+    benchmark and case in each results file, with the ratio of the last
+    run to the first.
+    """
+    runs = []
+    labels = []
+    for fn in fns:
+        df, env = read_results(fn)
+        label = run_label(env, fn)
+        # Two runs of the same commit are labeled by file name instead
+        if label in labels:
+            label = fn
+        labels.append(label)
+        runs.append(df.set_index(['benchmark', 'case'])[col].rename(label))
+    table = pd.concat(runs, axis=1)[labels]
+    if len(labels) > 1:
+        table['ratio'] = table[labels[-1]]/table[labels[0]]
+    return table
+
+def scaling_size(df):
+    """
+    Returns the size of the data each result was run on: samples x OTUs
+    for the OTU table benchmarks, and genera x datasets for the q-value
+    benchmarks.
+    """
+    qval = df['benchmark'].isin(QVALUE_BENCHMARKS)
+    return (df['n_genera']*df['n_datasets']).where(
+        qval, df['n_samples']*df['n_otus'])
+
+def plot_scaling(fns, fnout, col='wall'):
+    """
+    Plot col against the data size for each benchmark on the synthetic
+    data, with one line per results file, and save the figure to fnout.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    allres = []
+    for fn in fns:
+        df, env = read_results(fn)
+        df = df[(df['source'] == 'synthetic') & df['error'].isnull()].copy()
+        df['run'] = run_label(env, fn)
+        df['size'] = scaling_size(df)
+        allres.append(df)
+    allres = pd.concat(allres)
+
+    benchmarks = sorted(allres['benchmark'].unique())
+    ncols = 4
+    nrows = (len(benchmarks) + ncols - 1)//ncols
+    fig, axes = plt.subplots(nrows, ncols, figsize=(4*ncols, 3.5*nrows),
+                             squeeze=False)
+    for ax, bench in zip(axes.flat, benchmarks):
+        for run, subdf in allres[allres['benchmark'] == bench].groupby('run'):
+            subdf = subdf.sort_values('size')
+            ax.plot(subdf['size'], subdf[col], marker='o', label=run)
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.set_title(bench)
+        ax.set_xlabel('genera x datasets' if bench in QVALUE_BENCHMARKS
+                      else 'samples x OTUs')
+        ax.set_ylabel(col)
+    for ax in axes.flat[len(benchmarks):]:
+        ax.axis('off')
+    axes.flat[0].legend(loc='best', fontsize='small')
+    fig.tight_layout()
+    fig.savefig(fnout)
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument('results', help='results files from run_benchmarks.py, '
+        + 'oldest first', nargs='+')
+    p.add_argument('--col', help='measurement to compare '
+        + '[default: %(default)s]', default='wall',
+        choices=['wall', 'cpu', 'peak_rss', 'rss_increase'])
+    p.add_argument('--out', help='file to write the comparison table to '
+        + '(tab-delimited)', default=None)
+    p.add_argument('--plot', help='file to save the scaling plot to',
+        default=None)
+    args = p.parse_args()
+
+    table = compare_runs(args.results, args.col)
+    with pd.option_context('display.width', 200, 'display.max_rows', None,
+                           'display.max_columns', None):
+        print(table)
+    if args.out is not None:
+        table.to_csv(args.out, sep='\t')
+    if args.plot is not None:
+        plot_scaling(args.results, args.plot, args.col)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+"""
+This script times the slow steps of the analyses on synthetic datasets of
+different sizes (and optionally on the real clean tables), and writes the
+results to a JSON file which can be compared with the results from other
+commits using compare_benchmarks.py.
+
+Each benchmark is run --repeat times in a separate process, which records
+the wall-clock and CPU time of each run and how much the benchmark raised
+the process' peak resident memory. The data is made before the process
+starts, so making it isn't timed.
+
+The synthetic datasets are made with src/data/simulate_datasets.py. Each
+size is given as <samples>x<OTUs>, and has one OTU table with that many
+samples and OTUs (and a tenth as many genera), a table of signed q-values
+for --datasets datasets of those genera, and a random tree of the genera.
+
+Run it from the top directory of this repo, e.g.:
+    python src/benchmarks/run_benchmarks.py data/benchmarks/results.json \\
+        --sizes 100x1000 1000x5000 --clean-dir data/clean_tables
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import platform
+import Queue
+import subprocess
+import shutil
+import tempfile
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+
+# Add this repo to the path
+import os, sys
+for d in ['src/data', 'src/analysis', 'src/util']:
+    sys.path.insert(0, os.path.normpath(os.path.join(os.getcwd(), d)))
+import FileIO as fio
+import Profiling
+from util import raw2abun, collapse_taxonomic_contents_df, \
+    compare_otus_teststat, prep_classifier, cv_and_roc
+from Formatting import reorder_index_from_tree
+from Taxonomy import taxon_name
+from meta_analyze import count_sig, cross_disease_meta_analysis
+from null_core import null_core_counts
+from concordance_analysis import empirical_pval
+from alpha_diversity import alpha_diversities
+import simulate_datasets as sim
+
+## Data for the benchmarks
+def make_qvalues(genera, n_datasets, rs, frac_sig=0.1, frac_missing=0.2):
+    """
+    Make a table of signed q-values like get_qvalues.py writes, with genera
+    in rows and datasets (named <disease>_synth<i>) in columns. A fraction
+    frac_sig of the q-values are significant, and a fraction frac_missing
+    are NaN (i.e. the genus isn't in that dataset).
+    """
+    shape = (len(genera), n_datasets)
+    q = np.where(rs.rand(*shape) < frac_sig, rs.uniform(0, 0.05, shape),
+                 rs.uniform(0.05, 1, shape))
+    q *= rs.choice([-1, 1], shape)
+    q[rs.rand(*shape) < frac_missing] = np.nan
+    columns = ['{}_synth{}'.format(sim.DISEASES[i % len(sim.DISEASES)].lower(),
+                                   i) for i in range(n_datasets)]
+    return pd.DataFrame(q, index=genera, columns=columns)
+
+def write_tree(genera, fn, rs):
+    """
+    Write a random binary newick tree whose tips are the genus names of
+    genera (as in the genus-level tree in data/tree/).
+    """
+    nodes = [taxon_name(g) for g in genera]
+    while len(nodes) > 1:
+        rs.shuffle(nodes)
+        nodes = ['({},{})'.format(nodes[i], nodes[i + 1])
+                 if i + 1 < len(nodes) else nodes[i]
+                 for i in range(0, len(nodes), 2)]
+    with open(fn, 'w') as f:
+        f.write(nodes[0] + ';\n')
+
+def prepare_case(case, df, meta, qvals, tree_file):
+    """
+    Add the tables that the benchmarks need to case (a dict).
+    """
+    case['df'] = df
+    case['meta'] = meta
+    case['abun'] = raw2abun(df)
+    case['genus'] = collapse_taxonomic_contents_df(case['abun'], 'genus')
+    H_smpls, dis_smpls = fio.get_samples(meta, fio.get_classes(meta))
+    case['H_smpls'], case['dis_smpls'] = H_smpls, dis_smpls
+    case['qvals'] = qvals
+    case['tree_file'] = tree_file
+    case.update({'n_samples': df.shape[0], 'n_otus': df.shape[1],
+                 'n_genera': case['genus'].shape[1],
+                 'n_datasets': None if qvals is None else qvals.shape[1]})
+    return case
+
+def synthetic_case(n_samples, n_otus, n_datasets, tmp_dir, rs):
+    """
+    Make and write a synthetic dataset with n_samples and n_otus.
+    """
+    n_genera = max(1, n_otus//10)
+    otus, otu_genus = sim.make_taxonomy(n_otus, n_genera, rs)
+    genus_abun = rs.lognormal(0, 2, n_genera)
+    genus_abun /= genus_abun.sum()
+    planted = rs.choice(np.unique(otu_genus[otu_genus >= 0]),
+                        min(10, n_genera), replace=False)
+    dataset = 'crc_synth'
+    df, meta = sim.simulate_dataset(dataset, 'CRC', otus, otu_genus,
+                                    genus_abun, n_samples, planted, rs)
+
+    table_dir = os.path.join(tmp_dir, '{}x{}'.format(n_samples, n_otus))
+    os.makedirs(table_dir)
+    sim.write_dataset(df, meta, dataset, table_dir)
+
+    case = {'case': '{}x{}'.format(n_samples, n_otus), 'source': 'synthetic',
+            'dataset': dataset, 'table_dir': table_dir}
+    prepare_case(case, df, meta, None, None)
+    genera = case['genus'].columns
+    case['qvals'] = make_qvalues(genera, n_datasets, rs)
+    case['n_datasets'] = n_datasets
+    case['tree_file'] = os.path.join(table_dir, 'tree.newick')
+    write_tree(genera, case['tree_file'], rs)
+    return case
+
+def real_case(dataset, clean_dir):
+    """
+    Read a real clean dataset.
+    """
+    df, meta = fio.read_dataset_files(dataset, clean_dir)
+    case = {'case': dataset, 'source': 'real', 'dataset': dataset,
+            'table_dir': clean_dir}
+    return prepare_case(case, df, meta, None, None)
+
+def real_qvalues_case(fnqvals, tree_file):
+    """
+    Read real q-values, for the benchmarks which only need q-values and
+    the genus-level tree.
+    """
+    qvals = pd.read_csv(fnqvals, sep='\t', index_col=0)
+    return {'case': 'qvalues', 'source': 'real', 'df': None, 'qvals': qvals,
+            'tree_file': tree_file, 'n_samples': None, 'n_otus': None,
+            'n_genera': qvals.shape[0], 'n_datasets': qvals.shape[1]}
+
+## Benchmarks. Each one takes a case and the command-line arguments, and
+# returns the function to time.
+def bench_read_dataset_files(case, args):
+    return lambda: fio.read_dataset_files(case['dataset'], case['table_dir'])
+
+def bench_raw2abun(case, args):
+    return lambda: raw2abun(case['df'])
+
+def bench_collapse_taxonomic_contents_df(case, args):
+    return lambda: collapse_taxonomic_contents_df(case['abun'], 'genus')
+
+def bench_compare_otus_teststat(case, args):
+    return lambda: compare_otus_teststat(case['genus'], case['H_smpls'],
+                                         case['dis_smpls'],
+                                         method='kruskal-wallis',
+                                         multi_comp='fdr')
+
+def bench_meta_analysis(case, args):
+    return lambda: cross_disease_meta_analysis(
+        count_sig(case['qvals'], 0.05), 2)
+
+def bench_null_core(case, args):
+    return lambda: null_core_counts(case['qvals'], 0.05, 2, args.null_reps)
+
+def bench_empirical_pval(case, args):
+    signs = np.sign(case['qvals']).replace(0, np.nan)
+    return lambda: empirical_pval(signs.iloc[:, 0], signs.iloc[:, 1],
+                                  args.empirical_reps)
+
+def bench_cv_and_roc(case, args):
+    rf, X, Y = prep_classifier(case['genus'], case['H_smpls'],
+                               case['dis_smpls'], 12345)
+    rf.set_params(n_estimators=args.n_estimators)
+    return lambda: cv_and_roc(rf, X, Y, random_state=12345)
+
+def bench_alpha_diversity(case, args):
+    return lambda: alpha_diversities(case['df'])
+
+def bench_reorder_index_from_tree(case, args):
+    return lambda: reorder_index_from_tree(case['tree_file'],
+                                           case['qvals'].index)
+
+# (benchmark name, function which sets it up, case keys it needs)
+BENCHMARKS = [
+    ('read_dataset_files', bench_read_dataset_files, ['df']),
+    ('raw2abun', bench_raw2abun, ['df']),
+    ('collapse_taxonomic_contents_df', bench_collapse_taxonomic_contents_df,
+     ['df']),
+    ('compare_otus_teststat', bench_compare_otus_teststat, ['df']),
+    ('meta_analysis', bench_meta_analysis, ['qvals']),
+    ('null_core', bench_null_core, ['qvals']),
+    ('empirical_pval', bench_empirical_pval, ['qvals']),
+    ('cv_and_roc', bench_cv_and_roc, ['df']),
+    ('alpha_diversity', bench_alpha_diversity, ['df']),
+    ('reorder_index_from_tree', bench_reorder_index_from_tree,
+     ['qvals', 'tree_file']),
+    ]
+BENCHMARK_NAMES = [b[0] for b in BENCHMARKS]
+
+## Running and timing
+def _time_benchmark(fn, repeat, queue):
+    """
+    Run fn repeat times and put the timings on queue. This runs in its own
+    process, so that the peak memory is the benchmark's.
+    """
+    try:
+        # Some of the functions print their progress
+        sys.stdout = open(os.devnull, 'w')
+        Profiling.reset_peak_rss()
+        rss = Profiling.peak_rss()
+        walls, cpus = [], []
+        for _ in range(repeat):
+            start, cpu = time.time(), Profiling.cpu_time()
+            fn()
+            walls.append(time.time() - start)
+            cpus.append(Profiling.cpu_time() - cpu)
+        peak = Profiling.peak_rss()
+        queue.put({'wall': min(walls), 'wall_all': walls, 'cpu': min(cpus),
+                   'peak_rss': peak, 'rss_increase': peak - rss})
+    except Exception:
+        queue.put({'error': traceback.format_exc()})
+
+def run_benchmark(name, setup, case, args):
+    """
+    Set up and time one benchmark on one case.
+
+    Returns
+    -------
+    result : dict
+        benchmark and case names, the case's size, and the timings (or the
+        error, if the benchmark failed)
+    """
+    result = {k: case[k] for k in ['case', 'source', 'n_samples', 'n_otus',
+                                   'n_genera', 'n_datasets']}
+    result.update({'benchmark': name, 'repeat': args.repeat})
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_time_benchmark,
+                                args=(setup(case, args), args.repeat, queue))
+    p.start()
+    # Get the result before joining, so that the queue doesn't block
+    start = time.time()
+    while True:
+        try:
+            result.update(queue.get(timeout=1))
+            break
+        except Queue.Empty:
+            pass
+        if not p.is_alive() and queue.empty():
+            result['error'] = 'exited with code {}'.format(p.exitcode)
+            break
+        if time.time() - start > args.timeout:
+            result['error'] = 'no result after {} s'.format(args.timeout)
+            p.terminate()
+            break
+    p.join()
+    return result
+
+def git_commit():
+    """
+    Returns the current commit of this repo (or None if git isn't there).
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                           stderr=devnull).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    """
+    Returns information about this run, to store with the results.
+    """
+    return {'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(),
+            'host': platform.node(),
+            'platform': platform.platform(),
+            'cpus': multiprocessing.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__}
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument('out', help='JSON file to write results to')
+    p.add_argument('--sizes', help='synthetic data sizes, as <samples>x<OTUs>'
+        + ' [default: %(default)s]', nargs='*',
+        default=['100x1000', '300x3000', '1000x10000'])
+    p.add_argument('--datasets', help='number of datasets in the synthetic '
+        + 'q-values [default: %(default)s]', default=28, type=int)
+    p.add_argument('--clean-dir', help='directory with real clean tables to '
+        + 'also run the benchmarks on', default=None)
+    p.add_argument('--subset', help='file with the dataset IDs in --clean-dir'
+        + ' to use, one per line [default: all of them]', default=None)
+    p.add_argument('--qvalues', help='file with real signed q-values (from '
+        + 'get_qvalues.py) to also run the q-value benchmarks on',
+        default=None)
+    p.add_argument('--tree', help='genus-level newick tree to use with '
+        + '--qvalues [default: %(default)s]',
+        default='data/tree/phyloT_tree.updated.newick')
+    p.add_argument('--benchmarks', help='benchmarks to run [default: all]',
+        nargs='+', choices=BENCHMARK_NAMES, default=BENCHMARK_NAMES)
+    p.add_argument('--repeat', help='number of times to run each benchmark; '
+        + 'the fastest is reported [default: %(default)s]', default=3,
+        type=int)
+    p.add_argument('--timeout', help='seconds to wait for each benchmark '
+        + '[default: %(default)s]', default=3600, type=int)
+    p.add_argument('--null-reps', help='shuffles in the null_core benchmark '
+        + '[default: %(default)s]', default=10, type=int)
+    p.add_argument('--empirical-reps', help='shuffles in the empirical_pval '
+        + 'benchmark [default: %(default)s]', default=100, type=int)
+    p.add_argument('--n-estimators', help='number of trees in the cv_and_roc '
+        + 'benchmark (the classifiers use 1000) [default: %(default)s]',
+        default=100, type=int)
+    p.add_argument('--random-state', help='random seed for the synthetic '
+        + 'data [default: %(default)s]', default=12345, type=int)
+    args = p.parse_args()
+
+    rs = np.random.RandomState(args.random_state)
+    tmp_dir = tempfile.mkdtemp()
+    cases = []
+    try:
+        for size in args.sizes:
+            n_samples, n_otus = [int(i) for i in size.lower().split('x')]
+            print('Making {} synthetic dataset...'.format(size))
+            cases.append(synthetic_case(n_samples, n_otus, args.datasets,
+                                        tmp_dir, rs))
+
+        if args.clean_dir is not None:
+            if args.subset is not None:
+                with open(args.subset, 'r') as f:
+                    datasetids = f.read().splitlines()
+            else:
+                datasetids = sorted(fio.get_dataset_ids(args.clean_dir))
+            print('Reading real datasets...')
+            for dataset in datasetids:
+                print(dataset),
+                cases.append(real_case(dataset, args.clean_dir))
+            print('')
+        if args.qvalues is not None:
+            cases.append(real_qvalues_case(args.qvalues, args.tree))
+
+        results = []
+        for name, setup, needs in BENCHMARKS:
+            if name not in args.benchmarks:
+                continue
+            print('Running {}...'.format(name))
+            for case in cases:
+                if any([case.get(k) is None for k in needs]):
+                    continue
+                result = run_benchmark(name, setup, case, args)
+                results.append(result)
+                if 'error' in result:
+                    print('    {}: failed\n{}'.format(case['case'],
+                                                     result['error']))
+                else:
+                    print('    {}: {:.3f} s, {:.1f} MB'.format(
+                        case['case'], result['wall'], result['rss_increase']))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    out_dir = os.path.dirname(args.out)
+    if out_dir and not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    with open(args.out, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f,
+                  indent=1, sort_keys=True)
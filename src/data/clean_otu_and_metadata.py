@@ -2,6 +2,12 @@
 """
 This file cleans up the raw OTU and metadata tables and
 writes datasetID.otu_table.clean datasetID.metadata.clean.
+It also writes datasetID.summary.clean.npz, with the summary statistics
+from SummaryStats.summarize_dataset().
+
+Raw OTU tables can be tab-delimited files (with OTUs in rows) or BIOM 2.x
+(HDF5) tables (see FileIO.read_yaml()). BIOM tables are read and cleaned
+up as sparse matrices, and are only made dense once they're cleaned up.
 """
 import argparse
 import yaml
@@ -9,13 +15,17 @@ import os
 import sys
 import subprocess
 
+import numpy as np
 import pandas as pd
-import feather
 from pyarrow.compat import pdapi
 
 src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.append(src_dir)
-from FileIO import read_yaml
+from FileIO import read_yaml, write_clean_table
+from BiomTable import sample_ids as biom_sample_ids
+from BiomTable import read_table as read_biom_table
+from SummaryStats import summarize_dataset, save_summary
+from Profiling import profile_script, profile_dataset
 
 def parse_args():
     p = argparse.ArgumentParser()
@@ -35,17 +45,19 @@ def parse_args():
 
     return p.parse_args()
 
-def read_raw_files(otufile, metafile):
-
-    df = pd.read_csv(otufile, sep='\t', index_col=0)
-    meta = pd.read_csv(metafile, sep='\t', index_col=0)
+def read_tsv_with_string_index(fn):
+    """
+    Reads a tab-delimited file with its first column as the index, which is
+    always read as strings (so that sample IDs like '0012' aren't made into
+    numbers).
+    """
+    df = pd.read_csv(fn, sep='\t', converters={0: str})
+    return df.set_index(df.columns[0])
 
-    # If either index wasn't read as a string, explicitly do so
-    if meta.index.dtype != 'O':
-        meta.index = pd.read_csv(y[dataset_id]['metadata_file'], sep='\t', dtype=str).iloc[:,0]
+def read_raw_files(otufile, metafile):
 
-    if df.index.dtype != 'O':
-        df.index = pd.read_csv(clean_otu_file, sep='\t', dtype=str).iloc[:,0]
+    df = read_tsv_with_string_index(otufile)
+    meta = read_tsv_with_string_index(metafile)
 
     return df.T, meta
 
@@ -123,21 +135,7 @@ def clean_up_samples(df, meta, data):
 
     print('\t\tOriginal: {} samples with 16S, {} samples with metadata.'.format(df.shape[0], meta.shape[0]))
 
-    # If a condition is given, keep only samples with that condition
-    try:
-        # conditions is a dict with {metadata_column: [keep, conditions]}
-        conditions = data['condition']
-    except:
-        conditions = None
-        print('\t\tNo metadata subset specified. Keeping all samples.')
-
-    if conditions is not None:
-        for col in conditions:
-            print('\t\tKeeping only samples with values {} for metadata ' \
-                  'column {}'.format(', '.join([str(i) for i in conditions[col]]), col))
-            meta = meta[meta[col].isin(conditions[col])]
-            print('\t\t\t{} samples left in metadata'.format(meta.shape[0]))
-
+    meta = keep_condition_samples(meta, data)
 
     # Remove samples which don't have both 16S and metadata
     # if len(meta.index) > len(df.index):
@@ -154,6 +152,29 @@ def clean_up_samples(df, meta, data):
 
     return df, meta
 
+def keep_condition_samples(meta, data):
+    """
+    If a 'condition' was given in the yaml file (as recorded in
+    data['condition']), returns only the samples in meta which have the
+    specified condition. Otherwise, returns meta.
+    """
+    # If a condition is given, keep only samples with that condition
+    try:
+        # conditions is a dict with {metadata_column: [keep, conditions]}
+        conditions = data['condition']
+    except:
+        conditions = None
+        print('\t\tNo metadata subset specified. Keeping all samples.')
+
+    if conditions is not None:
+        for col in conditions:
+            print('\t\tKeeping only samples with values {} for metadata ' \
+                  'column {}'.format(', '.join([str(i) for i in conditions[col]]), col))
+            meta = meta[meta[col].isin(conditions[col])]
+            print('\t\t\t{} samples left in metadata'.format(meta.shape[0]))
+
+    return meta
+
 def clean_up_tables(df, meta, n_reads_otu, n_reads_sample, perc_samples):
     """
     Cleans up the OTU table and metadata dataframes in data.
@@ -183,6 +204,13 @@ def clean_up_tables(df, meta, n_reads_otu, n_reads_sample, perc_samples):
     # Remove any samples which now have fewer than n_reads
     df = remove_shallow_smpls(df, n_reads_sample)
 
+    return match_clean_samples(df, meta)
+
+def match_clean_samples(df, meta):
+    """
+    Keeps only the samples which are in both the cleaned up OTU table and
+    metadata, and removes empty metadata columns.
+    """
     # Double check that both metadata and OTU table have same samples
     # (after we've filtered out samples based on reads, etc)
     # if len(meta.index) > len(df.index):
@@ -261,6 +289,99 @@ def remove_shallow_otus(df, perc_samples=None, n_reads=None):
 
     return df
 
+def clean_up_biom_samples(biomfile, meta, data):
+    """
+    Same as clean_up_samples(), for an OTU table in a BIOM file. Only the
+    samples which have metadata (and the condition in the yaml file, if one
+    was given) are read, into a sparse matrix.
+
+    Returns
+    -------
+    X : scipy sparse CSR matrix
+        counts, with samples in rows and OTUs in columns
+    smpls, otus : lists
+        sample IDs (rows) and OTU names (columns) of X
+    meta : pandas dataframe
+        metadata of smpls, in the same order
+    """
+    allsmpls = biom_sample_ids(biomfile)
+    print('\t\tOriginal: {} samples with 16S, {} samples with metadata.'.format(len(allsmpls), meta.shape[0]))
+
+    meta = keep_condition_samples(meta, data)
+
+    X, smpls, otus = read_biom_table(biomfile, samples=meta.index)
+
+    if len(smpls) != len(allsmpls) or len(smpls) != len(meta.index):
+        print('\t\tDataset has {} samples with 16S, \n\t\t\t{} samples with metadata, \n \
+              \t\tbut only {} samples with both'.format(len(allsmpls), len(meta.index), len(smpls)))
+    meta = meta.loc[smpls]
+
+    return X, smpls, otus, meta
+
+def clean_up_sparse_tables(X, smpls, otus, meta, n_reads_otu, n_reads_sample,
+                           perc_samples):
+    """
+    Same as clean_up_tables(), for a sparse OTU table from
+    clean_up_biom_samples(). The table is only made into a dense dataframe
+    once the samples and OTUs have been removed.
+
+    Returns
+    -------
+    df, meta : pandas dataframes
+        cleaned up OTU table (samples in rows, OTUs in columns) and metadata
+    """
+    smpls = np.array(smpls, dtype=object)
+    otus = np.array(otus, dtype=object)
+
+    # Remove samples with fewer than n_reads reads.
+    keep = np.flatnonzero(sparse_deep_smpls(X, n_reads_sample))
+    X, smpls = X[keep], smpls[keep]
+
+    # Remove OTUs with fewer than 10 reads
+    old = X.shape[1]
+    keep = np.flatnonzero(sparse_deep_otus(X, n_reads=n_reads_otu))
+    X, otus = X[:, keep], otus[keep]
+    new = X.shape[1]
+    if new < old:
+        print('\t\tOf {} original OTUs, {} have more than {} reads'.format(old, new, n_reads_otu))
+
+    # Remove OTUs which are present in fewer than perc_samples of samples.
+    old = X.shape[1]
+    keep = np.flatnonzero(sparse_deep_otus(X, perc_samples=perc_samples))
+    X, otus = X[:, keep], otus[keep]
+    new = X.shape[1]
+    if new < old:
+        print('\t\tOf {} original OTUs, {} are present \n\t\t\tin more than {}% of samples'.format(old, new, perc_samples*100))
+
+    # Remove any samples which now have fewer than n_reads
+    keep = np.flatnonzero(sparse_deep_smpls(X, n_reads_sample))
+    X, smpls = X[keep], smpls[keep]
+
+    df = pd.DataFrame(X.toarray(), index=list(smpls), columns=list(otus))
+    return match_clean_samples(df, meta)
+
+def sparse_deep_smpls(X, n_reads):
+    """
+    Returns a boolean array of which samples (rows) in the sparse OTU table
+    X have more than n_reads reads, i.e. the ones that
+    remove_shallow_smpls() keeps.
+    """
+    return np.asarray(X.sum(axis=1)).ravel() > n_reads
+
+def sparse_deep_otus(X, perc_samples=None, n_reads=None):
+    """
+    Returns a boolean array of which OTUs (columns) in the sparse OTU table
+    X are present in more than 100*perc_samples percent of samples AND have
+    at least n_reads reads, i.e. the ones that remove_shallow_otus() keeps.
+    """
+    keep = np.ones(X.shape[1], dtype=bool)
+    if perc_samples is not None:
+        n_present = np.bincount(X.indices, minlength=X.shape[1])
+        keep &= n_present/float(X.shape[0]) > perc_samples
+    if n_reads is not None:
+        keep &= np.asarray(X.sum(axis=0)).ravel() >= n_reads
+    return keep
+
 def fix_ob_zhu(meta):
     """
     Fix the DiseaseState labels for case patients in the ob_zhu data.
@@ -284,18 +405,30 @@ def fix_noncdi_schubert(meta):
 if __name__ == "__main__":
 
     args = parse_args()
+    profile_script()
 
     dataset_id = args.otu_out.split('/')[-1].split('.')[0]
+    profile_dataset(dataset_id)
     y = read_yaml(args.yaml_file, args.raw_data_dir)
 
-    df, meta = read_raw_files(y[dataset_id]['otu_table'],
-                              y[dataset_id]['metadata_file'])
+    if y[dataset_id]['table_format'] == 'biom':
+        ## BIOM tables are read and cleaned up as sparse matrices
+        meta = read_tsv_with_string_index(y[dataset_id]['metadata_file'])
+        meta = add_info_to_meta(meta, y[dataset_id], dataset_id)
 
-    ## Add some study-wise metadata, like sequencer and region
-    meta = add_info_to_meta(meta, y[dataset_id], dataset_id)
+        X, smpls, otus, meta = clean_up_biom_samples(
+            y[dataset_id]['otu_table'], meta, y[dataset_id])
+        df, meta = clean_up_sparse_tables(X, smpls, otus, meta,
+            args.n_reads_otu, args.n_reads_sample, args.perc_samples)
+    else:
+        df, meta = read_raw_files(y[dataset_id]['otu_table'],
+                                  y[dataset_id]['metadata_file'])
 
-    df, meta = clean_up_samples(df, meta, y[dataset_id])
-    df, meta = clean_up_tables(df, meta, args.n_reads_otu, args.n_reads_sample, args.perc_samples)
+        ## Add some study-wise metadata, like sequencer and region
+        meta = add_info_to_meta(meta, y[dataset_id], dataset_id)
+
+        df, meta = clean_up_samples(df, meta, y[dataset_id])
+        df, meta = clean_up_tables(df, meta, args.n_reads_otu, args.n_reads_sample, args.perc_samples)
 
     ## Add sequencing depth to metadata
     meta['total_reads'] = df.sum(axis=1)
@@ -309,12 +442,14 @@ if __name__ == "__main__":
     elif dataset_id == 'noncdi_schubert':
         meta = fix_noncdi_schubert(meta)
 
-    # Reset indices to write as feather format
-    df = df.reset_index()
-    feather.write_dataframe(df, args.otu_out)
+    ## Per-group summary statistics, which can be merged across datasets
+    summary_out = args.otu_out.split('.otu_table.clean.feather')[0] + '.summary.clean.npz'
+    save_summary(summary_out, summarize_dataset(df, meta))
+
+    # Sample IDs are written as the first column, as strings
+    write_clean_table(df, args.otu_out)
 
     meta_out = args.otu_out.split('.otu_table.clean.feather')[0] + '.metadata.clean.feather'
-    meta = meta.reset_index()
 
     # Feather doesn't support writing Object column types with 'mixed' inferred
     # dtype OR non-unicode or non-string inferred dtype.
@@ -328,4 +463,4 @@ if __name__ == "__main__":
             if inferred_type == "boolean":
                 meta.iloc[:, i] = meta.iloc[:, i].astype(bool)
 
-    feather.write_dataframe(meta, meta_out)
+    write_clean_table(meta, meta_out)
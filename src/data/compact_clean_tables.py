@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+This script writes the clean OTU tables in a clean tables directory in the
+compact format (see src/util/CompactTable.py) to another directory, along
+with copies of their metadata and summary statistics. The new directory
+can be used in place of data/clean_tables, e.g. to archive the clean
+tables.
+
+It checks that each compact table reads back exactly the same as the
+original, and prints the size of the original and compact files.
+
+Run it from the top directory of this repo, e.g.:
+    python src/data/compact_clean_tables.py data/clean_tables \\
+        data/compact_tables --compression zstd
+"""
+import os
+import sys
+import shutil
+import argparse
+
+# Add this repo to the path
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
+sys.path.insert(0, src_dir)
+import FileIO as fio
+import CompactTable
+from Profiling import profile_script, profile_dataset, finish_dataset
+
+def file_size(fn):
+    """
+    Returns the size of fn in MB.
+    """
+    return os.path.getsize(fn)/1024.0**2
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument('clean_dir', help='directory with clean OTU tables, '
+        + 'metadata, and summary statistics')
+    p.add_argument('out_dir', help='directory to write the compact tables '
+        + 'to')
+    p.add_argument('--compression', help='compression codec '
+        + '[default: %(default)s]', default='zstd',
+        choices=['zstd', 'lz4', 'snappy', 'gzip'])
+    p.add_argument('--subset', help='file with the datasets to write (one '
+        + 'per line) [default: all datasets in clean_dir]', default=None)
+    args = p.parse_args()
+    profile_script()
+
+    if args.subset is not None:
+        with open(args.subset, 'r') as f:
+            datasetids = f.read().splitlines()
+    else:
+        datasetids = sorted(fio.get_dataset_ids(args.clean_dir))
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    print('dataset\toriginal_MB\tcompact_MB')
+    total_orig = total_compact = 0.0
+    for dataset in datasetids:
+        profile_dataset(dataset)
+        fnotu = os.path.join(args.clean_dir,
+                             dataset + '.otu_table.clean.feather')
+        fnout = os.path.join(args.out_dir, dataset + CompactTable.SUFFIX)
+        df = fio.read_clean_table(fnotu)
+        CompactTable.write_table(df, fnout, args.compression)
+        if not CompactTable.read_table(fnout).equals(df):
+            raise ValueError('Compact table for {} does not match the '
+                             'original'.format(dataset))
+
+        for suffix in ['.metadata.clean.feather', '.summary.clean.npz']:
+            fn = os.path.join(args.clean_dir, dataset + suffix)
+            if os.path.exists(fn):
+                shutil.copy(fn, args.out_dir)
+
+        orig, compact = file_size(fnotu), file_size(fnout)
+        total_orig += orig
+        total_compact += compact
+        print('{}\t{:.2f}\t{:.2f}'.format(dataset, orig, compact))
+    finish_dataset()
+    print('total\t{:.2f}\t{:.2f}'.format(total_orig, total_compact))
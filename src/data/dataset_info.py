@@ -13,6 +13,8 @@ import argparse
 src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
 import FileIO as fio
+import SummaryStats as ss
+from Profiling import profile_script, profile_dataset, finish_dataset
 
 def get_citation(dataset):
     """
@@ -55,8 +57,8 @@ parser = argparse.ArgumentParser(description='Read and write basic info '
     + 'about the datasets.')
 parser.add_argument('yaml_file', help='yaml file with all dataset info')
 parser.add_argument('raw_data_dir', help='directory with raw data')
-parser.add_argument('clean_data_dir', help='directory with clean OTU tables '
-    + 'and metadata')
+parser.add_argument('clean_data_dir', help='directory with the clean '
+    + 'datasets\' summary statistics (*.summary.clean.npz)')
 parser.add_argument('dataset_info', help='out file with the tab-delimited, '
     + 'unformatted information.')
 parser.add_argument('--subset', help='file with list of dataset IDs that '
@@ -66,6 +68,7 @@ parser.add_argument('--subset', help='file with list of dataset IDs that '
 parser.add_argument('--split-cases', help='flag to provide sample size info '
     + 'for each case group separately', action='store_true')
 args = parser.parse_args()
+profile_script()
 
 yamlinfo = fio.read_yaml(args.yaml_file, args.raw_data_dir)
 
@@ -79,6 +82,7 @@ else:
 statslst = []
 for dataset in datasetids:
     print(dataset),
+    profile_dataset(dataset)
 
     # Dataset metadata
     sequencer = yamlinfo[dataset]['sequencer']
@@ -87,8 +91,11 @@ for dataset in datasetids:
     # Citation for Latex string
     citation = "\cite{" + get_citation(dataset) + "}"
 
-    # Data-dependent info
-    df, meta = fio.read_dataset_files(dataset, args.clean_data_dir)
+    # Data-dependent info, from the sample sizes and read depths of each
+    # DiseaseState label in the dataset's summary statistics
+    summary = fio.read_dataset_summary(dataset, args.clean_data_dir)
+    labels = [str(g) for g in summary['groups']]
+    meta = pd.DataFrame({'DiseaseState': labels})
     if args.split_cases:
         classes_list = fio.get_classes(meta)
 
@@ -98,41 +105,42 @@ for dataset in datasetids:
 
             # Get samples
             sub_list = [classes_list[0], [dis_label]]
-            h_smpls, dis_smpls = fio.get_samples(meta, sub_list)
-            all_smpls = h_smpls + dis_smpls
+            h_stats = ss.pool_groups(summary, sub_list[0])
+            dis_stats = ss.pool_groups(summary, sub_list[1])
+            reads = pd.Series(ss.pool_groups(summary, sub_list[0]
+                                             + sub_list[1])['reads'])
 
             # String with the types of patients in control/case categories
             controls = ', '.join(sub_list[0])
             cases = ', '.join(sub_list[1])
 
             statslst.append([newdataset,
-                             len(h_smpls), len(dis_smpls),
-                             len(all_smpls),
+                             h_stats['n_samples'], dis_stats['n_samples'],
+                             len(reads),
                              controls, cases,
-                             df.loc[all_smpls].sum(axis=1).min(),
-                             df.loc[all_smpls].sum(axis=1).max(),
-                             df.loc[all_smpls].sum(axis=1).median(),
+                             reads.min(), reads.max(), reads.median(),
                              sequencer, region,
                              year, citation])
 
     else:
         classes_list = fio.get_classes(meta)
-        h_smpls, dis_smpls = fio.get_samples(meta, classes_list)
-        all_smpls = h_smpls + dis_smpls
+        h_stats = ss.pool_groups(summary, classes_list[0])
+        dis_stats = ss.pool_groups(summary, classes_list[1])
+        reads = pd.Series(ss.pool_groups(summary, classes_list[0]
+                                         + classes_list[1])['reads'])
 
         # String with the types of patients in control/case categories
         controls = ', '.join(classes_list[0])
         cases = ', '.join(classes_list[1])
 
         statslst.append([dataset,
-                         len(h_smpls), len(dis_smpls),
-                         len(all_smpls),
+                         h_stats['n_samples'], dis_stats['n_samples'],
+                         len(reads),
                          controls, cases,
-                         df.loc[all_smpls].sum(axis=1).min(),
-                         df.loc[all_smpls].sum(axis=1).max(),
-                         df.loc[all_smpls].sum(axis=1).median(),
+                         reads.min(), reads.max(), reads.median(),
                          sequencer, region,
                          year, citation])
+finish_dataset()
 
 # Convert to dataframe
 stats = pd.DataFrame(data=statslst,
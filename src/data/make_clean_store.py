@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+This script writes the clean OTU tables, metadata, and summary statistics
+of all datasets in a clean tables directory into one consolidated store
+(see src/util/CleanStore.py).
+
+The analysis scripts can be given the store's directory instead of
+data/clean_tables. Other scripts can use CleanStore.read_datasets() to
+read just some genera or DiseaseStates across all datasets, e.g.:
+    import CleanStore
+    data = CleanStore.read_datasets('data/clean_store',
+        genera=['k__Bacteria;...;g__Akkermansia'], disease_states=['H'])
+"""
+import os
+import sys
+import argparse
+
+# Add this repo to the path
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
+sys.path.insert(0, src_dir)
+import FileIO as fio
+import CleanStore
+from Profiling import profile_script, profile_dataset, finish_dataset
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument('clean_dir', help='directory with clean OTU tables, '
+        + 'metadata, and summary statistics')
+    p.add_argument('store_dir', help='directory of the store to write')
+    p.add_argument('--subset', help='file with the datasets to write (one '
+        + 'per line) [default: all datasets in clean_dir]', default=None)
+    args = p.parse_args()
+    profile_script()
+
+    if args.subset is not None:
+        with open(args.subset, 'r') as f:
+            datasetids = f.read().splitlines()
+    else:
+        datasetids = sorted(fio.get_dataset_ids(args.clean_dir))
+
+    print('Writing datasets to store...')
+    for dataset in datasetids:
+        profile_dataset(dataset)
+        print(dataset),
+        df, meta = fio.read_dataset_files(dataset, args.clean_dir)
+        summary = os.path.join(args.clean_dir,
+                               dataset + '.summary.clean.npz')
+        if not os.path.exists(summary):
+            summary = None
+        CleanStore.write_dataset(args.store_dir, dataset, df, meta, summary)
+    finish_dataset()
+    print('\nWriting datasets to store... Finished.')
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+"""
+This script writes synthetic clean OTU tables and metadata, in the same
+format as clean_otu_and_metadata.py (so that FileIO.read_dataset_files()
+and the analysis scripts can read them like the real datasets). It is
+meant for testing the analyses at sizes larger than the real data, and
+offline.
+
+Each dataset has case and control patients, with counts drawn from a
+zero-inflated negative binomial model:
+    - each genus has a log-normal mean relative abundance, split among its
+      OTUs, and each OTU has a prevalence (the probability that it's not a
+      structural zero in a sample)
+    - each sample has a log-normal read depth
+    - counts are Poisson with a gamma-distributed mean (i.e. negative
+      binomial), with dispersion --dispersion
+Some genera are made more or less abundant in the cases of each dataset
+(see --diff-genera). These are written to <out_dir>/planted_genera.txt,
+so that tests can check that the analyses find them.
+
+Dataset IDs are <disease>_synth<i>, with diseases taken in turn from the
+ones in FileIO.get_classes(), and DiseaseState is 'H' (controls) or the
+disease label (cases).
+
+Run it from the top directory of this repo, e.g.:
+    python src/data/simulate_datasets.py data/synthetic_tables \\
+        --datasets 20 --samples 2000 --otus 5000
+"""
+import argparse
+import numpy as np
+import pandas as pd
+
+# Add this repo to the path
+import os, sys
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
+sys.path.insert(0, src_dir)
+from SummaryStats import summarize_dataset, save_summary
+from FileIO import write_clean_table
+
+# Case labels which FileIO.get_classes() recognizes, and the study-wise
+# metadata that clean_otu_and_metadata.add_info_to_meta() adds
+DISEASES = ['ASD', 'CDI', 'CIRR', 'CRC', 'EDD', 'HIV', 'MHE', 'NASH', 'OB',
+            'PAR', 'PSA', 'RA', 'T1D', 'UC']
+SEQUENCERS = ['454', 'Miseq', 'Illumina']
+REGIONS = ['V1-V2', 'V3-V5', 'V4', 'V4-V5']
+
+# Rank prefixes, as in the RDP-assigned OTU tables
+PREFIXES = ['k__', 'p__', 'c__', 'o__', 'f__', 'g__', 's__']
+
+# Number of counts to simulate at once
+CHUNK_SIZE = 2*10**6
+
+def make_taxonomy(n_otus, n_genera, rs, frac_unannotated=0.2):
+    """
+    Make RDP-style lineages for n_otus OTUs in about n_genera genera.
+
+    Genera are grouped into families, orders, classes, and phyla with
+    a few children at each rank, so that collapsing to any rank merges
+    taxa. A fraction frac_unannotated of the OTUs are only annotated down
+    to a random rank above genus (e.g. 'k__Bacteria;p__Phylum1;c__;o__;
+    f__;g__;s__'). Every OTU ends in a unique 'd__denovo<i>' label.
+
+    Returns
+    -------
+    otus : list of str
+        lineage of each OTU
+    otu_genus : numpy array
+        index of each OTU's genus (between 0 and n_genera - 1), or -1 if
+        the OTU isn't annotated at the genus level
+    """
+    # Parent of each taxon at each rank, from genus up to phylum
+    n_taxa = [n_genera]
+    parents = []
+    for _ in range(4):
+        n_parent = max(1, int(round(n_taxa[-1]/3.0)))
+        parents.append(rs.randint(0, n_parent, n_taxa[-1]))
+        n_taxa.append(n_parent)
+
+    # Full lineage of each genus, from kingdom down
+    lineages = []
+    for g in range(n_genera):
+        ranks = [g]
+        for p in parents:
+            ranks.append(p[ranks[-1]])
+        names = ['Bacteria'] + ['{}{}'.format(name, i) for name, i in
+            zip(['Phylum', 'Class', 'Order', 'Family', 'Genus'],
+                ranks[::-1])]
+        lineages.append([pre + n for pre, n in zip(PREFIXES, names)])
+
+    # Every genus gets at least one OTU, and the rest are spread out
+    otu_genus = np.concatenate((np.arange(n_genera),
+        rs.randint(0, n_genera, max(0, n_otus - n_genera))))[:n_otus]
+    unannotated = rs.rand(n_otus) < frac_unannotated
+    # Lowest rank which unannotated OTUs are annotated at (phylum to family)
+    depth = rs.randint(2, 6, n_otus)
+
+    otus = []
+    for i, g in enumerate(otu_genus):
+        lineage = lineages[g][:depth[i] if unannotated[i] else 6]
+        lineage = lineage + PREFIXES[len(lineage):]
+        otus.append(';'.join(lineage + ['d__denovo{}'.format(i)]))
+    otu_genus = np.where(unannotated, -1, otu_genus)
+    return otus, otu_genus
+
+def simulate_counts(n_samples, otu_abun, otu_prev, case_fold, is_case,
+                    depth, dispersion, rs):
+    """
+    Draw zero-inflated negative binomial counts.
+
+    Parameters
+    ----------
+    n_samples : int
+        number of samples to simulate
+    otu_abun : numpy array, shape = [n_otus]
+        mean relative abundance of each OTU in the controls
+    otu_prev : numpy array, shape = [n_otus]
+        probability that each OTU isn't a structural zero
+    case_fold : numpy array, shape = [n_otus]
+        fold change of each OTU's abundance in cases
+    is_case : numpy array of bool, shape = [n_samples]
+    depth : numpy array, shape = [n_samples]
+        expected read depth of each sample
+    dispersion : float
+        negative binomial dispersion (variance = mu + dispersion*mu**2)
+    rs : numpy RandomState
+
+    Returns
+    -------
+    counts : numpy array of int, shape = [n_samples, n_otus]
+    """
+    abun = np.where(is_case[:, np.newaxis], otu_abun*case_fold, otu_abun)
+    abun /= abun.sum(axis=1)[:, np.newaxis]
+    # Scale up the non-zero counts, so that the expected depth is depth
+    mu = abun*depth[:, np.newaxis]/otu_prev
+    # Gamma-Poisson mixture is a negative binomial with mean mu
+    shape = 1.0/dispersion
+    lam = rs.gamma(shape, mu/shape)
+    counts = rs.poisson(lam)
+    counts[rs.rand(*counts.shape) > otu_prev] = 0
+    return counts
+
+def simulate_dataset(dataset, disease, otus, otu_genus, genus_abun, n_samples,
+                     planted, rs, case_frac=0.5, fold_change=4.0,
+                     median_depth=10000, dispersion=2.0, numeric_ids=False):
+    """
+    Simulate one clean dataset.
+
+    Parameters
+    ----------
+    dataset : str
+        dataset ID
+    disease : str
+        case DiseaseState label
+    otus, otu_genus : from make_taxonomy()
+    genus_abun : numpy array, shape = [n_genera]
+        mean relative abundance of each genus in controls
+    n_samples : int
+        number of samples
+    planted : numpy array of int
+        indices of the genera which are differentially abundant. The first
+        half are enriched in cases, and the rest are depleted.
+    rs : numpy RandomState
+    case_frac : float
+        fraction of samples which are cases
+    fold_change : float
+        fold change of planted genera in cases
+    median_depth : float
+        median read depth
+    dispersion : float
+        negative binomial dispersion
+    numeric_ids : bool
+        whether sample IDs should be only digits (like some of the real
+        datasets)
+
+    Returns
+    -------
+    df : pandas DataFrame
+        counts, samples in rows and OTUs in columns
+    meta : pandas DataFrame
+        metadata with samples in rows, and DiseaseState, dataset, sequencer,
+        region, year, and total_reads columns
+    """
+    n_otus = len(otus)
+    # Split each genus' abundance among its OTUs. Unannotated OTUs get
+    # abundances drawn like the genera's.
+    otu_share = rs.gamma(0.5, 1.0, n_otus)
+    annotated = otu_genus >= 0
+    genus_share = np.bincount(otu_genus[annotated],
+                              weights=otu_share[annotated],
+                              minlength=len(genus_abun))
+    otu_abun = np.where(annotated,
+        genus_abun[np.maximum(otu_genus, 0)]*otu_share
+            /genus_share[np.maximum(otu_genus, 0)],
+        rs.choice(genus_abun, n_otus)*otu_share)
+    # Rarer OTUs are also less prevalent
+    rank = otu_abun.argsort().argsort()/float(n_otus)
+    otu_prev = np.clip(rs.beta(2, 2, n_otus)*0.6 + 0.4*rank, 0.02, 1.0)
+
+    fold = np.ones(len(genus_abun))
+    n_up = (len(planted) + 1)//2
+    fold[planted[:n_up]] = fold_change
+    fold[planted[n_up:]] = 1.0/fold_change
+    case_fold = np.where(annotated, fold[np.maximum(otu_genus, 0)], 1.0)
+
+    is_case = rs.rand(n_samples) < case_frac
+    # At least one sample in each group
+    is_case[0], is_case[-1] = False, True
+    depth = median_depth*rs.lognormal(0, 0.5, n_samples)
+    # Simulate a block of samples at a time, so that the intermediate
+    # arrays stay small for large datasets
+    counts = np.empty((n_samples, n_otus), dtype=int)
+    block = max(1, CHUNK_SIZE//n_otus)
+    for start in range(0, n_samples, block):
+        rows = slice(start, min(start + block, n_samples))
+        counts[rows] = simulate_counts(counts[rows].shape[0], otu_abun,
+                                       otu_prev, case_fold, is_case[rows],
+                                       depth[rows], dispersion, rs)
+
+    # Clean tables don't have empty samples
+    empty = counts.sum(axis=1) == 0
+    counts[empty, otu_abun.argmax()] = 1
+
+    if numeric_ids:
+        smpls = [str(100000 + i) for i in range(n_samples)]
+    else:
+        smpls = ['S{}'.format(i) for i in range(n_samples)]
+    df = pd.DataFrame(counts, index=smpls, columns=otus)
+
+    meta = pd.DataFrame(index=smpls)
+    meta['DiseaseState'] = np.where(is_case, disease, 'H')
+    meta['dataset'] = dataset
+    meta['sequencer'] = rs.choice(SEQUENCERS)
+    meta['region'] = rs.choice(REGIONS)
+    meta['year'] = rs.randint(2010, 2018)
+    meta['total_reads'] = df.sum(axis=1)
+    return df, meta
+
+def write_dataset(df, meta, dataset, out_dir):
+    """
+    Write a dataset like clean_otu_and_metadata.py does: feather files with
+    the sample IDs in the first column, and the summary statistics.
+    """
+    out = os.path.join(out_dir, dataset)
+    save_summary(out + '.summary.clean.npz', summarize_dataset(df, meta))
+    write_clean_table(df, out + '.otu_table.clean.feather')
+    write_clean_table(meta, out + '.metadata.clean.feather')
+
+def simulate_datasets(out_dir, n_datasets=10, n_samples=200, n_otus=1000,
+                      n_genera=None, n_diff=10, frac_shared=0.5,
+                      random_state=12345, **kwargs):
+    """
+    Simulate and write n_datasets clean datasets to out_dir.
+
+    The datasets share one taxonomy and genus abundance profile. Each
+    dataset has n_diff planted genera: a fraction frac_shared of them are
+    the same in all datasets (like the shared response to disease), and
+    the rest are specific to the dataset. Sample sizes vary between half
+    and 1.5 times n_samples. Other keyword arguments are passed to
+    simulate_dataset().
+
+    Returns
+    -------
+    planted : pandas DataFrame
+        one row per dataset and planted genus, with columns 'dataset',
+        'genus' (its lineage, as in the genus-level tables), and 'effect'
+        (+1 if it's enriched in cases, -1 if depleted)
+    """
+    if n_genera is None:
+        n_genera = max(1, n_otus//10)
+    rs = np.random.RandomState(random_state)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    otus, otu_genus = make_taxonomy(n_otus, n_genera, rs)
+    # Only genera with annotated OTUs are in the genus-level tables
+    genera = np.unique(otu_genus[otu_genus >= 0])
+    genus_abun = rs.lognormal(0, 2, n_genera)
+    genus_abun /= genus_abun.sum()
+    genus_lineage = {}
+    for otu, g in zip(otus, otu_genus):
+        if g >= 0 and g not in genus_lineage:
+            genus_lineage[g] = otu.split(';s__')[0]
+
+    n_diff = min(n_diff, len(genera))
+    n_shared = int(round(n_diff*frac_shared))
+    shared = rs.choice(genera, n_shared, replace=False)
+
+    planted_rows = []
+    for i in range(n_datasets):
+        disease = DISEASES[i % len(DISEASES)]
+        dataset = '{}_synth{}'.format(disease.lower(), i)
+        print(dataset),
+        specific = rs.choice(np.setdiff1d(genera, shared),
+                             n_diff - n_shared, replace=False)
+        planted = rs.permutation(np.concatenate((shared, specific)))
+        n = rs.randint(max(2, n_samples//2), max(3, n_samples*3//2 + 1))
+        df, meta = simulate_dataset(dataset, disease, otus, otu_genus,
+                                    genus_abun, n, planted, rs, **kwargs)
+        write_dataset(df, meta, dataset, out_dir)
+
+        n_up = (len(planted) + 1)//2
+        planted_rows += [[dataset, genus_lineage[g], 1 if j < n_up else -1]
+                         for j, g in enumerate(planted)]
+    print('')
+    return pd.DataFrame(planted_rows, columns=['dataset', 'genus', 'effect'])
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument('out_dir', help='directory to write the clean tables to')
+    p.add_argument('--datasets', help='number of datasets '
+        + '[default: %(default)s]', default=10, type=int)
+    p.add_argument('--samples', help='average number of samples per dataset '
+        + '[default: %(default)s]', default=200, type=int)
+    p.add_argument('--otus', help='number of OTUs [default: %(default)s]',
+        default=1000, type=int)
+    p.add_argument('--genera', help='number of genera [default: --otus/10]',
+        default=None, type=int)
+    p.add_argument('--diff-genera', help='number of genera which are '
+        + 'differentially abundant in each dataset [default: %(default)s]',
+        default=10, type=int)
+    p.add_argument('--frac-shared', help='fraction of the differentially '
+        + 'abundant genera which are the same in every dataset '
+        + '[default: %(default)s]', default=0.5, type=float)
+    p.add_argument('--fold-change', help='fold change of the differentially '
+        + 'abundant genera [default: %(default)s]', default=4.0, type=float)
+    p.add_argument('--case-frac', help='fraction of samples which are cases '
+        + '[default: %(default)s]', default=0.5, type=float)
+    p.add_argument('--depth', help='median read depth '
+        + '[default: %(default)s]', default=10000, type=float)
+    p.add_argument('--dispersion', help='negative binomial dispersion '
+        + '[default: %(default)s]', default=2.0, type=float)
+    p.add_argument('--numeric-ids', help='flag to make sample IDs digits '
+        + 'only, like in some of the real datasets', action='store_true')
+    p.add_argument('--random-state', help='random seed '
+        + '[default: %(default)s]', default=12345, type=int)
+    args = p.parse_args()
+
+    planted = simulate_datasets(args.out_dir, n_datasets=args.datasets,
+        n_samples=args.samples, n_otus=args.otus, n_genera=args.genera,
+        n_diff=args.diff_genera, frac_shared=args.frac_shared,
+        random_state=args.random_state, case_frac=args.case_frac,
+        fold_change=args.fold_change, median_depth=args.depth,
+        dispersion=args.dispersion, numeric_ids=args.numeric_ids)
+    planted.to_csv(os.path.join(args.out_dir, 'planted_genera.txt'),
+                   sep='\t', index=False)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+This script writes the summary statistics (datasetID.summary.clean.npz, see
+src/util/SummaryStats.py) of clean datasets from their clean OTU tables
+and metadata.
+
+clean_otu_and_metadata.py already writes them when it cleans a dataset.
+This script makes them for datasets which were cleaned before the
+summaries existed (or whose summaries were deleted) without re-cleaning
+the raw data, e.g.:
+    python src/data/summarize_clean_tables.py data/clean_tables \\
+        --datasets cdi_schubert crc_baxter
+"""
+import os
+import sys
+import argparse
+
+# Add this repo to the path
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
+sys.path.insert(0, src_dir)
+import FileIO as fio
+from SummaryStats import summarize_dataset, save_summary
+from Profiling import profile_script, profile_dataset, finish_dataset
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument('clean_dir', help='directory with clean OTU tables and '
+        + 'metadata, where the summaries are written')
+    p.add_argument('--datasets', help='datasets to summarize [default: all '
+        + 'datasets in clean_dir]', nargs='+', default=None)
+    args = p.parse_args()
+    profile_script()
+
+    if args.datasets is not None:
+        datasetids = args.datasets
+    else:
+        datasetids = sorted(fio.get_dataset_ids(args.clean_dir))
+
+    print('Summarizing datasets...')
+    for dataset in datasetids:
+        profile_dataset(dataset)
+        print(dataset),
+        df, meta = fio.read_dataset_files(dataset, args.clean_dir)
+        save_summary(os.path.join(args.clean_dir,
+                                  dataset + '.summary.clean.npz'),
+                     summarize_dataset(df, meta))
+    finish_dataset()
+    print('\nSummarizing datasets... Finished.')
@@ -18,6 +18,7 @@ import os, sys
 src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
 from Formatting import get_phylo_colors
+from Taxonomy import taxon_name
 
 p = argparse.ArgumentParser()
 p.add_argument('disease', help='path to file with disease-wise meta-analysis '
@@ -96,7 +97,7 @@ if args.labels:
     # Get series with True/False if any of the values are not NaN
     labeldf = overall_meta.join(disease_meta)
     labeldf = labeldf.applymap(np.isfinite).sum(axis=1).astype(bool)
-    labels = [i.split(';')[-1][3:] for i in labeldf.index]
+    labels = [taxon_name(i) for i in labeldf.index]
 
     axL1.set_yticks(range(0, len(labeldf)))
     axL1.set_yticklabels(labels,fontsize='xx-small', rotation=180, va='center')
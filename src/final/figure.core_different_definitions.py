@@ -18,6 +18,7 @@ import os, sys
 src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
 from Formatting import get_phylo_colors, reorder_index_from_tree
+from Taxonomy import taxon_name
 
 p = argparse.ArgumentParser()
 p.add_argument('heuristic', help='path to file with core/overall meta-analysis '
@@ -87,7 +88,7 @@ axM1.set_xticklabels(['Stouffer', 'No diarrhea', '2+ diseases'], rotation=270)
 if args.labels:
     ## Label left-most axis with significant genera
     # Get series with True/False if any of the values are not NaN
-    labels = [i.split(';')[-1][3:] for i in core_all.index]
+    labels = [taxon_name(i) for i in core_all.index]
     axL1.set_yticks(range(0, core_all.shape[0]))
     axL1.set_yticklabels(labels,fontsize='xx-small', rotation=180, va='center')
 
@@ -20,6 +20,7 @@ import os, sys
 src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
 import Formatting as fmt
+from Taxonomy import taxon_name
 
 
 def plot_overall_heatmap_figure(mean_toplot, phylo_toplot, overall_df,
@@ -147,7 +148,7 @@ def plot_overall_heatmap_figure(mean_toplot, phylo_toplot, overall_df,
     # Add genus labels to right-most axis
     ax.yaxis.tick_right()
     ax.yaxis.set_label_position('right')
-    labels = [i.split(';')[-1][3:] for i in subdf.index]
+    labels = [taxon_name(i) for i in subdf.index]
     ax.set_yticks(np.arange(0, len(labels)))
     ax.set_yticklabels(labels, fontsize=8, va='center')
 
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Functions to calculate beta diversity (between-sample distances) for tables
+with too many samples to hold the full distance matrix in memory.
+
+Distances are calculated in square blocks of samples, in parallel, and
+written straight into a condensed distance matrix (as returned by
+scipy.spatial.distance.pdist) in a memory-mapped .npy file. Only the
+samples' features and one block of distances per process are in memory at
+any time.
+"""
+import multiprocessing
+from functools import partial
+import numpy as np
+from scipy.spatial.distance import cdist
+
+# Beta diversity metrics, and the function that gets the values that
+# scipy's cdist() should be calculated on from the abundance table.
+# Jaccard distance is calculated on presence/absence.
+METRICS = {'braycurtis': lambda X: X,
+           'jaccard': lambda X: X > 0}
+
+def n_condensed(n_smpls):
+    """
+    Returns the length of the condensed distance matrix for n_smpls samples.
+    """
+    return n_smpls*(n_smpls - 1)//2
+
+def condensed_index(n_smpls, i, j):
+    """
+    Returns the position of the distance between samples i and j (i < j) in
+    the condensed distance matrix, as in scipy.spatial.distance.squareform
+    """
+    return n_smpls*i - i*(i + 1)//2 + (j - i - 1)
+
+def make_blocks(n_smpls, block_size):
+    """
+    Returns the (row_start, row_end, col_start, col_end) of each block of
+    the upper triangle of the distance matrix.
+    """
+    starts = range(0, n_smpls, block_size)
+    return [(r0, min(r0 + block_size, n_smpls), c0, min(c0 + block_size, n_smpls))
+            for r0 in starts for c0 in starts if c0 >= r0]
+
+def write_block(out, n_smpls, D, r0, r1, c0, c1):
+    """
+    Write the distances in block D (between rows r0:r1 and columns c0:c1)
+    into the condensed distance matrix out. Only distances with row < column
+    are written. For each row, these are contiguous in out.
+    """
+    for i in range(r0, r1):
+        start = max(c0, i + 1)
+        if start >= c1:
+            continue
+        pos = condensed_index(n_smpls, i, start)
+        out[pos:pos + c1 - start] = D[i - r0, start - c0:]
+
+# The features, distance function, and memory-mapped output are given to
+# each worker once, when the worker starts (instead of with every block) by
+# _init_beta_worker.
+_beta_X = None
+_beta_dist_fun = None
+_beta_out = None
+
+def _init_beta_worker(X, dist_fun, out_file):
+    global _beta_X, _beta_dist_fun, _beta_out
+    _beta_X = X
+    _beta_dist_fun = dist_fun
+    _beta_out = np.lib.format.open_memmap(out_file, mode='r+')
+
+def _run_one_block(block):
+    """
+    Calculate one block of distances and write it to the output file.
+    """
+    r0, r1, c0, c1 = block
+    D = _beta_dist_fun(_beta_X[r0:r1], _beta_X[c0:c1])
+    write_block(_beta_out, _beta_X.shape[0], D, r0, r1, c0, c1)
+    _beta_out.flush()
+    return r1 - r0
+
+def blocked_distances(X, dist_fun, out_file, block_size=1024, n_jobs=None):
+    """
+    Calculate the distance between all pairs of rows in X, in blocks.
+
+    Parameters
+    ----------
+    X : numpy array
+        samples in rows, features in columns
+    dist_fun : function
+        takes two arrays of samples A and B and returns the
+        (len(A) x len(B)) array of distances between them, like
+        scipy.spatial.distance.cdist. Has to be picklable (e.g. a module-
+        level function or a functools.partial of one).
+    out_file : str
+        .npy file to write the condensed distance matrix to
+    block_size : int (default: 1024)
+        number of samples in each block. Each process holds one
+        block_size x block_size array of distances in memory.
+    n_jobs : int (default: None)
+        number of processes. If None, uses all of the available CPUs.
+        If 1, runs serially in this process.
+
+    Returns
+    -------
+    dists : numpy memmap
+        the condensed distance matrix, opened read-only
+    """
+    X = np.ascontiguousarray(X)
+    n_smpls = X.shape[0]
+
+    out = np.lib.format.open_memmap(out_file, mode='w+', dtype=np.float64,
+                                    shape=(n_condensed(n_smpls),))
+    del out
+
+    blocks = make_blocks(n_smpls, block_size)
+    if n_jobs == 1:
+        _init_beta_worker(X, dist_fun, out_file)
+        for block in blocks:
+            _run_one_block(block)
+    else:
+        pool = multiprocessing.Pool(n_jobs, initializer=_init_beta_worker,
+                                    initargs=(X, dist_fun, out_file))
+        # Blocks are different sizes at the edges, so hand them out one
+        # at a time
+        for _ in pool.imap_unordered(_run_one_block, blocks):
+            pass
+        pool.close()
+        pool.join()
+
+    return np.load(out_file, mmap_mode='r')
+
+def beta_diversity(X, metric, out_file, block_size=1024, n_jobs=None):
+    """
+    Calculate the Bray-Curtis or Jaccard distance between all pairs of
+    samples, in blocks. See blocked_distances() for the other parameters.
+
+    Parameters
+    ----------
+    X : numpy array
+        samples in rows, features (e.g. relative abundance of each genus)
+        in columns
+    metric : str
+        'braycurtis' or 'jaccard' (see METRICS)
+
+    Returns
+    -------
+    dists : numpy memmap
+        the condensed distance matrix, opened read-only. It's the same as
+        scipy.spatial.distance.pdist(METRICS[metric](X), metric).
+    """
+    if metric not in METRICS:
+        raise ValueError('Unknown beta diversity metric {}. Options are: '
+                         '{}'.format(metric, ', '.join(sorted(METRICS))))
+    return blocked_distances(METRICS[metric](X), partial(cdist, metric=metric),
+                             out_file, block_size=block_size, n_jobs=n_jobs)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Functions to read OTU tables in the BIOM 2.x (HDF5) format, without making
+a dense table.
+
+A BIOM file has the counts as a sparse matrix twice: by observation (OTU)
+in 'observation/matrix', and by sample in 'sample/matrix' (i.e. the CSC
+and CSR matrices of the samples x OTUs table). Samples are read from
+'sample/matrix' in blocks of CHUNK_SIZE samples, straight into a scipy
+CSR matrix. Only the counts of the samples which are needed are read
+(each run of consecutive samples in one slice), and the table is never
+dense. Each OTU is named by its lineage (from the taxonomy in the
+observation metadata) and its ID, like the OTUs in the tab-delimited
+tables, e.g. 'k__Bacteria;...;g__Akkermansia;s__;d__denovo12'.
+"""
+import numpy as np
+import h5py
+from scipy import sparse
+
+# Number of samples read at a time
+CHUNK_SIZE = 1000
+
+def _decode(values):
+    """
+    Returns the strings in an HDF5 dataset as str.
+    """
+    return [v if isinstance(v, str) else v.decode('utf-8') for v in values]
+
+def sample_ids(fn):
+    """
+    Returns the sample IDs in a BIOM file, in order.
+    """
+    with h5py.File(fn, 'r') as f:
+        return _decode(f['sample/ids'][:])
+
+def otu_names(f):
+    """
+    Returns the name of each OTU in an open BIOM file: its lineage and its
+    ID, separated by ';d__'. If the file doesn't have taxonomy metadata,
+    the OTU IDs are used as they are (e.g. if they are already lineages).
+    """
+    ids = _decode(f['observation/ids'][:])
+    if 'observation/metadata/taxonomy' not in f:
+        return ids
+    taxonomy = f['observation/metadata/taxonomy'][:]
+    names = []
+    for otu, taxa in zip(ids, taxonomy):
+        lineage = [t.strip() for t in _decode(np.atleast_1d(taxa))]
+        names.append(';'.join([t for t in lineage if t] + ['d__' + otu]))
+    return names
+
+def sample_runs(rows):
+    """
+    Returns the runs of consecutive rows in rows (sorted row indices), as
+    a list of (first, last + 1) pairs.
+    """
+    rows = np.asarray(rows)
+    if len(rows) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(rows)]))
+    return [(rows[s], rows[e - 1] + 1) for s, e in zip(starts, ends)]
+
+def read_table(fn, samples=None, chunk_size=CHUNK_SIZE):
+    """
+    Read the counts of a BIOM file as a sparse matrix.
+
+    Parameters
+    ----------
+    fn : str
+        BIOM 2.x (HDF5) file
+    samples : collection of str, optional
+        IDs of the samples to read. Other samples aren't read.
+    chunk_size : int
+        number of samples to read at a time
+
+    Returns
+    -------
+    X : scipy sparse CSR matrix
+        samples in rows, OTUs in columns. Counts are integers if they're
+        all whole numbers.
+    smpls : list of str
+        sample ID of each row, in the order they're in the file
+    otus : list of str
+        name of each column (see otu_names())
+    """
+    with h5py.File(fn, 'r') as f:
+        ids = _decode(f['sample/ids'][:])
+        otus = otu_names(f)
+        if samples is None:
+            rows = np.arange(len(ids))
+        else:
+            samples = set(samples)
+            rows = np.array([i for i, s in enumerate(ids) if s in samples],
+                            dtype=int)
+        indptr = f['sample/matrix/indptr'][:]
+        data = f['sample/matrix/data']
+        indices = f['sample/matrix/indices']
+
+        blocks = []
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            # Read only the counts of the samples in the chunk: one slice
+            # per run of consecutive samples
+            block_data, block_indices = [], []
+            for first, last in sample_runs(chunk):
+                lo, hi = indptr[first], indptr[last]
+                block_data.append(data[lo:hi])
+                block_indices.append(indices[lo:hi])
+            block_indptr = np.concatenate(
+                ([0], np.cumsum(indptr[chunk + 1] - indptr[chunk])))
+            blocks.append(sparse.csr_matrix(
+                (np.concatenate(block_data), np.concatenate(block_indices),
+                 block_indptr),
+                shape=(len(chunk), len(otus))))
+
+    if len(blocks) > 0:
+        X = sparse.vstack(blocks, format='csr')
+    else:
+        X = sparse.csr_matrix((0, len(otus)))
+    X.eliminate_zeros()
+    if X.dtype.kind == 'f' and np.all(np.mod(X.data, 1) == 0):
+        X = X.astype(np.int64)
+    return X, [ids[i] for i in rows], otus
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+Functions to write and read the consolidated store of clean datasets.
+
+The store is one directory which holds the clean OTU tables, metadata,
+and summary statistics of all datasets (made from the per-dataset feather
+files in data/clean_tables by src/data/make_clean_store.py), partitioned
+by dataset:
+
+    <store>/store.json                  list of the datasets in the store
+    <store>/dataset=<id>/counts.parquet   OTU table
+    <store>/dataset=<id>/metadata.parquet metadata
+    <store>/dataset=<id>/summary.npz      summary statistics
+
+The tables are Parquet files, with the sample IDs stored as a string
+column which the file's schema marks as the index (so they are read back
+as strings, with the same index name). The OTU table has one column per
+OTU, and its samples are grouped by DiseaseState, with one row group per
+label (listed in the file's 'clean_store' metadata). So reading:
+    - some datasets only opens their partitions
+    - some genera (or OTUs) only reads the columns for their OTUs
+    - some DiseaseStates only reads their row groups
+Files are memory-mapped, rather than read into memory before they're
+decoded.
+
+FileIO.read_dataset_files() and get_dataset_ids() read from a store when
+they're given its directory instead of data/clean_tables, so the analysis
+scripts can be run on a store as is.
+"""
+import os
+import json
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Add this repo to the path
+import sys
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
+sys.path.insert(0, src_dir)
+from Taxonomy import TAXONOMY
+from Profiling import profiled
+
+STORE_FILE = 'store.json'
+# Key of the OTU tables' row group labels in their Parquet metadata
+ROW_GROUPS_KEY = b'clean_store'
+
+def is_store(path):
+    """
+    Returns whether path is the directory of a store.
+    """
+    return os.path.isfile(os.path.join(path, STORE_FILE))
+
+def dataset_dir(store_dir, datasetid):
+    """
+    Returns the partition directory of datasetid in the store.
+    """
+    return os.path.join(store_dir, 'dataset=' + datasetid)
+
+def summary_file(store_dir, datasetid):
+    """
+    Returns the path to datasetid's summary statistics in the store.
+    """
+    return os.path.join(dataset_dir(store_dir, datasetid), 'summary.npz')
+
+def list_datasets(store_dir):
+    """
+    Returns the IDs of the datasets in the store.
+    """
+    with open(os.path.join(store_dir, STORE_FILE), 'r') as f:
+        return [str(d) for d in json.load(f)['datasets']]
+
+def _add_to_store_file(store_dir, datasetid):
+    datasets = list_datasets(store_dir) if is_store(store_dir) else []
+    if datasetid not in datasets:
+        datasets = sorted(datasets + [datasetid])
+    with open(os.path.join(store_dir, STORE_FILE), 'w') as f:
+        json.dump({'datasets': datasets}, f, indent=1)
+
+def _string_index(df):
+    """
+    Returns a copy of df whose index is strings, as the store keeps it.
+    """
+    df = df.copy()
+    df.index = pd.Index([str(i) for i in df.index], name=df.index.name,
+                        dtype=object)
+    return df
+
+def write_dataset(store_dir, datasetid, df, meta, summary=None):
+    """
+    Write one dataset to the store, replacing it if it's already there.
+
+    Parameters
+    ----------
+    store_dir : str
+        directory of the store (made if it doesn't exist)
+    datasetid : str
+    df : pandas DataFrame
+        clean OTU table, samples in rows and OTUs in columns
+    meta : pandas DataFrame
+        clean metadata, with the same samples as df in its index and a
+        'DiseaseState' column
+    summary : str, optional
+        path to the dataset's summary statistics file, which is copied
+        into the store
+    """
+    part = dataset_dir(store_dir, datasetid)
+    if os.path.exists(part):
+        shutil.rmtree(part)
+    os.makedirs(part)
+
+    meta = _string_index(meta)
+    pq.write_table(pa.Table.from_pandas(meta),
+                   os.path.join(part, 'metadata.parquet'))
+
+    # One row group per DiseaseState, in the order they first appear
+    df = _string_index(df)
+    labels = meta['DiseaseState'].reindex(df.index).astype(str)
+    groups = list(pd.unique(labels))
+    schema = pa.Table.from_pandas(df.iloc[:1]).schema
+    metadata = dict(schema.metadata)
+    metadata[ROW_GROUPS_KEY] = json.dumps({'row_groups': groups}).encode('utf-8')
+    schema = schema.with_metadata(metadata)
+    writer = pq.ParquetWriter(os.path.join(part, 'counts.parquet'), schema)
+    for group in groups:
+        writer.write_table(pa.Table.from_pandas(df[(labels == group).values],
+                                                schema=schema))
+    writer.close()
+
+    if summary is not None:
+        shutil.copyfile(summary, summary_file(store_dir, datasetid))
+    _add_to_store_file(store_dir, datasetid)
+
+def _open(fn):
+    return pq.ParquetFile(fn, memory_map=True)
+
+def row_groups(pf):
+    """
+    Returns the DiseaseState label of each row group in a store's OTU table
+    (a pyarrow ParquetFile).
+    """
+    return json.loads(pf.metadata.metadata[ROW_GROUPS_KEY].decode('utf-8'))['row_groups']
+
+def otu_columns(pf):
+    """
+    Returns the OTU columns of a store's OTU table (a pyarrow ParquetFile),
+    in order, without the sample ID column.
+    """
+    pandas_meta = json.loads(pf.metadata.metadata[b'pandas'].decode('utf-8'))
+    index_cols = pandas_meta['index_columns']
+    return [c['name'] for c in pandas_meta['columns']
+            if c['field_name'] not in index_cols]
+
+def genus_columns(columns, genera):
+    """
+    Returns the columns (OTUs) which are in genera, i.e. whose taxonomy at
+    genus level (as in the index of the q-values files, e.g.
+    'k__Bacteria;...;g__Akkermansia') is one of genera.
+    """
+    genera = set(genera)
+    codes = TAXONOMY.codes(columns, 'genus')
+    names = TAXONOMY.decode([c for c in codes if c >= 0], 'genus')
+    annotated = [col for col, c in zip(columns, codes) if c >= 0]
+    return [col for col, g in zip(annotated, names) if g in genera]
+
+def read_metadata(store_dir, datasetid, disease_states=None):
+    """
+    Read a dataset's metadata from the store. If disease_states is given,
+    only returns the samples with those DiseaseState labels.
+    """
+    fn = os.path.join(dataset_dir(store_dir, datasetid), 'metadata.parquet')
+    meta = _open(fn).read(use_pandas_metadata=True).to_pandas()
+    if disease_states is not None:
+        meta = meta[meta['DiseaseState'].isin(disease_states)]
+    return meta
+
+def read_counts(store_dir, datasetid, columns=None, genera=None,
+                disease_states=None):
+    """
+    Read a dataset's OTU table from the store, reading only the columns
+    and row groups which are asked for.
+
+    Parameters
+    ----------
+    store_dir, datasetid : str
+    columns : list of str, optional
+        OTUs to read
+    genera : list of str, optional
+        read only the OTUs in these genera (see genus_columns())
+    disease_states : list of str, optional
+        read only the samples with these DiseaseState labels
+
+    Returns
+    -------
+    df : pandas DataFrame
+        samples in rows, OTUs in columns (in the same order as they were
+        written). Samples are grouped by DiseaseState.
+    """
+    pf = _open(os.path.join(dataset_dir(store_dir, datasetid),
+                            'counts.parquet'))
+    if columns is None:
+        columns = otu_columns(pf)
+    if genera is not None:
+        columns = genus_columns(columns, genera)
+    groups = [i for i, group in enumerate(row_groups(pf))
+              if disease_states is None or group in disease_states]
+    if len(groups) > 0:
+        tables = [pf.read_row_group(i, columns=columns,
+                                    use_pandas_metadata=True)
+                  for i in groups]
+    else:
+        tables = [pf.read_row_group(0, columns=columns,
+                                    use_pandas_metadata=True).slice(0, 0)]
+    df = pa.concat_tables(tables).to_pandas()
+    return df[columns]
+
+def read_dataset(store_dir, datasetid, columns=None, genera=None,
+                 disease_states=None):
+    """
+    Read a dataset from the store, like FileIO.read_dataset_files(). The
+    arguments are as in read_counts().
+
+    Returns
+    -------
+    df, meta : pandas DataFrames
+        OTU table and metadata, with the samples in the same order as they
+        were written
+    """
+    with profiled('read_dataset', datasetid) as p:
+        meta = read_metadata(store_dir, datasetid, disease_states)
+        df = read_counts(store_dir, datasetid, columns, genera,
+                         disease_states)
+        df = df.loc[meta.index]
+        p.set_shape(df)
+        return df, meta
+
+def read_datasets(store_dir, datasets=None, columns=None, genera=None,
+                  disease_states=None):
+    """
+    Read some or all of the datasets in the store. The other arguments are
+    as in read_counts(), and apply to all datasets (e.g. to read some
+    genera across all studies).
+
+    Returns
+    -------
+    data : dict
+        {dataset: (df, meta)}
+    """
+    if datasets is None:
+        datasets = list_datasets(store_dir)
+    data = {}
+    for dataset in datasets:
+        data[dataset] = read_dataset(store_dir, dataset, columns, genera,
+                                     disease_states)
+    return data
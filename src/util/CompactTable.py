@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Functions to write and read clean OTU tables in a compact format, for
+archiving them and for reading them from disk faster.
+
+The clean feather tables are dense, with one int64 column per OTU and the
+full lineage string of each OTU as its column name. Most counts are zero,
+and the lineages repeat the same taxa over and over. A compact table is
+one Parquet file (datasetID.otu_table.clean.compact.parquet) with:
+    - only the non-zero counts, as (sample, otu, count) rows sorted by
+      sample, in blocks of BLOCK_SIZE rows (Parquet row groups)
+    - sample and OTU positions and counts in the narrowest integer dtypes
+      that hold them
+    - the sample IDs and the OTUs' lineages in the file's metadata, with
+      the lineages dictionary-encoded (each taxon is stored once, and each
+      lineage is a list of codes)
+    - fast compression (zstd by default, or lz4)
+
+read_table() gives back exactly the table that was written: same values,
+dtype, sample IDs, and OTU columns, in the same order. FileIO's
+read_dataset_files() reads compact tables when a dataset's clean feather
+OTU table isn't there, so a folder made by src/data/compact_clean_tables.py
+can be used in place of data/clean_tables.
+"""
+import json
+import zlib
+import base64
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SUFFIX = '.otu_table.clean.compact.parquet'
+# Number of non-zero counts in each block
+BLOCK_SIZE = 2**20
+# Key of the sample IDs, lineages, and dtype in the file's metadata
+METADATA_KEY = b'compact_table'
+
+def narrowest_dtype(values):
+    """
+    Returns the narrowest numpy dtype which holds values exactly: the
+    smallest (unsigned, if possible) integer type for integers, and
+    float32 for floats which don't lose anything in float32.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        if np.array_equal(values.astype(np.float32), values):
+            return np.dtype(np.float32)
+        return values.dtype
+    if values.dtype.kind not in 'iu' or len(values) == 0:
+        return values.dtype
+    lo, hi = values.min(), values.max()
+    kinds = ['uint8', 'uint16', 'uint32', 'uint64'] if lo >= 0 \
+        else ['int8', 'int16', 'int32', 'int64']
+    for kind in kinds:
+        info = np.iinfo(kind)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(kind)
+    return values.dtype
+
+def encode_lineages(lineages):
+    """
+    Dictionary-encode semicolon-delimited lineages.
+
+    Returns
+    -------
+    taxa : list of lists
+        the taxa at each position in the lineages (e.g. taxa[1] has the
+        phyla), in the order they're first seen
+    codes : list of lists
+        each lineage, as the index of each of its taxa in taxa
+    """
+    taxa = []
+    ids = []
+    codes = []
+    for lineage in lineages:
+        parts = lineage.split(';')
+        while len(taxa) < len(parts):
+            taxa.append([])
+            ids.append({})
+        code = []
+        for i, part in enumerate(parts):
+            if part not in ids[i]:
+                ids[i][part] = len(taxa[i])
+                taxa[i].append(part)
+            code.append(ids[i][part])
+        codes.append(code)
+    return taxa, codes
+
+def decode_lineages(taxa, codes):
+    """
+    Returns the lineages encoded by encode_lineages().
+    """
+    return [';'.join([taxa[i][c] for i, c in enumerate(code)])
+            for code in codes]
+
+def write_table(df, fn, compression='zstd'):
+    """
+    Write a clean OTU table in the compact format.
+
+    Parameters
+    ----------
+    df : pandas DataFrame
+        samples in rows, OTUs in columns
+    fn : str
+        file to write
+    compression : str
+        Parquet compression codec, e.g. 'zstd' or 'lz4'
+    """
+    values = df.values
+    smpls, otus = np.nonzero(values)
+    counts = values[smpls, otus]
+    table = pa.Table.from_arrays(
+        [pa.array(smpls.astype(narrowest_dtype([len(df.index)]))),
+         pa.array(otus.astype(narrowest_dtype([len(df.columns)]))),
+         pa.array(counts.astype(narrowest_dtype(counts)))],
+        ['sample', 'otu', 'count'])
+
+    taxa, codes = encode_lineages([str(c) for c in df.columns])
+    info = {'samples': [str(i) for i in df.index],
+            'index_name': df.index.name,
+            'dtype': str(values.dtype),
+            'taxa': taxa,
+            'codes': codes}
+    info = base64.b64encode(zlib.compress(json.dumps(info).encode('utf-8')))
+    table = table.replace_schema_metadata({METADATA_KEY: info})
+    pq.write_table(table, fn, row_group_size=BLOCK_SIZE,
+                   compression=compression)
+
+def read_table(fn):
+    """
+    Read a clean OTU table written by write_table().
+
+    Returns
+    -------
+    df : pandas DataFrame
+        samples in rows, OTUs in columns, with the same values, dtype,
+        and labels as the table that was written
+    """
+    table = pq.read_table(fn, memory_map=True)
+    info = table.schema.metadata[METADATA_KEY]
+    info = json.loads(zlib.decompress(base64.b64decode(info)).decode('utf-8'))
+    columns = decode_lineages(info['taxa'], info['codes'])
+
+    values = np.zeros((len(info['samples']), len(columns)),
+                      dtype=info['dtype'])
+    smpls, otus, counts = [np.asarray(table.column(c).to_pandas())
+                           for c in ['sample', 'otu', 'count']]
+    values[smpls, otus] = counts
+    return pd.DataFrame(values, columns=columns,
+                        index=pd.Index(info['samples'],
+                                       name=info['index_name'],
+                                       dtype=object))
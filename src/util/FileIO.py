@@ -7,11 +7,16 @@ import os, sys
 import yaml
 import pandas as pd
 import feather
+from pyarrow import feather as arrow_feather
 
 # Add this repo to the path
 src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
 sys.path.insert(0, src_dir)
 from util import raw2abun
+from SummaryStats import load_summary
+from Profiling import profile, profiled
+import CleanStore
+import CompactTable
 
 def read_yaml(yamlfile, batch_data_dir):
     """
@@ -32,6 +37,7 @@ def read_yaml(yamlfile, batch_data_dir):
                                 region: <16S region>,
                                 disease_label: 'label',
                                 table_type: <'classic' or 'normal'>,
+                                table_format: <'tsv' or 'biom'>,
                                 condition: <condition_dict, if given>, ...}
     yaml file can have 'otu_table' and 'metadata_file' keys indicating full paths
         to the respective files.
@@ -46,6 +52,13 @@ def read_yaml(yamlfile, batch_data_dir):
             'normal' means that OTUs are in columns and samples are in rows
             'classic' means that OTUs are in rows and samples are in columns
         If not given, defaults to 'classic'
+
+        'biom_table' key can be given instead of 'otu_table', with the path
+        to a BIOM 2.x (HDF5) table (absolute, or relative to batch_data_dir).
+        'table_format' key indicates whether the OTU table is a
+        tab-delimited file ('tsv') or a BIOM file ('biom'). If not given, it
+        is 'biom' for OTU tables whose file names end in '.biom' and 'tsv'
+        otherwise.
     """
 
     with open(yamlfile, 'r') as f:
@@ -55,6 +68,12 @@ def read_yaml(yamlfile, batch_data_dir):
         # Grab the sub-dict with just that dataset's info
         data = datasets[dataset]
 
+        # BIOM tables are given in place of the OTU table
+        if 'biom_table' in data:
+            datasets[dataset]['otu_table'] = os.path.realpath(
+                os.path.join(batch_data_dir, data['biom_table']))
+            datasets[dataset].setdefault('table_format', 'biom')
+
         # Get OTU table file, if it's not already specified
         if 'otu_table' not in data:
             try:
@@ -109,35 +128,100 @@ def read_yaml(yamlfile, batch_data_dir):
         if 'table_type' not in data:
             datasets[dataset]['table_type'] = 'classic'
 
+        if 'table_format' not in data:
+            datasets[dataset]['table_format'] = 'biom' \
+                if data['otu_table'].endswith('.biom') else 'tsv'
+
         if 'year' not in data:
             datasets[dataset]['year'] = 'unk'
 
     return datasets
 
-def read_dataset_files(datasetid, clean_folder):
+def write_clean_table(df, fn):
     """
-    Reads the OTU table and metadata files for datasetid in clean_folder.
+    Writes a clean OTU table or metadata to a feather file. Feather files
+    don't have an index, so the sample IDs are written as the first column.
+    They are always written as strings, so that read_clean_table() gets
+    them back as they were (e.g. '0012' and not 12).
     """
-    fnotu = datasetid + '.otu_table.clean.feather'
-    fnmeta = datasetid + '.metadata.clean.feather'
+    df = df.copy(deep=False)
+    df.index = pd.Index([str(i) for i in df.index], name=df.index.name,
+                        dtype=object)
+    feather.write_dataframe(df.reset_index(), fn)
 
-    df = feather.read_dataframe(os.path.join(clean_folder, fnotu))
-    # Feather format does not support index names, first column has index
-    df.index = df.iloc[:,0]
-    df = df.iloc[:, 1:]
-
-    meta = feather.read_dataframe(os.path.join(clean_folder, fnmeta))
-    meta.index = meta.iloc[:, 0]
-    meta = meta.iloc[:, 1:]
-
-    ## Make sure sample names are strings
-    if df.index.dtype != 'O':
-        df.index = pd.read_csv(os.path.join(clean_folder, fnotu), sep='\t', dtype=str).iloc[:,0]
-
-    if meta.index.dtype != 'O':
-        meta.index = pd.read_csv(os.path.join(clean_folder, fnmeta), sep='\t', dtype=str).iloc[:,0]
+def read_clean_table(fn):
+    """
+    Reads a feather file written by write_clean_table(), with its first
+    column as the index. The file is memory-mapped, and the index column
+    is taken off before the table is converted to pandas, so the rest of
+    the table isn't copied to take it out.
+    """
+    table = arrow_feather.read_table(fn)
+    ids = table.column(0).to_pandas()
+    # Files written before the IDs were always strings can have numbers
+    if ids.dtype != 'O':
+        ids = [str(i) for i in ids]
+    df = table.remove_column(0).to_pandas()
+    df.index = pd.Index(ids, name=table.schema[0].name, dtype=object)
+    return df
+
+# Clean tables which are kept in memory by cache_clean_tables(), so that
+# read_dataset_files() doesn't re-read them.
+# {(clean_folder absolute path, datasetid): (df, meta)}
+_table_cache = {}
+
+def cache_clean_tables(datasetids, clean_folder):
+    """
+    Read the clean tables for datasetids into memory. After this, calling
+    read_dataset_files() on these datasets returns copies of the in-memory
+    tables instead of reading the files again. This is used by
+    src/analysis/pipeline.py to share the tables between analysis stages.
+    """
+    for datasetid in datasetids:
+        df, meta = read_dataset_files(datasetid, clean_folder)
+        _table_cache[(os.path.abspath(clean_folder), datasetid)] = (df, meta)
 
-    return df, meta
+def read_dataset_files(datasetid, clean_folder):
+    """
+    Reads the OTU table and metadata files for datasetid in clean_folder.
+    clean_folder can also be the directory of a consolidated store of the
+    clean datasets (see CleanStore.py). If the OTU table isn't there as a
+    feather file, its compact version is read (see CompactTable.py).
+    """
+    with profiled('read_dataset_files', datasetid) as p:
+        key = (os.path.abspath(clean_folder), datasetid)
+        if key in _table_cache:
+            df, meta = _table_cache[key]
+            p.set_shape(df)
+            return df.copy(), meta.copy()
+
+        if CleanStore.is_store(clean_folder):
+            df, meta = CleanStore.read_dataset(clean_folder, datasetid)
+            p.set_shape(df)
+            return df, meta
+
+        fnotu = datasetid + '.otu_table.clean.feather'
+        fnmeta = datasetid + '.metadata.clean.feather'
+
+        if os.path.exists(os.path.join(clean_folder, fnotu)):
+            df = read_clean_table(os.path.join(clean_folder, fnotu))
+        else:
+            df = CompactTable.read_table(
+                os.path.join(clean_folder, datasetid + CompactTable.SUFFIX))
+        meta = read_clean_table(os.path.join(clean_folder, fnmeta))
+
+        p.set_shape(df)
+        return df, meta
+
+def read_dataset_summary(datasetid, clean_folder):
+    """
+    Reads the summary statistics for datasetid in clean_folder, written by
+    clean_otu_and_metadata.py. See SummaryStats.py.
+    """
+    if CleanStore.is_store(clean_folder):
+        return load_summary(CleanStore.summary_file(clean_folder, datasetid))
+    fn = datasetid + '.summary.clean.npz'
+    return load_summary(os.path.join(clean_folder, fn))
 
 def get_classes(meta, dataset=''):
     """
@@ -235,14 +319,22 @@ def get_samples(meta, classes_list):
 
 def get_dataset_ids(clean_folder):
     """
-    Gets the list of dataset_ids present in clean_folder.
+    Gets the list of dataset_ids present in clean_folder (or in the store,
+    if clean_folder is a consolidated store).
     """
+    if CleanStore.is_store(clean_folder):
+        return CleanStore.list_datasets(clean_folder)
+
     files = os.listdir(clean_folder)
 
     datasets = list(set([i.split('.')[0] for i in files]))
 
-    return [d for d in datasets if d + '.otu_table.clean.feather' in files and d + '.metadata.clean.feather' in files]
+    return [d for d in datasets
+            if (d + '.otu_table.clean.feather' in files
+                or d + CompactTable.SUFFIX in files)
+            and d + '.metadata.clean.feather' in files]
 
+@profile
 def read_dfdict_data(datadir, subset=None):
     """
     Read in all df's, metadata, dis_smpls, H_smpls, and classes_list for all
@@ -9,6 +9,8 @@ import dendropy as dp
 import matplotlib
 import seaborn as sns
 
+from Taxonomy import TAXONOMY, taxon_name
+
 def get_dataset_order(df):
     """
     Given a list of diseases and a dataframe with 'total' sample size
@@ -158,11 +160,8 @@ def get_phylo_colors(keep_rows):
     """
     phylodf = pd.DataFrame(columns=['phylum', 'class', 'order', 'full'])
     phylodf['full'] = keep_rows
-    phylodf['phylum'] = phylodf['full'].apply(lambda x: x.split(';')[1])
-    phylodf['class'] = phylodf['full'].apply(lambda x: x.split(';')[2])
-    phylodf['order'] = phylodf['full'].apply(lambda x: x.split(';')[3])
-    phylodf['family'] = phylodf['full'].apply(lambda x: x.split(';')[4])
-    phylodf['genus'] = phylodf['full'].apply(lambda x: x.split(';')[5])
+    for level in ['phylum', 'class', 'order', 'family', 'genus']:
+        phylodf[level] = TAXONOMY.rank_names(phylodf['full'], level)
 
     ## Set1 color palette
     colors = sns.color_palette('Set1', 9)
@@ -261,7 +260,7 @@ def reorder_index_from_tree(fntree, original_index):
 
     # From the original index, extract just the genus name
     # and put into a dict - {genus: original_index_label}
-    genus2full = {i.split(';')[-1][3:]: i for i in original_index}
+    genus2full = {taxon_name(i): i for i in original_index}
 
     tree = dp.Tree.get(path=fntree, schema='newick')
     genera = [i.label for i in tree.taxon_namespace]
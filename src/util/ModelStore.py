@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Functions to save and load trained classifiers, so that they don't have to
+be re-trained when the clean data and the classifier parameters haven't
+changed.
+
+Models are stored in one directory, with one compressed file per key.
+Keys are made from the content of the data used to train the models,
+the feature set, and the classifier parameters (see model_key()), so any
+change to one of these gives a new key and the models are re-trained.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+try:
+    import joblib
+except ImportError:
+    from sklearn.externals import joblib
+
+def hash_data(X, Y=None, labels=None):
+    """
+    Hash the content of the data used to train a classifier.
+
+    Parameters
+    ----------
+    X : numpy array
+        samples in rows, features in columns
+    Y : list or numpy array, optional
+        class labels
+    labels : list of lists, optional
+        any other labels which describe the data, e.g. the sample IDs
+        and feature names
+
+    Returns
+    -------
+    data_hash : str
+        hex digest of the data
+    """
+    h = hashlib.sha1()
+    X = np.ascontiguousarray(X)
+    h.update(str(X.dtype).encode('utf-8'))
+    h.update(str(X.shape).encode('utf-8'))
+    h.update(X.tobytes())
+    if Y is not None:
+        h.update(np.ascontiguousarray(Y, dtype=np.int64).tobytes())
+    if labels is not None:
+        for l in labels:
+            h.update('\t'.join([str(i) for i in l]).encode('utf-8'))
+    return h.hexdigest()
+
+def model_key(name, data_hash, feature_set, params, **kwargs):
+    """
+    Make the key that a set of trained models is stored under.
+
+    Parameters
+    ----------
+    name : str
+        dataset ID (or other label for the models, e.g. 'pooled')
+    data_hash : str
+        hash of the training data, from hash_data()
+    feature_set : str
+        label for the features used, e.g. 'genus' or 'core'
+    params : dict
+        classifier parameters, e.g. from rf.get_params()
+    kwargs : any other parameters that the results depend on, e.g.
+        num_cv and random_state for cv_and_roc()
+
+    Returns
+    -------
+    key : str
+        '<name>.<feature_set>.<hash>'. Everything but the hash is only
+        there to make the store human-readable.
+    """
+    params = dict(params)
+    params.update(kwargs)
+    h = hashlib.sha1()
+    h.update(name.encode('utf-8'))
+    h.update(data_hash.encode('utf-8'))
+    h.update(feature_set.encode('utf-8'))
+    h.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+    return '.'.join([name, feature_set, h.hexdigest()[:16]])
+
+def split_key(key):
+    """
+    Returns the (name, feature set, hash) in a key made by model_key(), or
+    None if key isn't in that format (e.g. a file which was saved in the
+    store directory with save_model_file()).
+    """
+    parts = key.rsplit('.', 2)
+    if len(parts) != 3 or not all(parts) or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    return tuple(parts)
+
+def model_path(store_dir, key):
+    """
+    Returns the file path that models with key are stored in.
+    """
+    return os.path.join(store_dir, key + '.joblib')
+
+def has_models(store_dir, key):
+    """
+    Returns True if models with key are in store_dir.
+    """
+    return store_dir is not None and os.path.isfile(model_path(store_dir, key))
+
+def stored_keys(store_dir):
+    """
+    Returns the keys of all models in store_dir, from oldest to newest.
+    """
+    if store_dir is None or not os.path.isdir(store_dir):
+        return []
+    fns = [f for f in os.listdir(store_dir) if f.endswith('.joblib')]
+    fns = sorted(fns,
+                 key=lambda f: os.path.getmtime(os.path.join(store_dir, f)))
+    return [f[:-len('.joblib')] for f in fns]
+
+def save_models(store_dir, key, record, compress=3):
+    """
+    Save trained models and associated information to store_dir.
+
+    Parameters
+    ----------
+    store_dir : str
+        path to model store directory. Made if it doesn't exist.
+    key : str
+        key from model_key()
+    record : dict
+        anything pickle-able. By convention, cross-validated models are
+        stored as {'models': [rf for each fold], 'test_fold': array,
+        'features': list of feature names, ...}, and single models as
+        {'model': rf, 'features': list of feature names, ...}
+    compress : int
+        joblib compression level (0-9)
+    """
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    save_model_file(model_path(store_dir, key), record, compress=compress)
+
+def load_models(store_dir, key):
+    """
+    Load the record saved with save_models(). Returns None if there
+    are no models with key in store_dir.
+    """
+    if not has_models(store_dir, key):
+        return None
+    return load_model_file(model_path(store_dir, key))
+
+def save_model_file(fn, record, compress=3):
+    """
+    Save a record with trained models to the file fn, outside of
+    any model store (e.g. the pooled classifier used to score new samples).
+    See save_models() for the record format.
+    """
+    out_dir = os.path.dirname(fn)
+    if out_dir and not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    # Write to a temporary file first, so that an interrupted run doesn't
+    # leave a truncated file behind
+    joblib.dump(record, fn + '.tmp', compress=compress)
+    os.rename(fn + '.tmp', fn)
+
+def load_model_file(fn):
+    """
+    Load the record saved with save_model_file().
+    """
+    return joblib.load(fn)
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+"""
+Opt-in timing and memory instrumentation for the data and analysis
+scripts.
+
+Instrumentation is turned on by setting the PROFILE_REPORT environment
+variable to the path of a report file, e.g.
+
+    PROFILE_REPORT=data/profile_report.jsonl make all
+
+Every instrumented stage then appends one JSON record to that file when it
+finishes, with keys:
+    'script': name of the script that was running
+    'stage': 'script' for the whole script, 'dataset' for one pass of a
+        script's loop over datasets, or the name of an instrumented function
+    'dataset': dataset being processed (or null)
+    'wall': wall-clock time, in seconds
+    'cpu': user + system CPU time of the process, in seconds
+    'peak_rss': peak resident memory of the process at the end of the
+        stage, in MB
+    'rss_increase': how much the stage raised the process' peak resident
+        memory, in MB
+    'rows', 'cols': shape of the table the stage processed (or null)
+    'pid', 'start': process ID and start time (seconds since the epoch)
+
+Since records are appended, a report collects all of the scripts run by
+make (or by src/analysis/pipeline.py). To print a summary table of a
+report (and write it next to the report, as a tab-delimited file):
+
+    python src/util/Profiling.py data/profile_report.jsonl
+
+When PROFILE_REPORT isn't set, the instrumented functions are called
+directly and nothing is recorded.
+"""
+import os, sys
+import json
+import time
+import atexit
+import resource
+import functools
+import argparse
+
+import pandas as pd
+
+REPORT = os.environ.get('PROFILE_REPORT')
+ENABLED = bool(REPORT)
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT = 1024.0**2 if sys.platform == 'darwin' else 1024.0
+
+def _script_name():
+    return os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] \
+        else 'python'
+
+def peak_rss():
+    """
+    Returns the peak resident memory of this process so far, in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/_RSS_UNIT
+
+def reset_peak_rss():
+    """
+    Reset this process' peak resident memory to its current resident memory,
+    so that peak_rss() measures the peak from now on. This only works on
+    Linux; returns whether it worked.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+def cpu_time():
+    """
+    Returns the user + system CPU time of this process so far, in seconds.
+    """
+    t = os.times()
+    return t[0] + t[1]
+
+def table_shape(*objs):
+    """
+    Returns (rows, cols) of the first 2-D table (DataFrame, array, or
+    sparse matrix) in objs, looking inside tuples and lists. Returns
+    (None, None) if there isn't one.
+    """
+    for obj in objs:
+        if isinstance(obj, (tuple, list)):
+            shape = table_shape(*obj)
+            if shape[0] is not None:
+                return shape
+            continue
+        shape = getattr(obj, 'shape', None)
+        if shape is not None and len(shape) == 2:
+            return int(shape[0]), int(shape[1])
+    return None, None
+
+class Stage(object):
+    """
+    One instrumented stage, which is recorded when it's finished.
+    """
+    def __init__(self, stage, dataset=None):
+        self.stage = stage
+        self.dataset = dataset
+        self.rows = None
+        self.cols = None
+        self.pid = os.getpid()
+        self.start = time.time()
+        self._cpu = cpu_time()
+        self._rss = peak_rss()
+
+    def set_shape(self, *objs):
+        """
+        Record the shape of the first table in objs as the shape that this
+        stage processed, if it doesn't have one yet.
+        """
+        if self.rows is None:
+            self.rows, self.cols = table_shape(*objs)
+
+    def finish(self):
+        # Stages started before a fork are only recorded by the process
+        # which started them
+        if os.getpid() != self.pid:
+            return None
+        rss = peak_rss()
+        record = {'script': _script_name(),
+                  'stage': self.stage,
+                  'dataset': self.dataset,
+                  'wall': time.time() - self.start,
+                  'cpu': cpu_time() - self._cpu,
+                  'peak_rss': rss,
+                  'rss_increase': rss - self._rss,
+                  'rows': self.rows,
+                  'cols': self.cols,
+                  'pid': self.pid,
+                  'start': self.start}
+        write_record(record)
+        return record
+
+def write_record(record):
+    """
+    Append record to the report, as one line of JSON.
+    """
+    # One write per record, so that records from processes running at the
+    # same time don't get mixed up
+    with open(REPORT, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+class _NullStage(object):
+    """
+    Stand-in for Stage when instrumentation is off.
+    """
+    def set_shape(self, *objs):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+# Stage of the current pass through a script's loop over datasets, from
+# profile_dataset()
+_dataset_stage = None
+# Stages which have started but not finished, from profiled()
+_open_stages = []
+
+class profiled(object):
+    """
+    Context manager which records the block inside it as a stage, e.g.
+
+        with profiled('collapse', dataset) as p:
+            df = collapse_taxonomic_contents_df(df, 'genus')
+            p.set_shape(df)
+
+    If dataset is None, the dataset of the stage this one is inside of (or
+    of the current profile_dataset() pass) is used.
+    """
+    def __init__(self, stage, dataset=None):
+        self.stage = stage
+        self.dataset = dataset
+
+    def __enter__(self):
+        if not ENABLED:
+            return _NULL_STAGE
+        dataset = self.dataset
+        if dataset is None and len(_open_stages) > 0:
+            dataset = _open_stages[-1].dataset
+        if dataset is None and _dataset_stage is not None:
+            dataset = _dataset_stage.dataset
+        self._stage = Stage(self.stage, dataset)
+        _open_stages.append(self._stage)
+        return self._stage
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if ENABLED:
+            _open_stages.remove(self._stage)
+            self._stage.finish()
+            # The tables a dataset pass processes are the ones its stages do
+            if _dataset_stage is not None and _dataset_stage.rows is None:
+                _dataset_stage.rows = self._stage.rows
+                _dataset_stage.cols = self._stage.cols
+        return False
+
+def profile(func):
+    """
+    Decorator which records each call to func as a stage named after it.
+    The rows and columns processed are the shape of the first table in
+    func's arguments (or in what it returns, if none of its arguments are
+    tables).
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+        with profiled(func.__name__) as p:
+            p.set_shape(*args)
+            result = func(*args, **kwargs)
+            p.set_shape(result)
+        return result
+    return wrapper
+
+def profile_dataset(dataset):
+    """
+    Call at the top of each pass of a script's loop over datasets. Records
+    the previous pass (if any) as a 'dataset' stage, and starts timing this
+    one. The last pass is recorded by finish_dataset(), which is also
+    called when the script exits.
+    """
+    global _dataset_stage
+    if not ENABLED:
+        return
+    finish_dataset()
+    _dataset_stage = Stage('dataset', dataset)
+
+def finish_dataset():
+    """
+    Record the current profile_dataset() pass, if there is one.
+    """
+    global _dataset_stage
+    if _dataset_stage is not None:
+        _dataset_stage.finish()
+        _dataset_stage = None
+
+# Stage of the whole script, from profile_script()
+_script_stage = None
+
+def profile_script():
+    """
+    Call once at the start of a script to record the whole script as a
+    'script' stage when it exits (or when finish_script() is called).
+    """
+    global _script_stage
+    if not ENABLED:
+        return
+    finish_script()
+    _script_stage = Stage('script')
+    atexit.register(finish_script)
+
+def finish_script():
+    """
+    Record the current profile_dataset() pass and profile_script() stage,
+    if there are any. Processes which don't exit normally (e.g. the
+    multiprocessing children that src/analysis/pipeline.py runs scripts in)
+    need to call this themselves.
+    """
+    global _script_stage
+    finish_dataset()
+    if _script_stage is not None:
+        _script_stage.finish()
+        _script_stage = None
+
+def read_report(fn):
+    """
+    Read a report into a DataFrame with one row per record.
+    """
+    with open(fn, 'r') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return pd.DataFrame(records, columns=['script', 'stage', 'dataset',
+                                          'wall', 'cpu', 'peak_rss',
+                                          'rss_increase', 'rows', 'cols',
+                                          'pid', 'start'])
+
+def summarize(report, by=['script', 'stage'], since=None):
+    """
+    Summarize a report (from read_report()) by the given columns.
+
+    Returns
+    -------
+    summary : pandas DataFrame
+        number of calls and datasets, total and maximum wall time, total
+        CPU time, the largest peak resident memory and increase in it, and
+        the largest number of rows and columns processed for each group,
+        sorted by total wall time.
+    """
+    if since is not None:
+        report = report[report['start'] >= since]
+    grouped = report.groupby(by)
+    summary = pd.DataFrame({
+        'calls': grouped.size(),
+        'datasets': grouped['dataset'].nunique(),
+        'wall': grouped['wall'].sum(),
+        'max_wall': grouped['wall'].max(),
+        'cpu': grouped['cpu'].sum(),
+        'peak_rss': grouped['peak_rss'].max(),
+        'rss_increase': grouped['rss_increase'].max(),
+        'max_rows': grouped['rows'].max(),
+        'max_cols': grouped['cols'].max()},
+        columns=['calls', 'datasets', 'wall', 'max_wall', 'cpu',
+                 'peak_rss', 'rss_increase', 'max_rows', 'max_cols'])
+    return summary.sort_values('wall', ascending=False)
+
+def print_summary(fn, by=['script', 'stage'], since=None):
+    """
+    Print the summary table of the report in fn, and write it to
+    fn (without its extension) + '.summary.txt'. If since is given, only
+    stages which started after since (in seconds since the epoch) are
+    summarized.
+    """
+    summary = summarize(read_report(fn), by, since)
+    with pd.option_context('display.width', 200,
+                           'display.max_rows', None,
+                           'display.max_columns', None,
+                           'display.float_format', '{:.2f}'.format):
+        print(summary)
+    summary.to_csv(os.path.splitext(fn)[0] + '.summary.txt', sep='\t',
+                   float_format='%.3f')
+    return summary
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument('report', help='report file written when the '
+                   + 'PROFILE_REPORT environment variable is set',
+                   nargs='?', default=REPORT)
+    p.add_argument('--by', help='columns to summarize by (comma-separated, '
+                   + 'from script, stage, and dataset) [default: %(default)s]',
+                   default='script,stage')
+    args = p.parse_args()
+    if args.report is None:
+        p.error('no report file given, and PROFILE_REPORT is not set')
+
+    print_summary(args.report, args.by.split(','))
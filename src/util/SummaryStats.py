@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Functions to make, save, merge, and query per-dataset summary statistics
+of the clean OTU tables.
+
+A summary has, for each genus and each patient group (i.e. each
+DiseaseState label), the number of samples, the sum of the genus' relative
+abundance, and the number of samples it's present in. It also has the read
+depth of each sample (one number per sample, so that read depth medians
+are exact). Because all of these are sums (or lists) over samples,
+summaries of different datasets (or groups) are combined by adding them up.
+
+Group means and ubiquities are exact, so ubiquity_abundance.py,
+dataset_info.py, and the mean log-fold changes in logfold_effect.py are
+calculated from the summaries. Medians of the abundances aren't in the
+summaries: the median log-fold changes and get_qvalues.py's signs (which
+are done alongside its tests, on the same arrays) still use the OTU tables.
+
+Summaries are dicts of numpy arrays:
+    {'genera': array of genus names,
+     'groups': array of DiseaseState labels,
+     'n_samples': (n_groups, ),
+     'sum': (n_groups, n_genera) float,
+     'present': (n_groups, n_genera) int,
+     'reads': (n_samples, ) read depth of each sample,
+     'reads_groups': (n_samples, ) int, index in 'groups' of each sample}
+"""
+import numpy as np
+import pandas as pd
+
+# Add this repo to the path
+import os, sys
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
+sys.path.insert(0, src_dir)
+from util import raw2abun, collapse_taxonomic_contents_df
+from Profiling import profile
+
+# Arrays which are per genus
+GENUS_KEYS = ['sum', 'present']
+
+@profile
+def summarize_dataset(df, meta, level='genus'):
+    """
+    Make the summary of one clean dataset.
+
+    Parameters
+    ----------
+    df : pandas DataFrame
+        raw counts, samples in rows and OTUs in columns (as in the clean
+        OTU tables)
+    meta : pandas DataFrame
+        metadata with samples in rows and 'DiseaseState' column. Samples
+        without a DiseaseState are in group 'nan'.
+    level : str
+        taxonomic level to collapse to
+
+    Returns
+    -------
+    summary : dict
+        see the module docstring
+    """
+    reads = df.sum(axis=1).values
+    abun = collapse_taxonomic_contents_df(raw2abun(df), level)
+    X = abun.values
+
+    labels = meta['DiseaseState'].reindex(abun.index).fillna('nan')
+    codes, groups = pd.factorize(labels.astype(str))
+    n_groups = len(groups)
+    # (n_samples x n_groups) indicator matrix, so that sums for all
+    # groups are a single matrix product
+    G = np.zeros((X.shape[0], n_groups))
+    G[np.arange(X.shape[0]), codes] = 1
+
+    summary = {'genera': np.array(abun.columns, dtype=np.unicode_),
+               'groups': np.array(groups, dtype=np.unicode_),
+               'n_samples': G.sum(axis=0).astype(int),
+               'sum': G.T.dot(X),
+               'present': G.T.dot(X != 0).astype(int)}
+
+    ## Read depths, in the same order as the table's samples
+    summary['reads'] = reads
+    summary['reads_groups'] = codes
+    return summary
+
+def save_summary(fn, summary):
+    """
+    Save summary to a compressed .npz file.
+    """
+    np.savez_compressed(fn, **summary)
+
+def load_summary(fn):
+    """
+    Load a summary saved with save_summary().
+    """
+    with np.load(fn) as f:
+        return {k: f[k] for k in f.files}
+
+def merge_summaries(summaries):
+    """
+    Combine the summaries of several datasets into one summary. Groups with
+    the same label are pooled, and genera which aren't in a dataset
+    count as not present in any of its samples.
+    """
+    genera = sorted(set().union(*[s['genera'] for s in summaries]))
+    groups = sorted(set().union(*[s['groups'] for s in summaries]))
+    gen_idx = {g: i for i, g in enumerate(genera)}
+    grp_idx = {g: i for i, g in enumerate(groups)}
+
+    merged = {'genera': np.array(genera, dtype=np.unicode_),
+              'groups': np.array(groups, dtype=np.unicode_)}
+    for k in GENUS_KEYS:
+        merged[k] = np.zeros((len(groups), len(genera)),
+                             dtype=summaries[0][k].dtype)
+    merged['n_samples'] = np.zeros(len(groups), dtype=int)
+
+    reads_groups = []
+    for s in summaries:
+        gr = np.array([grp_idx[g] for g in s['groups']], dtype=int)
+        ge = np.array([gen_idx[g] for g in s['genera']], dtype=int)
+        for k in GENUS_KEYS:
+            merged[k][np.ix_(gr, ge)] += s[k]
+        merged['n_samples'][gr] += s['n_samples']
+        reads_groups.append(gr[s['reads_groups']])
+    merged['reads'] = np.concatenate([s['reads'] for s in summaries])
+    merged['reads_groups'] = np.concatenate(reads_groups)
+    return merged
+
+def pool_groups(summary, groups):
+    """
+    Pool the given groups of a summary together (e.g. all of the control
+    labels from FileIO.get_classes()).
+
+    Returns
+    -------
+    stats : dict
+        same keys as a summary (without 'groups' and 'reads_groups'), but
+        with the group dimension summed over, and only the read depths of
+        the samples in groups. Groups which aren't in the summary are
+        ignored.
+    """
+    keep = np.in1d(summary['groups'], groups)
+    stats = {'genera': summary['genera']}
+    for k in GENUS_KEYS + ['n_samples']:
+        stats[k] = summary[k][keep].sum(axis=0)
+    stats['reads'] = summary['reads'][keep[summary['reads_groups']]]
+    return stats
+
+def genus_mean(stats):
+    """
+    Returns the mean relative abundance of each genus in pooled stats.
+    """
+    return pd.Series(stats['sum']/float(stats['n_samples']),
+                     index=stats['genera'])
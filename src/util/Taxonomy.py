@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+Integer-coded taxonomy index.
+
+Taxonomies in the OTU tables and results files are semicolon-delimited
+strings like 'k__Bacteria;p__Verrucomicrobia;...;g__Akkermansia', and
+a taxon at a given rank is the lineage truncated at that rank (as in
+util.collapse_taxonomic_contents_df). Instead of splitting these strings
+over and over, TaxonomyIndex splits each lineage once and gives each taxon
+an integer ID at its rank, with a pointer to its parent taxon. Collapsing,
+joining, and looking up names are then integer operations, and the strings
+are only put back together for output.
+
+TAXONOMY is the index shared by all tables in a process, so the same taxon
+has the same ID in every dataset.
+"""
+import numpy as np
+from scipy import sparse
+
+RANKS = ['kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
+
+class TaxonomyIndex(object):
+    """
+    Interns taxonomy strings. IDs are given to taxa at each rank in the
+    order they're first seen, and don't change once given.
+    """
+    def __init__(self):
+        # For each rank: ID -> taxon string, taxon string -> ID,
+        # ID -> ID of the parent taxon (at the rank above),
+        # ID -> whether the taxon is annotated (doesn't end in '__'), and
+        # ID -> the taxon's own label (e.g. 'g__Akkermansia')
+        self.taxa = [[] for _ in RANKS]
+        self.ids = [{} for _ in RANKS]
+        self.parents = [[] for _ in RANKS]
+        self.annotated = [[] for _ in RANKS]
+        self.labels = [[] for _ in RANKS]
+        # Lineage string -> tuple with its taxon ID at each rank
+        self.lineages = {}
+
+    def _intern(self, rank, taxon, parent):
+        try:
+            return self.ids[rank][taxon]
+        except KeyError:
+            i = len(self.taxa[rank])
+            self.ids[rank][taxon] = i
+            self.taxa[rank].append(taxon)
+            self.parents[rank].append(parent)
+            self.annotated[rank].append(not taxon.endswith('__'))
+            self.labels[rank].append(taxon.rsplit(';', 1)[-1])
+            return i
+
+    def encode(self, lineage):
+        """
+        Returns a tuple with the taxon ID at each rank in RANKS for lineage.
+        As in util.collapse_taxonomic_contents_df, a lineage which is
+        shorter than a rank is its own taxon at that rank.
+        """
+        try:
+            return self.lineages[lineage]
+        except KeyError:
+            pass
+        parts = lineage.split(';')
+        codes = []
+        parent = -1
+        for rank in range(len(RANKS)):
+            parent = self._intern(rank, ';'.join(parts[:rank + 1]), parent)
+            codes.append(parent)
+        codes = tuple(codes)
+        self.lineages[lineage] = codes
+        return codes
+
+    def codes(self, lineages, level='genus'):
+        """
+        Returns the taxon ID at the given level of each lineage, as a numpy
+        array. Lineages which are unannotated at that level (i.e. whose
+        taxon ends in '__') are -1, like the OTUs that
+        util.collapse_taxonomic_contents_df() discards.
+        """
+        rank = RANKS.index(level)
+        annotated = self.annotated[rank]
+        codes = np.empty(len(lineages), dtype=int)
+        for i, lineage in enumerate(lineages):
+            c = self.encode(lineage)[rank]
+            codes[i] = c if annotated[c] else -1
+        return codes
+
+    def ancestors(self, codes, level, to_level):
+        """
+        Returns the IDs at to_level of the taxa with the given IDs at level.
+        to_level should be above (or the same as) level.
+        """
+        codes = np.asarray(codes, dtype=int)
+        rank = RANKS.index(level)
+        for r in range(rank, RANKS.index(to_level), -1):
+            parents = np.asarray(self.parents[r], dtype=int)
+            codes = np.where(codes >= 0, parents[codes], -1)
+        return codes
+
+    def decode(self, codes, level='genus'):
+        """
+        Returns the taxon strings of the IDs at the given level.
+        """
+        taxa = self.taxa[RANKS.index(level)]
+        return [taxa[c] for c in codes]
+
+    def names(self, codes, level='genus', prefix=False):
+        """
+        Returns just the names of the taxa with the given IDs, without
+        their lineage (e.g. 'g__Akkermansia'), and without their rank prefix
+        unless prefix is True (e.g. 'Akkermansia').
+        """
+        labels = self.labels[RANKS.index(level)]
+        if prefix:
+            return [labels[c] for c in codes]
+        return [labels[c][3:] for c in codes]
+
+    def rank_names(self, lineages, level, prefix=True):
+        """
+        Returns the name of each lineage's taxon at level, e.g.
+        'p__Firmicutes' for level='phylum'.
+        """
+        rank = RANKS.index(level)
+        return self.names([self.encode(l)[rank] for l in lineages], level,
+                          prefix=prefix)
+
+    def collapse_matrix(self, lineages, level='genus'):
+        """
+        Make the matrix which sums OTUs into the taxa at level.
+
+        Parameters
+        ----------
+        lineages : list of str
+            taxonomy of each OTU
+        level : str
+            rank to collapse to
+
+        Returns
+        -------
+        M : scipy sparse matrix, shape = [n_otus, n_taxa]
+            1 where the OTU is in the taxon. Multiplying an OTU table (with
+            OTUs in columns) by M gives the collapsed table.
+        taxa : numpy array
+            taxon ID of each column in M, in the order they're first seen
+            in lineages. Unannotated OTUs aren't in any column.
+        """
+        codes = self.codes(lineages, level)
+        keep = np.flatnonzero(codes >= 0)
+        taxa, first = np.unique(codes[keep], return_index=True)
+        taxa = taxa[np.argsort(first)]
+        col = np.empty(len(self.taxa[RANKS.index(level)]), dtype=int)
+        col[taxa] = np.arange(len(taxa))
+        M = sparse.csr_matrix((np.ones(len(keep)), (keep, col[codes[keep]])),
+                              shape=(len(lineages), len(taxa)))
+        return M, taxa
+
+TAXONOMY = TaxonomyIndex()
+
+# Taxon strings -> label of their last taxon, for results whose index may
+# not be full lineages (e.g. 'f__Verrucomicrobiaceae;g__Akkermansia')
+_labels = {}
+
+def taxon_name(taxon, prefix=False):
+    """
+    Returns the name of the last taxon in a semicolon-delimited taxonomy,
+    without its rank prefix unless prefix is True (e.g. 'Akkermansia' or
+    'g__Akkermansia' for '...;g__Akkermansia').
+    """
+    try:
+        label = _labels[taxon]
+    except KeyError:
+        label = taxon.rsplit(';', 1)[-1]
+        _labels[taxon] = label
+    return label if prefix else label[3:]
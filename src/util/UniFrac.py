@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+"""
+Functions to calculate weighted and unweighted UniFrac distances between
+genus-level abundance tables on a genus-level tree (e.g. the phyloT tree in
+data/tree/, whose tips are labeled with genus names).
+
+The tree is read once and flattened into arrays, with nodes in postorder.
+Each sample's abundance on every branch (i.e. the total abundance of
+the genera below it) is then calculated for all samples at once, with one
+sparse matrix product. With those, both UniFrac distances are weighted sums
+over branches, which are calculated in blocks of samples by
+BetaDiversity.blocked_distances().
+"""
+from functools import partial
+import numpy as np
+from scipy import sparse
+from scipy.spatial.distance import cdist
+import dendropy as dp
+
+# Add this repo to the path
+import os, sys
+src_dir = os.path.normpath(os.path.join(os.getcwd(), 'src/util'))
+sys.path.insert(0, src_dir)
+from BetaDiversity import blocked_distances
+from Taxonomy import taxon_name
+
+def read_tree(fntree, default_length=1.0):
+    """
+    Read a newick tree and flatten it into arrays.
+
+    Parameters
+    ----------
+    fntree : str
+        newick tree file, with tips labeled by genus name
+    default_length : float
+        length of branches which don't have one. The phyloT tree doesn't
+        have any branch lengths, so by default every branch has length 1.
+
+    Returns
+    -------
+    tree : dict
+        {'parent': array with the index of each node's parent (-1 for root),
+         'length': array with the length of the branch above each node
+                   (0 for the root),
+         'tips': {genus name: node index}}
+        Nodes are in postorder, so every node comes after all of its
+        descendants.
+    """
+    dptree = dp.Tree.get(path=fntree, schema='newick',
+                         preserve_underscores=True)
+    nodes = list(dptree.postorder_node_iter())
+    index = {n: i for i, n in enumerate(nodes)}
+
+    parent = np.array([index[n.parent_node] if n.parent_node is not None
+                       else -1 for n in nodes])
+    length = np.array([n.edge.length if n.edge.length is not None
+                       else default_length for n in nodes], dtype=float)
+    length[parent == -1] = 0.0
+    tips = {n.taxon.label: index[n] for n in nodes if n.is_leaf()}
+    return {'parent': parent, 'length': length, 'tips': tips}
+
+def tip_to_node_matrix(tree, genera):
+    """
+    Returns the sparse (n_genera x n_nodes) matrix with a 1 for each node
+    that is the genus' tip or one of its ancestors. Multiplying an abundance
+    table by this matrix gives the abundance of each node (i.e. on the
+    branch above each node).
+    """
+    parent = tree['parent']
+    rows = []
+    cols = []
+    for g, genus in enumerate(genera):
+        node = tree['tips'][genus]
+        while node != -1:
+            rows.append(g)
+            cols.append(node)
+            node = parent[node]
+    return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                             shape=(len(genera), len(parent)))
+
+def match_tree_genera(columns, tree):
+    """
+    Returns the position of the columns whose genus is in the tree, and
+    the corresponding genus names. Columns are full taxonomies (e.g.
+    'k__Bacteria;...;g__Akkermansia'), as in the collapsed OTU tables.
+
+    Genera which are missing from the tree are printed the first time
+    they're seen with this tree (they're remembered in tree['missing']),
+    rather than for every table and metric.
+    """
+    genera = [taxon_name(c) for c in columns]
+    keep = [i for i, g in enumerate(genera) if g in tree['tips']]
+    warned = tree.setdefault('missing', set())
+    missing = [g for g in genera if g not in tree['tips'] and g not in warned]
+    if len(missing) > 0:
+        print('The following genera are missing from your tree, and are '
+              'not included in UniFrac:')
+        print('\n'.join(missing))
+        warned.update(missing)
+    return keep, [genera[i] for i in keep]
+
+def samples_without_tree_genera(X):
+    """
+    Returns the position of the samples (rows in X, with the genera in the
+    tree in columns) which don't have any reads in the tree's genera.
+    Their UniFrac distances are NaN.
+    """
+    return np.flatnonzero(~(np.asarray(X).sum(axis=1) > 0))
+
+def node_abundances(X, genera, tree):
+    """
+    Calculate the relative abundance of every node in the tree.
+
+    Parameters
+    ----------
+    X : numpy array
+        samples in rows, genera in columns
+    genera : list
+        genus name of each column in X. All should be tips in tree.
+    tree : dict
+        from read_tree()
+
+    Returns
+    -------
+    P : numpy array
+        samples in rows, nodes in columns (in postorder). Each sample's
+        abundances are first normalized to sum to 1 over the genera in the
+        tree. Rows are NaN for samples without any abundance in the tree
+        (see samples_without_tree_genera()).
+    """
+    X = np.asarray(X, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        X = X / X.sum(axis=1)[:, np.newaxis]
+    M = tip_to_node_matrix(tree, genera)
+    return np.asarray(M.T.dot(X.T).T)
+
+def _unweighted_unifrac_block(A, B, length):
+    """
+    Unweighted UniFrac between samples in A and B, which have the
+    presence/absence of each branch in columns: the length of branches
+    in only one of the two samples over the length of branches in either.
+    """
+    A = A.astype(float)
+    B = B.astype(float)
+    shared = (A*length).dot(B.T)
+    either = A.dot(length)[:, np.newaxis] + B.dot(length)[np.newaxis, :] \
+             - shared
+    with np.errstate(invalid='ignore', divide='ignore'):
+        D = (either - shared) / either
+    D[either == 0] = 0.0
+    return D
+
+def unifrac(X, genera, tree, out_file, weighted=True, block_size=1024,
+            n_jobs=None):
+    """
+    Calculate the UniFrac distance between all pairs of samples.
+
+    Weighted UniFrac is the (non-normalized) sum over branches of the
+    branch length times the difference in relative abundance below the
+    branch. Unweighted UniFrac is the fraction of the branch length
+    present in either sample which is only present in one of them.
+    Distances to samples without any abundance in the tree's genera are
+    NaN.
+
+    Parameters
+    ----------
+    X : numpy array
+        samples in rows, genera in columns (e.g. relative abundances)
+    genera : list
+        genus name of each column in X. All should be tips in tree.
+    tree : dict
+        from read_tree()
+    out_file : str
+        .npy file to write the condensed distance matrix to
+    weighted : bool
+        whether to calculate weighted (True) or unweighted (False) UniFrac
+    block_size, n_jobs : int
+        see BetaDiversity.blocked_distances()
+
+    Returns
+    -------
+    dists : numpy memmap
+        the condensed distance matrix, opened read-only
+    """
+    P = node_abundances(X, genera, tree)
+    # The root doesn't have a branch above it
+    on_branch = tree['length'] > 0
+    P = P[:, on_branch]
+    length = tree['length'][on_branch]
+
+    if weighted:
+        # sum(l*|p - q|) is the cityblock distance between l*p and l*q
+        return blocked_distances(P*length, partial(cdist, metric='cityblock'),
+                                 out_file, block_size=block_size,
+                                 n_jobs=n_jobs)
+    else:
+        # Keep samples without any abundance in the tree NaN, like in the
+        # weighted distances
+        with np.errstate(invalid='ignore'):
+            presence = (P > 0).astype(float)
+        presence[np.isnan(P[:, 0])] = np.nan
+        return blocked_distances(presence, partial(_unweighted_unifrac_block,
+                                                   length=length),
+                                 out_file, block_size=block_size,
+                                 n_jobs=n_jobs)
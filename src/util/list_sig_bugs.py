@@ -7,6 +7,8 @@ import argparse
 import pandas as pd
 import numpy as np
 
+from Taxonomy import taxon_name
+
 p = argparse.ArgumentParser()
 p.add_argument('qvalues', help='file with signed qvalues')
 p.add_argument('dataset', help='dataset ID, as in qvalues file columns')
@@ -23,9 +25,9 @@ sigmap = lambda x: dirs[np.sign(x)] if abs(x) < qthresh and abs(x) > 0 \
 
 sig = qvals[args.dataset].apply(sigmap)
 
-healthy = [i.split(';')[-1][3:] for i in
+healthy = [taxon_name(i) for i in
     sig[sig.astype(str) == 'healthy'].index]
-disease = [i.split(';')[-1][3:] for i in
+disease = [taxon_name(i) for i in
     sig[sig.astype(str) == 'disease'].index]
 
 print('\nhealthy')
@@ -5,6 +5,8 @@ Useful functions to be used through data processing and analysis code.
 """
 
 import copy
+import time
+import multiprocessing
 import pandas as pd
 import numpy as np
 
@@ -17,9 +19,12 @@ from statsmodels.sandbox.stats.multicomp import multipletests
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import auc, roc_curve, confusion_matrix, cohen_kappa_score, make_scorer
 from sklearn.cross_validation import StratifiedKFold
-from scipy import interp
 from scipy.stats import fisher_exact
 
+from Taxonomy import TAXONOMY
+from Profiling import profile
+
+@profile
 def raw2abun(df):
     """
     Converts OTU table with counts to relative abundances.
@@ -36,6 +41,7 @@ def raw2abun(df):
     """
     return df.divide(df.sum(axis=1), axis=0)
 
+@profile
 def collapse_taxonomic_contents_df(OTU_table, taxonomic_level):
     """
     Collapses OTU table to given taxonomic level by string-matching.
@@ -62,39 +68,26 @@ def collapse_taxonomic_contents_df(OTU_table, taxonomic_level):
         Values corresponding to unannotated taxa are discarded.
     """
 
-    OTU_IDs = list(OTU_table.columns)
-
-    # Collapse to the right level
-    if(taxonomic_level == "kingdom"):
-        OTU_taxa = [OTU_ID.split(';')[0] for OTU_ID in OTU_IDs]
-    if(taxonomic_level == "phylum"):
-        OTU_taxa = [';'.join(OTU_ID.split(';')[:2]) for OTU_ID in OTU_IDs]
-    if(taxonomic_level == "class"):
-        OTU_taxa = [';'.join(OTU_ID.split(';')[:3]) for OTU_ID in OTU_IDs]
-    if(taxonomic_level == "order"):
-        OTU_taxa = [';'.join(OTU_ID.split(';')[:4]) for OTU_ID in OTU_IDs]
-    if(taxonomic_level == "family"):
-        OTU_taxa = [';'.join(OTU_ID.split(';')[:5]) for OTU_ID in OTU_IDs]
-    if(taxonomic_level == "genus"):
-        OTU_taxa = [';'.join(OTU_ID.split(';')[:6]) for OTU_ID in OTU_IDs]
-    if(taxonomic_level == "species"):
-        OTU_taxa = [';'.join(OTU_ID.split(';')[:7]) for OTU_ID in OTU_IDs]
-
-    # Get indices of each unique taxon
-    taxa_indices = {}
-    for i in range(len(OTU_taxa)):
-        if (OTU_taxa[i] not in taxa_indices) and (OTU_taxa[i][(len(OTU_taxa[i])-2):] != "__"):
-            taxa_indices[OTU_taxa[i]] = []
-        if (OTU_taxa[i][(len(OTU_taxa[i])-2):] != "__"):
-            taxa_indices[OTU_taxa[i]].append(i)
-    # Make new empty df with the same samples as original df and taxa in taxa_indices.keys()
-    newdf = pd.DataFrame(index=OTU_table.index, columns=taxa_indices.keys(), data=0)
-
-    # Get sample contents for each taxa of the chosen level and put into newdf
-    for key in taxa_indices:
-        indices = taxa_indices[key]
-        newcol = OTU_table.iloc[:, indices].sum(axis=1)
-        newdf[key] = copy.copy(newcol)
+    # Each OTU's taxon ID at this level, from the index shared by all tables
+    M, taxa = TAXONOMY.collapse_matrix(list(OTU_table.columns), taxonomic_level)
+    values = OTU_table.values
+    if values.dtype.kind in 'iu':
+        M = M.astype(values.dtype)
+    # NaN values are skipped in the sums (counted as 0), as in pandas' sum()
+    if values.dtype.kind == 'f' and np.isnan(values).any():
+        values = np.where(np.isnan(values), 0, values)
+    newvalues = np.asarray(M.T.dot(values.T).T)
+
+    # Put the columns in the same order as before this used integer IDs
+    # (i.e. a dict keyed by taxon), so that results files stay the same
+    names = TAXONOMY.decode(taxa, taxonomic_level)
+    order = {}
+    for i, name in enumerate(names):
+        order[name] = i
+    columns = list(order.keys())
+
+    newdf = pd.DataFrame(index=OTU_table.index, columns=columns,
+                         data=newvalues[:, [order[c] for c in columns]])
 
     return newdf
 
@@ -115,6 +108,37 @@ def compare_otus_teststat(df, Xsmpls, Ysmpls, method='kruskal-wallis', multi_com
     -------
     results        dataframe with OTUs in rows and 'p' and 'test-stat' in columns
 
+    """
+    return compare_groups_teststat(group_array(df, Xsmpls),
+                                   group_array(df, Ysmpls), df.columns,
+                                   method=method, multi_comp=multi_comp)
+
+def group_array(df, smpls):
+    """
+    Returns the rows of df for the samples in smpls as a column-major
+    (Fortran-ordered) numpy array, so that each OTU's values are contiguous.
+    Slice each group once with this and share the array between
+    compare_groups_teststat() and effect_from_arrays().
+    """
+    return np.asfortranarray(df.loc[smpls].values)
+
+@profile
+def compare_groups_teststat(X, Y, columns, method='kruskal-wallis', multi_comp=None):
+    """
+    Same as compare_otus_teststat(), but with each group already sliced
+    into an array (e.g. by group_array()).
+
+    parameters
+    ----------
+    X, Y           arrays, samples in rows and OTUs in columns
+    columns        OTU names, for the index of results
+    method         statistical method to use for comparison
+    multi_comp     str, type of multiple comparison test to do.
+                   Currently accepts 'fdr' or None
+
+    outputs
+    -------
+    results        dataframe with OTUs in rows and 'p' and 'test-stat' in columns
     """
     if method == 'kruskal-wallis':
         pfun = kruskalwallis
@@ -124,21 +148,94 @@ def compare_otus_teststat(df, Xsmpls, Ysmpls, method='kruskal-wallis', multi_com
         pfun = mannwhitneyu
         # Note: prob wanna add some kwargs here to say whether 2sided or not
 
-    results = pd.DataFrame(index=df.columns, columns=['test-stat', 'p'])
-    for o in df.columns:
+    ps = np.empty(len(columns), dtype=object)
+    hs = np.empty(len(columns), dtype=object)
+    for i in range(len(columns)):
         try:
-            h, p = pfun(df.loc[Xsmpls, o], df.loc[Ysmpls, o])
+            h, p = pfun(X[:, i], Y[:, i])
         except:
             p = 1
             h = 0
-        results.loc[o, 'p'] = p
-        results.loc[o, 'test-stat'] = h
+        ps[i] = p
+        hs[i] = h
+
+    results = pd.DataFrame(index=columns, columns=['test-stat', 'p'])
+    results['test-stat'] = hs
+    results['p'] = ps
 
     if multi_comp == 'fdr':
         _, results['q'], _, _ = multipletests(results['p'], method='fdr_bh')
 
     return results
 
+def group_centers(X, method='mean'):
+    """
+    Returns the mean or median of every column in array X.
+    """
+    if method == 'mean':
+        return X.mean(axis=0)
+    elif method == 'median':
+        return np.median(X, axis=0)
+    else:
+        raise ValueError('Unrecognized method to compare values')
+
+@profile
+def effect_from_arrays(dis, H, method='mean', logfun=None, pseudocount=0):
+    """
+    Same as effect_size(), but with each group already sliced into an
+    array (e.g. by group_array()). Returns a numpy array.
+    """
+    return effect_from_centers(group_centers(dis, method),
+                               group_centers(H, method), logfun=logfun,
+                               pseudocount=pseudocount)
+
+def effect_from_centers(dis, h, logfun=None, pseudocount=0):
+    """
+    Same as effect_size(), but from each group's mean or median of every
+    genus (e.g. from the summary statistics). Returns a numpy array.
+    """
+    if logfun is None:
+        return dis - h
+
+    dis = dis + pseudocount
+    h = h + pseudocount
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vals = logfun(dis/h)
+    vals[(dis == 0) & (h == 0)] = 0.0
+    return vals
+
+def effect_size(df, dis_smpls, H_smpls, method='mean', logfun=None,
+                pseudocount=0):
+    """
+    Calculate the effect of disease on every column in df at once.
+
+    Parameters
+    ----------
+    df : pandas DataFrame
+        samples in rows, genera in columns
+    dis_smpls, H_smpls : lists
+        lists of samples to compare
+    method : str
+        'mean' or 'median'
+    logfun : function
+        np.log2 or np.log10, to return the log-fold change. If None,
+        returns the difference between groups instead.
+    pseudocount : float
+        added to both groups' mean/median before taking the log-fold change
+
+    Returns
+    -------
+    effect : pandas Series
+        genera in index. With logfun, this is
+        logfun((dis + pseudocount)/(H + pseudocount)): 0 if both are 0,
+        np.inf if only H is 0, and -np.inf if only dis is 0.
+        Otherwise, it's dis - H.
+    """
+    return pd.Series(effect_from_arrays(df.loc[dis_smpls].values,
+                                        df.loc[H_smpls].values, method=method,
+                                        logfun=logfun, pseudocount=pseudocount),
+                     index=df.columns)
+
 def prep_classifier(df, H_smpls, dis_smpls, random_state):
     """
     Prepares a classifier given a dataframe and list of samples for each
@@ -177,7 +274,9 @@ def prep_classifier(df, H_smpls, dis_smpls, random_state):
     Y = [1 if i in dis_smpls else 0 for i in all_smpls]
     return rf, X, Y
 
-def cv_and_roc(rf, X, Y, num_cv=5, random_state=None):
+@profile
+def cv_and_roc(rf, X, Y, num_cv=5, random_state=None, timing=False,
+               keep_models=False):
     """
     Perform cross validated training and testing and return the aggregate
     interpolated ROC curve and confusion matrices.
@@ -195,6 +294,12 @@ def cv_and_roc(rf, X, Y, num_cv=5, random_state=None):
         number of cross-validation folds
     random_state : int (default 12345)
         random state seed for StratifiedKFold
+    timing : bool (default: False)
+        whether to time the fit, inference, and metrics steps in each fold.
+        If True, prints a summary and adds a 'timing' key to the results.
+    keep_models : bool (default: False)
+        whether to return a copy of the classifier trained in each fold,
+        e.g. to save them with ModelStore.save_models()
 
     Returns
     -------
@@ -209,43 +314,143 @@ def cv_and_roc(rf, X, Y, num_cv=5, random_state=None):
         'y_probs': probability of being class 1
         'y_trues': true labels
         'mean_fpr', 'mean_tpr': interpolated values used to build ROC curve
+        'timing': only if timing is True. dict with 'fit' and 'inference'
+            (arrays of seconds per fold) and 'metrics' (total seconds spent
+            on the ROC curves and confusion matrix across all folds)
+        'models': only if keep_models is True. list with the trained
+            classifier for each fold, in the order of 'test_fold'
 
     """
     if isinstance(Y, list):
         Y = np.asarray(Y)
     cv = StratifiedKFold(Y, num_cv, shuffle=True, random_state=random_state)
-    mean_tpr = 0.0
-    mean_fpr = np.linspace(0, 1, 100)
-    conf_mat = np.asarray([[0,0],[0,0]])
     y_probs = np.empty_like(Y, dtype=float)
     y_trues = np.empty_like(Y)
     y_preds = np.empty_like(Y)
     cv_count = 0
     cv_counts = np.empty_like(Y)
+    times = {'fit': [], 'inference': []}
+    models = []
 
     for train_index, test_index in cv:
         X_train, X_test = X[train_index], X[test_index]
         Y_train, Y_test = Y[train_index], Y[test_index]
-        probs = rf.fit(X_train, Y_train).predict_proba(X_test)[:,1]
 
-        # Store probability and true Y for later
-        y_probs[test_index] = probs
+        t0 = time.time()
+        rf.fit(X_train, Y_train)
+        t1 = time.time()
+        # Derive the predictions from the probabilities rather than calling
+        # rf.predict(), which would walk all of the trees a second time.
+        # This is exactly what predict() does internally.
+        probas = rf.predict_proba(X_test)
+        y_pred = rf.classes_.take(np.argmax(probas, axis=1), axis=0)
+        t2 = time.time()
+
+        # Store probability, prediction, and true Y for later
+        y_probs[test_index] = probas[:, 1]
         y_trues[test_index] = Y_test # literally redundant, but keep it to maintain backward compatibility
-        y_pred = rf.predict(X_test)
         y_preds[test_index] = y_pred
-        # Compute ROC curve and area under the curve
-        fpr, tpr, thresholds = roc_curve(Y_test, probs)
-        mean_tpr += interp(mean_fpr, fpr, tpr)
-        # Compute confusion matrix
-        conf_mat += confusion_matrix(Y_test, y_pred, labels=[0,1])
 
         # Track which fold each sample was tested in
         cv_counts[test_index] = cv_count
         cv_count += 1
 
-    mean_tpr /= len(cv)
+        times['fit'].append(t1 - t0)
+        times['inference'].append(t2 - t1)
+        if keep_models:
+            models.append(copy.deepcopy(rf))
+
+    t0 = time.time()
+    results = cv_metrics(y_trues, y_probs, y_preds, cv_counts)
+    times['metrics'] = time.time() - t0
+
+    if timing:
+        times['fit'] = np.asarray(times['fit'])
+        times['inference'] = np.asarray(times['inference'])
+        total = sum(np.sum(times[k]) for k in times)
+        print('cv_and_roc timing ({} folds, {:.2f} s): '.format(cv_count, total)
+              + ', '.join(['{} {:.2f} s ({:.0f}%)'.format(
+                              k, np.sum(times[k]),
+                              100*np.sum(times[k])/total if total else 0)
+                           for k in ['fit', 'inference', 'metrics']]))
+        results['timing'] = times
+    if keep_models:
+        results['models'] = models
+
+    return results
+
+def interp_curves(x, xp, fp):
+    """
+    Interpolate several curves onto the same points at once. Gives exactly
+    the same values as calling np.interp(x, xp[i], fp[i]) for each row i.
+
+    Parameters
+    ----------
+    x : numpy array, shape = [n_points]
+        points to interpolate at
+    xp, fp : numpy arrays, shape = [n_curves, n_max]
+        x (non-decreasing) and y values of each curve. Curves with fewer
+        than n_max values are padded with their last value.
+
+    Returns
+    -------
+    y : numpy array, shape = [n_curves, n_points]
+    """
+    n_max = xp.shape[1]
+    rows = np.arange(xp.shape[0])[:, np.newaxis]
+    # Last value of each curve which is <= each point, as np.interp finds
+    j = (xp[:, np.newaxis, :] <= x[np.newaxis, :, np.newaxis]).sum(axis=2) - 1
+    past_end = j >= n_max - 1
+    j = np.clip(j, 0, n_max - 2)
+    x0, x1 = xp[rows, j], xp[rows, j + 1]
+    y0, y1 = fp[rows, j], fp[rows, j + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (y1 - y0)/(x1 - x0)
+        y = slope*(x - x0) + y0
+        # np.interp's fallbacks for non-finite slopes
+        y = np.where(np.isnan(y), slope*(x - x1) + y1, y)
+    y = np.where(np.isnan(y) & (y0 == y1), y0, y)
+    y = np.where(x == x0, y0, y)
+    y = np.where(x < xp[:, :1], fp[:, :1], y)
+    return np.where(past_end, fp[:, -1:], y)
+
+def cv_metrics(y_trues, y_probs, y_preds, test_fold):
+    """
+    Aggregate the out-of-fold predictions from cross-validation into the
+    interpolated ROC curve and confusion matrix.
+
+    Parameters
+    ----------
+    y_trues, y_probs, y_preds : numpy arrays
+        true label, probability of being class 1, and predicted label
+        for each sample
+    test_fold : numpy array
+        fold that each sample was tested in, numbered from 0
+
+    Returns
+    -------
+    d : dict
+        same keys as cv_and_roc() (without 'timing' and 'models')
+    """
+    mean_fpr = np.linspace(0, 1, 100)
+    n_folds = test_fold.max() + 1
+    curves = []
+    for i in range(n_folds):
+        fold = test_fold == i
+        fpr, tpr, thresholds = roc_curve(y_trues[fold], y_probs[fold])
+        curves.append((fpr, tpr))
+    ## All folds' ROC curves are interpolated onto mean_fpr at once
+    n_max = max([len(fpr) for fpr, _ in curves])
+    pad = lambda v: np.concatenate([v, np.repeat(v[-1:], n_max - len(v))])
+    fold_tprs = interp_curves(mean_fpr,
+                              np.vstack([pad(fpr) for fpr, _ in curves]),
+                              np.vstack([pad(tpr) for _, tpr in curves]))
+    mean_tpr = fold_tprs.sum(axis=0) / n_folds
     roc_auc = auc(mean_fpr, mean_tpr)
 
+    # Summing each fold's confusion matrix is the same as building
+    # one over all of the out-of-fold predictions
+    conf_mat = confusion_matrix(y_trues, y_preds, labels=[0,1])
     _, fisher_p = fisher_exact(conf_mat)
 
     return {i: j for i, j in
@@ -253,7 +458,159 @@ def cv_and_roc(rf, X, Y, num_cv=5, random_state=None):
                 'fisher_p', 'y_prob', 'y_true', 'test_fold',
                 'y_preds'),
                (roc_auc, conf_mat, mean_fpr, mean_tpr, fisher_p,
-               y_probs, y_trues, cv_counts, y_preds))}
+               y_probs, y_trues, test_fold, y_preds))}
+
+def rescore_cv(models, X, Y, test_fold):
+    """
+    Re-score cross-validation results from already-trained classifiers,
+    without re-training them.
+
+    Parameters
+    ----------
+    models : list
+        trained classifier for each fold, as in cv_and_roc()['models']
+    X : array-like, shape = [n_samples, n_features]
+        the same samples and features that the models were evaluated on
+    Y : list or array
+        true labels
+    test_fold : numpy array
+        fold that each sample was tested in, as in
+        cv_and_roc()['test_fold']
+
+    Returns
+    -------
+    d : dict
+        same keys as cv_and_roc() (without 'timing' and 'models')
+    """
+    if isinstance(Y, list):
+        Y = np.asarray(Y)
+    y_probs = np.empty_like(Y, dtype=float)
+    y_preds = np.empty_like(Y)
+    for i, rf in enumerate(models):
+        test_index = np.flatnonzero(test_fold == i)
+        probas = rf.predict_proba(X[test_index])
+        y_probs[test_index] = probas[:, 1]
+        y_preds[test_index] = rf.classes_.take(np.argmax(probas, axis=1),
+                                               axis=0)
+    return cv_metrics(Y.copy(), y_probs, y_preds, test_fold)
+
+def group_codes(labels):
+    """
+    Convert a list of group labels into integer codes.
+
+    Parameters
+    ----------
+    labels : list or array-like
+        one group label per sample (e.g. the dataset each sample comes from)
+
+    Returns
+    -------
+    codes : numpy array
+        integer code for each sample's group, in the same order as labels
+    uniques : numpy array
+        group labels, such that uniques[codes] == labels
+    """
+    codes, uniques = pd.factorize(np.asarray(labels))
+    return codes, np.asarray(uniques)
+
+def codes_in(codes, uniques, keep):
+    """
+    Returns a boolean mask of the samples whose group label is kept.
+
+    Parameters
+    ----------
+    codes, uniques : numpy arrays
+        as returned by group_codes()
+    keep : function
+        called on each unique group label (*not* on each sample). Should
+        return True if the samples in that group should be in the mask.
+
+    Returns
+    -------
+    mask : numpy array of bools, same length as codes
+    """
+    keep_codes = [c for c, label in enumerate(uniques) if keep(label)]
+    return np.in1d(codes, keep_codes)
+
+# Data shared with the holdout worker processes. These are set once per
+# worker (instead of being pickled with every task) by _init_holdout_worker.
+_holdout_X = None
+_holdout_Y = None
+
+def _init_holdout_worker(X, Y):
+    global _holdout_X, _holdout_Y
+    _holdout_X = X
+    _holdout_Y = Y
+
+def _run_one_holdout(task):
+    """
+    Train a classifier on one group's training samples and return the
+    probability of being class 1 for its test samples.
+
+    task is a (train_index, test_index, random_state, keep_model) tuple,
+    where the indices are rows in _holdout_X and _holdout_Y. If keep_model
+    is True, returns (probs, rf) instead of just probs.
+    """
+    train_index, test_index, random_state, keep_model = task
+    rf = RandomForestClassifier(n_estimators=1000, random_state=random_state)
+    rf.fit(_holdout_X[train_index], _holdout_Y[train_index])
+    probs = rf.predict_proba(_holdout_X[test_index])[:, 1]
+    if keep_model:
+        return probs, rf
+    return probs
+
+@profile
+def holdout_probs(X, Y, splits, random_state, n_jobs=None, keep_models=False):
+    """
+    Train and test one classifier per held-out group, in parallel.
+
+    Parameters
+    ----------
+    X : numpy array
+        samples in rows, features in columns. Contains all of the samples
+        in any of the splits.
+    Y : numpy array
+        class label (0 or 1) for each row in X
+    splits : list of (train_index, test_index) tuples
+        integer row indices into X for each held-out group. Rows are used
+        in the order given, so the classifiers are identical to ones built
+        with prep_classifier() on the samples in the same order.
+    random_state : int
+        classifier seed, used for every classifier
+    n_jobs : int (default: None)
+        number of processes. If None, uses all of the available CPUs.
+        If 1, runs serially in this process.
+    keep_models : bool (default: False)
+        whether to also return the trained classifiers
+
+    Returns
+    -------
+    probs : list of numpy arrays
+        probability of being class 1 for each sample in each split's
+        test_index, in the same order as splits
+    models : list of RandomForestClassifiers
+        only returned if keep_models is True. Trained classifier for each
+        split, in the same order as splits.
+    """
+    if len(splits) == 0:
+        return ([], []) if keep_models else []
+
+    tasks = [(train_index, test_index, random_state, keep_models)
+             for train_index, test_index in splits]
+    if n_jobs == 1:
+        _init_holdout_worker(X, Y)
+        results = [_run_one_holdout(t) for t in tasks]
+    else:
+        pool = multiprocessing.Pool(n_jobs, initializer=_init_holdout_worker,
+                                    initargs=(X, Y))
+        results = pool.map(_run_one_holdout, tasks)
+        pool.close()
+        pool.join()
+
+    if keep_models:
+        probs, models = zip(*results)
+        return list(probs), list(models)
+    return results
 
 def shuffle_col(col):
     """
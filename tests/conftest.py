@@ -0,0 +1,10 @@
+"""
+The modules in src/ find each other relative to the working directory, so
+the tests are run from the top directory of this repo.
+"""
+import os, sys
+
+repo_dir = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+os.chdir(repo_dir)
+for d in ['src/util', 'src/analysis', 'src/data']:
+    sys.path.insert(0, os.path.join(repo_dir, d))
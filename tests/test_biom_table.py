@@ -0,0 +1,39 @@
+import numpy as np
+import h5py
+from scipy import sparse
+
+import BiomTable
+
+def write_biom(fn, X, smpls, otus):
+    """
+    Write the samples x OTUs counts in X as a minimal BIOM 2.x file.
+    """
+    X = sparse.csr_matrix(X)
+    with h5py.File(fn, 'w') as f:
+        f['sample/ids'] = np.array(smpls, dtype='S')
+        f['observation/ids'] = np.array(otus, dtype='S')
+        f['sample/matrix/data'] = X.data.astype(float)
+        f['sample/matrix/indices'] = X.indices
+        f['sample/matrix/indptr'] = X.indptr
+
+def test_sample_runs():
+    assert BiomTable.sample_runs([]) == []
+    assert BiomTable.sample_runs([0, 1, 2, 5, 7, 8]) == [(0, 3), (5, 6),
+                                                         (7, 9)]
+
+def test_read_interleaved_samples(tmpdir):
+    rng = np.random.RandomState(0)
+    X = rng.randint(0, 3, (50, 8))
+    smpls = ['s{}'.format(i) for i in range(50)]
+    otus = ['otu{}'.format(i) for i in range(8)]
+    fn = str(tmpdir.join('table.biom'))
+    write_biom(fn, X, smpls, otus)
+
+    # Every third sample, plus a run of consecutive ones
+    rows = sorted(set(range(0, 50, 3)) | set(range(20, 26)))
+    Y, read_smpls, read_otus = BiomTable.read_table(
+        fn, [smpls[i] for i in rows], chunk_size=7)
+    assert read_smpls == [smpls[i] for i in rows]
+    assert read_otus == otus
+    assert Y.dtype.kind == 'i'
+    assert np.array_equal(Y.toarray(), X[rows])
@@ -0,0 +1,11 @@
+import ModelStore as ms
+
+def test_split_key():
+    key = ms.model_key('cdi_schubert', 'abc', 'genus', {'n_estimators': 1000})
+    name, feature_set, h = ms.split_key(key)
+    assert (name, feature_set) == ('cdi_schubert', 'genus')
+    assert key.endswith(h)
+
+def test_split_key_other_files():
+    assert ms.split_key('pooled_healthy_disease') is None
+    assert ms.split_key('pooled.healthy.disease') is None
@@ -0,0 +1,63 @@
+import pytest
+
+import pipeline
+
+def test_default_stages_select():
+    stages, upstream = pipeline.select_stages(pipeline.make_stages(),
+                                              pipeline.DEFAULT_STAGES)
+    names = [s['name'] for s in stages]
+    assert 'dataset_info' in names
+    assert 'qvalues' in names
+    # The data group's clean_data expands to the cleaning stages
+    cleaning = [s['name'] for s in pipeline.clean_stages()]
+    assert set(cleaning) <= set(names)
+
+def test_clean_data_in_group():
+    stages = [pipeline.stage('clean_a', 'clean.py', [], ['a.feather']),
+              pipeline.stage('clean_b', 'clean.py', [], ['b.feather']),
+              pipeline.stage('dataset_info', 'info.py', [], ['info.txt'],
+                             [pipeline.CLEAN])]
+    selected, upstream = pipeline.select_stages(stages, ['data'])
+    assert [s['name'] for s in selected] == ['clean_a', 'clean_b',
+                                             'dataset_info']
+    assert upstream['dataset_info'] == ['clean_a', 'clean_b']
+
+def test_unknown_stage():
+    with pytest.raises(ValueError):
+        pipeline.select_stages(pipeline.make_stages(), ['not_a_stage'])
+
+def test_output_globs(tmpdir):
+    s = pipeline.stage('beta', 'beta.py', [],
+                       [str(tmpdir.join('pooled.npy')),
+                        str(tmpdir.join('*.npy'))])
+    manifest = {'files': {}, 'stages': {}}
+    hashes = pipeline.output_hashes(s, manifest)
+    # Nothing written yet
+    assert None in hashes.values()
+
+    for name in ['pooled', 'a', 'b']:
+        tmpdir.join(name + '.npy').write(name)
+    hashes = pipeline.output_hashes(s, manifest)
+    assert None not in hashes.values()
+    assert sorted(hashes) == sorted([str(tmpdir.join(n + '.npy'))
+                                     for n in ['pooled', 'a', 'b']])
+
+    # Deleting one of the per-dataset files changes the outputs
+    tmpdir.join('a.npy').remove()
+    assert pipeline.output_hashes(s, manifest) != hashes
+
+def test_clean_inputs_have_summaries(tmpdir, monkeypatch):
+    monkeypatch.setattr(pipeline, 'clean_dir', str(tmpdir))
+    for fn in ['a.otu_table.clean.feather', 'a.summary.clean.npz']:
+        tmpdir.join(fn).write('x')
+    tmpdir.join('script.py').write('')
+    s = pipeline.stage('ubiquity', str(tmpdir.join('script.py')), [], [],
+                       [pipeline.CLEAN])
+    assert str(tmpdir.join('a.summary.clean.npz')) in pipeline.input_files(s)
+
+def test_multi_output_stages():
+    stages = dict((s['name'], s) for s in pipeline.make_stages())
+    assert pipeline.pooled_model in stages['rf_h_v_dis']['outputs']
+    beta = stages['beta']['outputs']
+    assert pipeline.beta_dir + '/pooled.braycurtis.npy' in beta
+    assert pipeline.beta_dir + '/*.unweighted_unifrac.npy' in beta
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+import SummaryStats as ss
+
+def make_dataset(labels, seed):
+    rng = np.random.RandomState(seed)
+    otus = ['k__Bacteria;p__P;c__C;o__O;f__F;g__G{};s__;d__{}'.format(i % 3, i)
+            for i in range(6)]
+    smpls = ['s{}_{}'.format(seed, i) for i in range(len(labels))]
+    df = pd.DataFrame(rng.randint(0, 50, (len(labels), len(otus))),
+                      index=smpls, columns=otus)
+    meta = pd.DataFrame({'DiseaseState': labels}, index=smpls)
+    return df, meta
+
+def test_pool_groups_reads():
+    df, meta = make_dataset(['H', 'CDI', 'H', 'nonCDI', 'CDI'], 0)
+    summary = ss.summarize_dataset(df, meta)
+    stats = ss.pool_groups(summary, ['H', 'CDI'])
+    smpls = meta.index[meta['DiseaseState'].isin(['H', 'CDI'])]
+    assert stats['n_samples'] == len(smpls)
+    assert sorted(stats['reads']) == sorted(df.loc[smpls].sum(axis=1))
+
+def test_merge_summaries():
+    df1, meta1 = make_dataset(['H', 'CRC', 'H'], 1)
+    df2, meta2 = make_dataset(['CRC', 'H', 'CRC', 'CRC'], 2)
+    merged = ss.merge_summaries([ss.summarize_dataset(df1, meta1),
+                                 ss.summarize_dataset(df2, meta2)])
+    stats = ss.pool_groups(merged, ['CRC'])
+    crc = pd.concat([df1[(meta1['DiseaseState'] == 'CRC').values],
+                     df2[(meta2['DiseaseState'] == 'CRC').values]])
+    assert stats['n_samples'] == crc.shape[0]
+    assert sorted(stats['reads']) == sorted(crc.sum(axis=1))
+    assert stats['present'].sum() > 0
+
+def test_genus_mean():
+    df, meta = make_dataset(['H', 'CDI', 'H', 'nonCDI', 'CDI'], 3)
+    stats = ss.pool_groups(ss.summarize_dataset(df, meta), ['H', 'nonCDI'])
+    abun = ss.collapse_taxonomic_contents_df(ss.raw2abun(df), 'genus')
+    smpls = meta.index[meta['DiseaseState'].isin(['H', 'nonCDI'])]
+    expected = abun.loc[smpls].mean()
+    assert np.allclose(ss.genus_mean(stats)[expected.index], expected)
@@ -0,0 +1,33 @@
+import numpy as np
+
+import UniFrac
+
+COLUMNS = ['k__B;p__P;c__C;o__O;f__F;g__' + g for g in ['A', 'B', 'C', 'X']]
+
+def make_tree(tmpdir):
+    fn = tmpdir.join('tree.newick')
+    fn.write('((A,B),C);\n')
+    return UniFrac.read_tree(str(fn))
+
+def test_missing_genera_printed_once(tmpdir, capsys):
+    tree = make_tree(tmpdir)
+    keep, genera = UniFrac.match_tree_genera(COLUMNS, tree)
+    assert keep == [0, 1, 2]
+    assert genera == ['A', 'B', 'C']
+    assert 'X' in capsys.readouterr()[0]
+    UniFrac.match_tree_genera(COLUMNS, tree)
+    assert capsys.readouterr()[0] == ''
+
+def test_samples_without_tree_genera(tmpdir):
+    tree = make_tree(tmpdir)
+    X = np.array([[1.0, 0.0, 1.0],
+                  [0.0, 0.0, 0.0],
+                  [0.0, 2.0, 0.0]])
+    assert UniFrac.samples_without_tree_genera(X).tolist() == [1]
+    for weighted in [True, False]:
+        fnout = str(tmpdir.join('{}.npy'.format(weighted)))
+        D = np.array(UniFrac.unifrac(X, ['A', 'B', 'C'], tree, fnout,
+                                     weighted=weighted, n_jobs=1))
+        # Condensed order: (0, 1), (0, 2), (1, 2)
+        assert np.isnan(D[0]) and np.isnan(D[2])
+        assert D[1] > 0
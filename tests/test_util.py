@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from sklearn.metrics import roc_curve
+from util import collapse_taxonomic_contents_df, interp_curves
+
+LINEAGE = 'k__B;p__P;c__C;o__O;f__F;g__'
+OTUS = [LINEAGE + g + ';s__;d__' + str(i) for i, g in
+        enumerate(['B', 'A', '', 'B', 'Roseburia', 'Akkermansia', 'C'])]
+
+def test_collapse_genus():
+    df = pd.DataFrame([range(7), range(7, 14)], columns=OTUS,
+                      index=['s1', 's2'])
+    genus = collapse_taxonomic_contents_df(df, 'genus')
+    # Taxa in the same order as the original (dict-keyed) implementation,
+    # without unannotated ones
+    assert list(genus.columns) == [LINEAGE + g for g in
+                                   ['Roseburia', 'Akkermansia', 'B', 'C',
+                                    'A']]
+    assert genus.values.tolist() == [[4, 5, 3, 6, 1], [11, 12, 17, 13, 8]]
+
+def test_collapse_skips_nan():
+    df = pd.DataFrame([[1.0, np.nan, 3.0, np.nan, 1.0, 1.0, 1.0],
+                       [np.nan, 5.0, 6.0, np.nan, 1.0, 1.0, 1.0]],
+                      columns=OTUS)
+    genus = collapse_taxonomic_contents_df(df, 'genus')
+    assert genus[LINEAGE + 'B'].tolist() == [1.0, 0.0]
+    assert genus[LINEAGE + 'A'].tolist() == [0.0, 5.0]
+
+def test_interp_curves_matches_interp():
+    rng = np.random.RandomState(0)
+    x = np.linspace(0, 1, 100)
+    curves = []
+    for n in [10, 25, 40]:
+        # Rounded probabilities, so that the ROC curves have ties
+        y_true = rng.randint(0, 2, n)
+        curves.append(roc_curve(y_true, rng.rand(n).round(1))[:2])
+    n_max = max([len(fpr) for fpr, _ in curves])
+    pad = lambda v: np.concatenate([v, np.repeat(v[-1:], n_max - len(v))])
+    y = interp_curves(x, np.vstack([pad(c[0]) for c in curves]),
+                      np.vstack([pad(c[1]) for c in curves]))
+    for i, (fpr, tpr) in enumerate(curves):
+        assert np.array_equal(y[i], np.interp(x, fpr, tpr))